@@ -29,4 +29,5 @@ def clean_local(state, location, delete_all):
 @dispatch.register("clean", "server")
 def clean_cluster(state, location, delete_all):
     state.console.rule(f'Cleaning cluster -- {location}')
-    cluster.clean_up_cluster(location, state)
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        cluster.clean_up_cluster(location, state)
@@ -0,0 +1,30 @@
+import typer
+
+from .. import state
+from .. import dispatch
+from ..computation import manager, cluster, cluster_resubmit
+
+
+def resubmit(
+    ctx: typer.Context,
+    location: str = typer.Option(..., help=state.help_texts["location"]),
+    time_factor: float = typer.Option(1.0, help="Multiply the slurm time of the resubmitted jobs by this"),
+    memory_factor: float = typer.Option(1.0, help="Multiply the slurm memory of the resubmitted jobs by this"),
+    runs: bool = typer.Option(True, help="Also resubmit configs whose synced sacred run failed"),
+    sbatch: bool = typer.Option(
+        True, help="If true will automatically call sbatch to run files on cluster"
+    ),
+):
+    state = ctx.obj
+    experiment_config = state.experiment_config
+
+    fn = manager.get_dispatched_fn('resubmit', location, experiment_config)
+
+    fn(state, location, time_factor, memory_factor, runs, sbatch)
+
+
+@dispatch.register("resubmit", "cluster")
+def resubmit_cluster(state, location, time_factor, memory_factor, runs, sbatch):
+    state.console.rule(f'Resubmitting failed configs to cluster -- {location}')
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        cluster_resubmit.resubmit(state, location, time_factor, memory_factor, runs, sbatch)
@@ -1,4 +1,5 @@
 import typer
+import itertools
 from typing import List
 
 from .. import dispatch
@@ -24,7 +25,15 @@ def run(
     ),
     ignore: List[str] = typer.Option([], help="List of file to not get configs from."),
     limit: int = typer.Option(None, help="Limit number of runs"),
-    docker_image: str = typer.Option(None, help="Optional docker image")
+    lazy: bool = typer.Option(False, help="Lazily enumerate and filter configs, only loading those required (for very large sweeps)"),
+    docker_image: str = typer.Option(None, help="Optional docker image"),
+    reuse_containers: bool = typer.Option(False, help="Start one container per docker image and docker exec every experiment into it"),
+    jobs: int = typer.Option(1, help="Number of experiments to run at the same time"),
+    memory_budget: str = typer.Option(None, help="Maximum memory (i.e 48G) used by experiments running at the same time, defaults to all of the machine"),
+    batch_size: int = typer.Option(1, help="Number of configs of a model file to run in a single process (local)"),
+    warm_workers: int = typer.Option(0, help="Run experiments on this many worker processes that import each model file once (local)"),
+    recycle_after: int = typer.Option(100, help="Replace a warm worker after this many runs"),
+    worker_max_memory: str = typer.Option(None, help="Replace a warm worker once its peak memory (i.e 4G) is larger than this, defaults to twice its memory after the first run")
 ):
     
     state = ctx.obj
@@ -47,18 +56,36 @@ def run(
         "force_all": force_all,
         "run_sbatch": sbatch,
         "check_cluster": check,
+        "jobs": jobs,
+        "memory_budget": memory_budget,
+        "batch_size": batch_size,
+        "reuse_containers": reuse_containers,
+        "warm_workers": warm_workers,
+        "recycle_after": recycle_after,
+        "worker_max_memory": worker_max_memory,
     }
 
-    # load all experiment configs 
-    configs_to_run = manager.get_configs_from_model_files(state, ignore_files=ignore)
+    if lazy:
+        # configs are only constructed as they are filtered, and we stop as soon as limit configs have been found
+        configs_to_run = manager.iter_configs_from_model_files(state, ignore_files=ignore)
+        configs_to_run = manager.iter_filter_configs(state, configs_to_run, filter_dict, new_only)
 
+        if limit is not None:
+            state.console.print(f'Limiting to {limit} experiments')
+            configs_to_run = itertools.islice(configs_to_run, limit)
 
-    # remove configs that do not match filter
-    configs_to_run = manager.filter_configs(state, configs_to_run, filter_dict, new_only)
+        configs_to_run = list(configs_to_run)
+    else:
+        # load all experiment configs 
+        configs_to_run = manager.get_configs_from_model_files(state, ignore_files=ignore)
+
+
+        # remove configs that do not match filter
+        configs_to_run = manager.filter_configs(state, configs_to_run, filter_dict, new_only)
 
-    if limit is not None:
-        state.console.print(f'Limiting to {limit} experiments')
-        configs_to_run = configs_to_run[:limit]
+        if limit is not None:
+            state.console.print(f'Limiting to {limit} experiments')
+            configs_to_run = configs_to_run[:limit]
 
     if len(configs_to_run) == 0:
         state.console.print('[bold red]No configs found to run! -- Exiting![/]')
@@ -96,10 +123,12 @@ def docker_run(state, configs_to_run, run_settings, location, docker_image = Non
 @dispatch.register("run", "cluster")
 def cluster_run(state, configs_to_run, run_settings, location):
     state.console.rule(f'Running on cluster {location}')
-    cluster.cluster_run(state, configs_to_run, run_settings, location)
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        cluster.cluster_run(state, configs_to_run, run_settings, location)
 
 
 @dispatch.register("run", "server")
 def server_run(state, configs_to_run, run_settings, location):
     state.console.rule('Running on server')
-    server.server_run(state, configs_to_run, run_settings, location)
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        server.server_run(state, configs_to_run, run_settings, location)
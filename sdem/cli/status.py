@@ -0,0 +1,34 @@
+import typer
+
+from .. import state
+from .. import dispatch
+from ..computation import manager, cluster, cluster_status, server
+
+
+def status(
+    ctx: typer.Context,
+    location: str = typer.Option(..., help=state.help_texts["location"]),
+    watch: bool = typer.Option(True, help="Keep updating the status until every job has finished"),
+    interval: float = typer.Option(30, help="Seconds between status updates when watching"),
+    show_failed: bool = typer.Option(False, help="List every failed config"),
+):
+    state = ctx.obj
+    experiment_config = state.experiment_config
+
+    fn = manager.get_dispatched_fn('status', location, experiment_config)
+
+    fn(state, location, watch, interval, show_failed)
+
+
+@dispatch.register("status", "cluster")
+def status_cluster(state, location, watch, interval, show_failed):
+    state.console.rule(f'Status of jobs on cluster -- {location}')
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        cluster_status.cluster_status(state, location, watch, interval, show_failed)
+
+
+@dispatch.register("status", "server")
+def status_server(state, location, watch, interval, show_failed):
+    state.console.rule(f'Status of runs on server -- {location}')
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        server.server_status(state, location)
@@ -23,9 +23,11 @@ def local_sync(location):
 @dispatch.register("sync", "cluster")
 def cluster_sync(state, location):
     state.console.rule(f'Syncing with cluster -- {location}')
-    cluster.sync_with_cluster(state, location)
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        cluster.sync_with_cluster(state, location)
 
 @dispatch.register("sync", "server")
 def cluster_sync(state, location):
     state.console.rule(f'Syncing with server -- {location}')
-    cluster.sync_with_cluster(state, location)
+    with cluster.session(cluster.get_cluster_config(state.experiment_config, location)):
+        cluster.sync_with_cluster(state, location)
@@ -4,8 +4,15 @@ from .. import decorators
 from .. import template
 from .. import utils
 from . import manager
+from .resources import ResourceUsage, RESOURCE_USAGE_FILE
+from . import upload
+from . import transport
+from . import cluster_sync
+from . import cluster_status
 
 import os
+import contextlib
+import json
 
 import slurmjobs
 from slurmjobs.args import NoArgVal
@@ -19,7 +26,27 @@ DEFAULT_CLUSTER_CONFIG = {
     'jump_host': None,
     'ssh_config_file': None,
     'key': None, # ssh key
-    'sbatch': {}
+    'sbatch': {},
+    'modules': [],
+    # how files are moved to the cluster, zip, incremental or stream (see upload.py)
+    'upload': 'zip',
+    # compression of streamed uploads, none, zstd or gzip
+    'compression': 'none',
+    # submit a single slurm job array per model file instead of one job per config
+    'array_jobs': False,
+    # maximum number of array tasks running at the same time (None is no limit)
+    'array_max_concurrent': None,
+    # largest array index allowed by the cluster (MaxArraySize - 1 in slurm.conf)
+    'max_array_size': 1000,
+    # run chunks of configs in each slurm job, each chunk taking roughly pack_time_budget seconds
+    'pack_jobs': False,
+    'pack_time_budget': 3600,
+    # number of configs of a chunk that run at the same time
+    'pack_parallel': 1,
+    # runtime (seconds) of configs without a runtime key or a recorded local run
+    'default_runtime': 600,
+    # number of rsync streams used when syncing from the cluster (see cluster_sync.py)
+    'sync_workers': 4,
 }
 
 def get_cluster_config(experiment_config, location):
@@ -54,18 +81,62 @@ rm -rf cluster.zip
 rm -rf {exp_name}
 HERE"""
 
-CHECK_CLUSTER_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'bash -s' << HERE
-    squeue -u {user}
-HERE"""
-
-SYNC_SCRIPT = 'cd ../ && rsync -ra --relative --progress --compress -e \'{ssh_auth_no_remote}\' {remotehost}:{folder_dest} {folder_origin}'
 
-LOCAL_SYNC_SCRIPT = (
-    "mkdir -p {folder_origin} && rsync -ra {folder_dest} {folder_origin}"
-)
+ARRAY_SBATCH_HEADER = """#!/bin/bash
+#SBATCH --job-name={job_name}
+#SBATCH --nodes=1
+#SBATCH --cpus-per-task={ncpus}
+#SBATCH --gres=gpu:{ngpus}
+#SBATCH --array={array}
+#SBATCH --output={output}
+{sbatch_options}
+
+##### Load Modules
+{modules}
+"""
+
+ARRAY_SBATCH_SCRIPT = ARRAY_SBATCH_HEADER + """
+##### Run Command
+cd {run_dir}
+{order_id_command}
+{run_command} $ORDER_ID
+"""
+
+# every array task runs the order_ids on a line of chunk_file, parallel at a time. Finished configs are
+#   marked in done_folder so that they are skipped when the job is submitted again
+PACKED_SBATCH_SCRIPT = ARRAY_SBATCH_HEADER + """
+##### Run Command
+cd {run_dir}
+export DONE_FOLDER={done_folder}
+mkdir -p $DONE_FOLDER
+
+run_config() {{
+    if [ -e "$DONE_FOLDER/$1" ]; then
+        echo "skipping $1 -- already finished"
+        return 0
+    fi
+    {run_command} $1 && touch "$DONE_FOLDER/$1"
+}}
+export -f run_config
+
+ORDER_IDS=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {chunk_file})
+echo $ORDER_IDS | tr ' ' '\\n' | xargs -P {parallel} -I ID bash -c 'run_config ID'
+"""
+
+# array task ids are the order_ids
+ARRAY_ORDER_ID_COMMAND = "ORDER_ID=$SLURM_ARRAY_TASK_ID"
+
+# array task ids are line numbers (from 0) of the order_id file
+ARRAY_ORDER_ID_FILE_COMMAND = 'ORDER_ID=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {order_id_file})'
 
 CLUSTER_ZIP = "jobs/cluster.zip"
 
+# the order_ids run by each array task of each slurm script of a model file, see write_job_tasks
+JOB_TASKS_FILE = "tasks.json"
+
+# printed before the run script of each model file is submitted, so that job ids can be matched to scripts
+SUBMIT_MARKER = "SDEM_SUBMIT"
+
 FOLDERS_TO_SYNC = ["jobs/", "results/", "models/runs/_sources"]
 
 # ========== HELPER FUNCTIONS ========
@@ -75,32 +146,12 @@ def get_remote_host(cluster_config):
         user=cluster_config["user"], host=cluster_config["host"]
     )
 
-def get_ssh_with_auth(i = None, J = None, remotehost = None, ssh_config_file=None):
-    s_part = 'ssh '
-
-    if ssh_config_file is not None:
-        s_part += '-F "%s" ' % (ssh_config_file,)
-
-    if J is not None:
-        s_part += '-J %s ' % (J,)
-
-    if i is not None:
-        s_part += '-i %s ' % (i,)
-
-    if remotehost == None:
-        return s_part 
-    else:
-        return s_part + '"%s"' % (remotehost,) 
-
 def ssh(base_script, cluster_config, run = True, verbose=False, **kwargs):
-    i = cluster_config["key"]
-    J = cluster_config["jump_host"]
-    ssh_config_file = cluster_config["ssh_config_file"]
-    remotehost = get_remote_host(cluster_config)
+    t = transport.get_transport(cluster_config)
 
-    base_ssh_str = get_ssh_with_auth(i = i, J = J, remotehost=remotehost, ssh_config_file=ssh_config_file)
+    base_ssh_str = t.ssh_command()
 
-    base_ssh_no_remotehost = get_ssh_with_auth(i = i, J = J, remotehost=None, ssh_config_file=ssh_config_file)
+    base_ssh_no_remotehost = t.ssh_command(remote=False)
 
 
     format_dict = {'ssh_auth_no_remote': base_ssh_no_remotehost, 'ssh_auth': base_ssh_str, **kwargs}
@@ -122,17 +173,9 @@ def scp(cluster_config, localfile = None, remotefile = None,):
 
 
     """
-    i = cluster_config["key"]
-    J = cluster_config["jump_host"]
     remotehost = get_remote_host(cluster_config)
 
-    s_part = 'scp '
-
-    if J is not None:
-        s_part += '-J %s ' % (J,)
-
-    if i is not None:
-        s_part += '-i %s ' % (i,)
+    s_part = transport.get_transport(cluster_config).scp_command()
 
     s = s_part + '"%s" "%s:%s"' % (
         localfile,
@@ -143,6 +186,20 @@ def scp(cluster_config, localfile = None, remotefile = None,):
     os.system(s)
 
 
+@contextlib.contextmanager
+def session(cluster_config):
+    """
+    Share a single connection to the cluster between every ssh/scp command run inside the session. See transport.py.
+    """
+    t = transport.get_transport(cluster_config)
+    t.start()
+
+    try:
+        yield t
+    finally:
+        t.stop()
+
+
 
 
 # ========== SDEM FUNCTIONALITY FUNCTIONS ========
@@ -174,6 +231,264 @@ def check_if_experiment_exists_on_cluster(exp_name, cluster_config):
     return False
 
 
+def get_cluster_run_command(configs_of_file, cluster_config):
+    """
+    Return the command (with a {filename} placeholder) used to run a model file on the cluster.
+        A pyenv in the cluster config takes priority, then a sif file in the configs and then a sif file
+        in the cluster config.
+    """
+    # py env takes priority
+    if "pyenv" in cluster_config.keys():
+        # run using singularity
+        run_command = "source activate {pyenv} &&".format(
+            pyenv=cluster_config["pyenv"]
+        )
+        run_command = run_command + " python {filename}"
+    # assume that every config has the same sif file
+    elif "sif" in configs_of_file[0].keys():
+        # run using singularity defined in model file
+        run_command = "singularity run --nv {sif_location}".format(
+            sif_location=configs_of_file[0]["sif"]
+        )
+        run_command = run_command + " python {filename}"
+
+    elif "sif" in cluster_config.keys():
+        # run using singularity
+        run_command = "singularity run --nv {sif_location}".format(
+            sif_location=cluster_config["sif"]
+        )
+        run_command = run_command + " python {filename}"
+
+    else:
+        run_command = "python {filename}"
+
+    return run_command
+
+
+def get_sbatch_resources(cluster_config):
+    """ Return the number of cpus, gpus and the remaining sbatch options of the cluster config. """
+    sbatch_options = dict(cluster_config["sbatch"])
+
+    ncpus = sbatch_options.pop("cpus", 1)  # this is actually the number of nodes
+    ngpus = sbatch_options.pop("gpus", 0)
+
+    return ncpus, ngpus, sbatch_options
+
+
+def get_array_chunks(order_ids, max_array_size):
+    """
+    Split order_ids into (array, order_ids) chunks, one per job array. When every order_id is a valid array
+        index they are used directly, otherwise array indices are positions in the chunk's order_ids.
+    """
+    if max(order_ids) <= max_array_size:
+        return [(utils.format_order_ids(order_ids), None)]
+
+    chunks = []
+    for i in range(0, len(order_ids), max_array_size + 1):
+        chunk = order_ids[i:i + max_array_size + 1]
+        chunks.append((f"0-{len(chunk) - 1}", chunk))
+
+    return chunks
+
+
+def format_modules(cluster_config):
+    if len(cluster_config["modules"]) == 0:
+        return ""
+
+    return "module purge\n" + "\n".join(f"module load {m}" for m in cluster_config["modules"])
+
+
+def format_sbatch_options(sbatch_options):
+    return "\n".join(
+        f"#SBATCH --{key.replace('_', '-')}={val}" for key, val in sbatch_options.items()
+    )
+
+
+def create_slurm_array_scripts(_file, configs_of_file, run_command, experiment_name, cluster_config, ncpus, ngpus, sbatch_options):
+    """
+    Creates a slurm job array script for the configs of _file, so that all of them are submitted with a single
+        sbatch call. If the order_ids are larger than the largest array index allowed by the cluster they are written
+        to an order_id file that array tasks look up, split into several arrays if required.
+
+    The scripts are written to jobs/{name}/ together with run_{name}.sh that submits them.
+    """
+    name = os.path.splitext(os.path.basename(_file))[0]
+    job_folder = os.path.join("jobs", name)
+    os.makedirs(job_folder, exist_ok=True)
+
+    order_ids = sorted([c["order_id"] for c in configs_of_file])
+
+    modules = format_modules(cluster_config)
+    sbatch_options_str = format_sbatch_options(sbatch_options)
+
+    max_concurrent = cluster_config["array_max_concurrent"]
+
+    array_scripts = []
+    job_tasks = []
+    for i, (array, chunk) in enumerate(get_array_chunks(order_ids, cluster_config["max_array_size"])):
+        if chunk is None:
+            order_id_command = ARRAY_ORDER_ID_COMMAND
+            tasks = {str(order_id): [order_id] for order_id in order_ids}
+        else:
+            tasks = {str(j): [order_id] for j, order_id in enumerate(chunk)}
+
+            order_id_file = os.path.join(job_folder, f"order_ids_{i}.txt")
+            with open(order_id_file, "w") as f:
+                f.write("\n".join(str(order_id) for order_id in chunk) + "\n")
+
+            # run from the models folder
+            order_id_command = ARRAY_ORDER_ID_FILE_COMMAND.format(order_id_file="../" + order_id_file)
+
+        if max_concurrent is not None:
+            array = f"{array}%{max_concurrent}"
+
+        script = ARRAY_SBATCH_SCRIPT.format(
+            job_name=f"{name}_{i}",
+            ncpus=ncpus,
+            ngpus=ngpus,
+            array=array,
+            output=f"{job_folder}/slurm/slurm_%A_%a.log",
+            sbatch_options=sbatch_options_str,
+            modules=modules,
+            run_dir="~/{name}/models/".format(name=experiment_name),
+            order_id_command=order_id_command,
+            run_command=run_command.format(filename=_file),
+        )
+
+        script_path = os.path.join(job_folder, f"{name}_array_{i}.sbatch")
+        with open(script_path, "w") as f:
+            f.write(script)
+
+        array_scripts.append(script_path)
+        job_tasks.append({"path": script_path, "tasks": tasks})
+
+    with open(os.path.join(job_folder, f"run_{name}.sh"), "w") as f:
+        f.write("".join(f'sbatch "{path}"\n' for path in array_scripts))
+
+    write_job_tasks(job_folder, job_tasks)
+
+
+def write_job_tasks(job_folder, job_tasks):
+    """
+    Write the slurm scripts of a model file, in the order that they are submitted, together with the order_ids
+        run by each of their array tasks ('' for scripts that are not arrays). See cluster_status.py.
+    """
+    os.makedirs(job_folder, exist_ok=True)
+
+    with open(os.path.join(job_folder, JOB_TASKS_FILE), "w") as f:
+        json.dump(job_tasks, f)
+
+
+def get_config_chunks(configs_of_file, runtimes, time_budget, parallel):
+    """
+    Split configs_of_file, in order, into chunks of order_ids whose estimated runtime fits in time_budget
+        when parallel of them are run at the same time. Every chunk has at least one config.
+    """
+    chunks = []
+    chunk = []
+    chunk_runtime = 0.0
+
+    for config, runtime in zip(configs_of_file, runtimes):
+        if (len(chunk) > 0) and ((chunk_runtime + runtime) / parallel > time_budget):
+            chunks.append(chunk)
+            chunk = []
+            chunk_runtime = 0.0
+
+        chunk.append(config["order_id"])
+        chunk_runtime += runtime
+
+    if len(chunk) > 0:
+        chunks.append(chunk)
+
+    return chunks
+
+
+def create_slurm_packed_scripts(_file, configs_of_file, run_command, experiment_name, cluster_config, ncpus, ngpus, sbatch_options, usage):
+    """
+    Creates slurm job arrays where every array task runs a chunk of the configs of _file, so that many short configs
+        share a single allocation. Chunks are sized so that their estimated runtime (from the `runtime` key of
+        the config, then the recorded local runs in usage, then default_runtime) fits in pack_time_budget
+        with pack_parallel configs running at the same time.
+
+    Finished configs are marked in jobs/{name}/done/{order_id}, so submitting the same jobs again only runs
+        the configs that did not finish.
+    """
+    name = os.path.splitext(os.path.basename(_file))[0]
+    job_folder = os.path.join("jobs", name)
+    os.makedirs(job_folder, exist_ok=True)
+
+    configs_of_file = sorted(configs_of_file, key=lambda c: c["order_id"])
+
+    runtimes = []
+    for config in configs_of_file:
+        runtime = config.get("runtime")
+        if runtime is None:
+            runtime = usage.estimate_runtime(config)
+        if runtime is None:
+            runtime = cluster_config["default_runtime"]
+        runtimes.append(runtime)
+
+    parallel = max(int(cluster_config["pack_parallel"]), 1)
+    time_budget = cluster_config["pack_time_budget"]
+
+    chunks = get_config_chunks(configs_of_file, runtimes, time_budget, parallel)
+
+    sbatch_options = dict(sbatch_options)
+    if "time" not in sbatch_options.keys():
+        # leave room for chunks that take longer than estimated, slurm times are in minutes
+        sbatch_options["time"] = int(-(-2 * time_budget // 60))
+
+    # every config of a chunk needs its own cpus when running in parallel
+    ncpus = ncpus * parallel
+
+    max_concurrent = cluster_config["array_max_concurrent"]
+    array_size = cluster_config["max_array_size"] + 1
+
+    array_scripts = []
+    job_tasks = []
+    for i in range(0, len(chunks), array_size):
+        chunks_of_array = chunks[i:i + array_size]
+        k = len(array_scripts)
+
+        chunk_file = os.path.join(job_folder, f"chunks_{k}.txt")
+        with open(chunk_file, "w") as f:
+            f.write("".join(" ".join(str(order_id) for order_id in chunk) + "\n" for chunk in chunks_of_array))
+
+        array = f"0-{len(chunks_of_array) - 1}"
+        if max_concurrent is not None:
+            array = f"{array}%{max_concurrent}"
+
+        script = PACKED_SBATCH_SCRIPT.format(
+            job_name=f"{name}_{k}",
+            ncpus=ncpus,
+            ngpus=ngpus,
+            array=array,
+            output=f"{job_folder}/slurm/slurm_%A_%a.log",
+            sbatch_options=format_sbatch_options(sbatch_options),
+            modules=format_modules(cluster_config),
+            run_dir="~/{name}/models/".format(name=experiment_name),
+            # run from the models folder
+            done_folder="../" + os.path.join(job_folder, "done"),
+            chunk_file="../" + chunk_file,
+            parallel=parallel,
+            run_command=run_command.format(filename=_file),
+        )
+
+        script_path = os.path.join(job_folder, f"{name}_packed_{k}.sbatch")
+        with open(script_path, "w") as f:
+            f.write(script)
+
+        array_scripts.append(script_path)
+        job_tasks.append({"path": script_path, "tasks": {str(j): chunk for j, chunk in enumerate(chunks_of_array)}})
+
+    with open(os.path.join(job_folder, f"run_{name}.sh"), "w") as f:
+        f.write("".join(f'sbatch "{path}"\n' for path in array_scripts))
+
+    write_job_tasks(job_folder, job_tasks)
+
+    return chunks
+
+
 def create_slurm_scripts(state, configs_to_run, run_settings, experiment_name, cluster_config):
     """
     Creates slurm scripts by:
@@ -183,6 +498,10 @@ def create_slurm_scripts(state, configs_to_run, run_settings, experiment_name, c
         If a sif file is defined in the cluster config, this is used
         Otherwise no sif file is used
 
+    When array_jobs is set in the cluster config a single job array is created per file instead of a job
+        per config, see create_slurm_array_scripts. When pack_jobs is set every slurm job runs a chunk of
+        configs, see create_slurm_packed_scripts.
+
     NOTE: scripts have to been run like 
         python {filename}.py {order_id}
     """
@@ -200,6 +519,8 @@ def create_slurm_scripts(state, configs_to_run, run_settings, experiment_name, c
                 return cls.format_value(k)
             return cls.kw_fmt.format(key=k, value=cls.format_value(v))
 
+    usage = ResourceUsage(manager.get_tmp_folder_path(state.experiment_config) / RESOURCE_USAGE_FILE)
+
     # distinct file names
     files_to_run = list(set([c["filename"] for c in configs_to_run]))
     for _file in files_to_run:
@@ -207,41 +528,22 @@ def create_slurm_scripts(state, configs_to_run, run_settings, experiment_name, c
 
         # configs_of_file comes from the model.py file
 
-        # py env takes priority
-        if "pyenv" in cluster_config.keys():
-            # run using singularity
-            run_command = "source activate {pyenv} &&".format(
-                pyenv=cluster_config["pyenv"]
-            )
-            run_command = run_command + " python {filename}"
-        # assume that every config has the same sif file
-        elif "sif" in configs_of_file[0].keys():
-            # run using singularity defined in model file
-            run_command = "singularity run --nv {sif_location}".format(
-                sif_location=configs_of_file[0]["sif"]
-            )
-            run_command = run_command + " python {filename}"
+        run_command = get_cluster_run_command(configs_of_file, cluster_config)
 
-        elif "sif" in cluster_config.keys():
-            # run using singularity
-            run_command = "singularity run --nv {sif_location}".format(
-                sif_location=cluster_config["sif"]
-            )
-            run_command = run_command + " python {filename}"
-
-        else:
-            run_command = "python {filename}"
+        ncpus, ngpus, sbatch_options = get_sbatch_resources(cluster_config)
 
-        ncpus = 1  # this is actually the number of nodes
-        ngpus = 0
-
-        if "cpus" in cluster_config["sbatch"].keys():
-            ncpus = cluster_config["sbatch"]["cpus"]
-            cluster_config["sbatch"].pop("cpus")
+        if cluster_config["pack_jobs"]:
+            chunks = create_slurm_packed_scripts(
+                _file, configs_of_file, run_command, experiment_name, cluster_config, ncpus, ngpus, sbatch_options, usage
+            )
+            state.console.print(f"Packed {len(configs_of_file)} configs of {_file} into {len(chunks)} slurm jobs")
+            continue
 
-        if "gpus" in cluster_config["sbatch"].keys():
-            ngpus = cluster_config["sbatch"]["gpus"]
-            cluster_config["sbatch"].pop("gpus")
+        if cluster_config["array_jobs"]:
+            create_slurm_array_scripts(
+                _file, configs_of_file, run_command, experiment_name, cluster_config, ncpus, ngpus, sbatch_options
+            )
+            continue
 
         batch = slurmjobs.SlurmBatch(
             run_command.format(filename=_file),
@@ -253,7 +555,7 @@ def create_slurm_scripts(state, configs_to_run, run_settings, experiment_name, c
             job_id=False,
             run_dir="~/{name}/models/".format(name=experiment_name),
             modules=cluster_config["modules"],
-            sbatch_options=cluster_config["sbatch"],
+            sbatch_options=sbatch_options,
             ncpus=ncpus,
             n_cpus=ncpus,  # get around a bug in slurm jobs
             ngpus=ngpus,
@@ -265,13 +567,20 @@ def create_slurm_scripts(state, configs_to_run, run_settings, experiment_name, c
         all_order_ids = [c["order_id"] for c in configs_of_file]
         run_script, job_paths = batch.generate([("order_id", all_order_ids)])
 
+        # jobs are submitted in the order of all_order_ids and are not arrays
+        write_job_tasks(
+            os.path.join("jobs", os.path.splitext(os.path.basename(_file))[0]),
+            [{"path": str(path), "tasks": {"": [order_id]}} for path, order_id in zip(job_paths, all_order_ids)],
+        )
 
-def compress_files_for_cluster(
-    state, configs_to_run, run_settings, experiment_name, cluster_config
-):
+
+def get_files_to_move(cluster_config):
+    """
+    Return the files and folders that are moved to the cluster (other than models/) and the folders
+        of models/ that are not.
+    """
     tmpl = template.get_template()
 
-    cluster_zip = CLUSTER_ZIP
     libs = cluster_config["libs"]
     files_to_move = (
         ["jobs/", "data/"]
@@ -280,6 +589,15 @@ def compress_files_for_cluster(
     )
     folders_to_ignore = ["models/runs"] + tmpl["ignore_dirs"]
 
+    return files_to_move, folders_to_ignore
+
+
+def compress_files_for_cluster(
+    state, configs_to_run, run_settings, experiment_name, cluster_config
+):
+    cluster_zip = CLUSTER_ZIP
+    files_to_move, folders_to_ignore = get_files_to_move(cluster_config)
+
     # clean up existing runs of this functin
     if os.path.exists(cluster_zip):
         os.remove(cluster_zip)
@@ -364,6 +682,7 @@ def run_on_cluster(state, configs_to_run, run_settings, experiment_name, cluster
     for _file in files_to_run:
         _filename = os.path.splitext(os.path.basename(_file))[0]
 
+        jobs += "echo {marker} {_file} \n".format(marker=SUBMIT_MARKER, _file=_filename)
         jobs += "sh ./jobs/{_file}/run_{_file}.sh \n".format(_file=_filename)
 
     # run experiments and get batch ids
@@ -372,11 +691,37 @@ def run_on_cluster(state, configs_to_run, run_settings, experiment_name, cluster
         cluster_config = cluster_config,
         exp_name=experiment_name,
         jobs = jobs,
-        run=True,
+        run=False,
         verbose=True
     )
 
+    cout = subprocess.run(run_ssh_script, stdout=subprocess.PIPE, shell=True).stdout.decode("utf-8")
+
+    for line in cout.splitlines():
+        if not line.startswith(SUBMIT_MARKER):
+            state.console.print(line, highlight=False)
+
+    return cluster_status.parse_submitted_jobs(cout)
+
+
+
 
+def upload_experiment(state, configs_to_run, run_settings, experiment_name, cluster_config):
+    """ Move the experiment to the cluster with the `upload` method of the cluster config. """
+    if cluster_config['upload'] == 'incremental':
+        # Only send files that have changed since the last upload
+        upload.incremental_upload(state, configs_to_run, run_settings, experiment_name, cluster_config)
+    elif cluster_config['upload'] == 'stream':
+        # Stream files straight to the cluster without creating a zip
+        upload.stream_upload(state, configs_to_run, run_settings, experiment_name, cluster_config)
+    else:
+        # Zip all files to move to the cluster
+        compress_files_for_cluster(
+            state, configs_to_run, run_settings, experiment_name, cluster_config
+        )
+
+        # Move zip to the cluster and unwrap
+        move_files_to_cluster(state, configs_to_run, run_settings, experiment_name, cluster_config)
 
 
 def cluster_run(state, configs_to_run, run_settings, location):
@@ -390,6 +735,9 @@ def cluster_run(state, configs_to_run, run_settings, location):
         Compress files to send over to cluster
         Move files to cluster
         Run slurm scripts
+
+    When upload is incremental in the cluster config, only files that have changed since the last upload
+        are sent, so the experiment is expected to already be on the cluster.
     """
     experiment_config = state.experiment_config
     experiment_name = manager.get_experiment_name(experiment_config)
@@ -397,8 +745,10 @@ def cluster_run(state, configs_to_run, run_settings, location):
     cluster_config = get_cluster_config(experiment_config, location)
 
 
+    incremental = cluster_config['upload'] == 'incremental'
+
     # Only run if the experiment is already on the cluster
-    if run_settings['check_cluster']:
+    if run_settings['check_cluster'] and not incremental:
         if check_if_experiment_exists_on_cluster(experiment_name, cluster_config):
             state.error(f"[red bold]Experiment is already on cluster - {location}, exiting![/]")
 
@@ -408,17 +758,14 @@ def cluster_run(state, configs_to_run, run_settings, location):
     # Create HPC slurm scripts using slurmjobs
     create_slurm_scripts(state, configs_to_run, run_settings, experiment_name, cluster_config)
 
-    # Zip all files to move to the cluster
-    compress_files_for_cluster(
-        state, configs_to_run, run_settings, experiment_name, cluster_config
-    )
-
-    # Move zip to the cluster and unwrap
-    move_files_to_cluster(state, configs_to_run, run_settings, experiment_name, cluster_config)
+    upload_experiment(state, configs_to_run, run_settings, experiment_name, cluster_config)
 
     # Only run experiments on cluster if run_sbatch flag is true
     if run_settings["run_sbatch"]:
-        run_on_cluster(state, configs_to_run, run_settings, experiment_name, cluster_config)
+        submitted = run_on_cluster(state, configs_to_run, run_settings, experiment_name, cluster_config)
+
+        # store the job ids so that sdem status can follow them
+        cluster_status.record_submissions(state, location, configs_to_run, submitted)
 
 
 def clean_up_cluster(location, state):
@@ -455,6 +802,7 @@ def clean_up_cluster(location, state):
 
     try:
         os.system(script)
+        cluster_status.remove_ledger(experiment_config, location)
         state.success('Cleaned up')
     except Exception:
         if state.verbose:
@@ -463,123 +811,21 @@ def clean_up_cluster(location, state):
         state.console.print_exception(show_locals=True)
 
 
-def sync_files(folders_to_sync, folder_origin, cluster_config):
-    remotehost = "{user}@{host}".format(
-        user=cluster_config["user"], host=cluster_config["host"]
-    )
-
-    ssh(
-        SYNC_SCRIPT,
-        cluster_config = cluster_config,
-        remotehost = remotehost,
-        folder_dest=folders_to_sync,
-        folder_origin=folder_origin,
-        run = True
-    )
-
-
-def local_sync(state, folder_origin):
-    # sync files from cluster_tmp to experiment folders
-    folders_to_sync = FOLDERS_TO_SYNC
-
-    for folder in folders_to_sync:
-        _origin = folder_origin + folder
-        _dest = folder
-
-        state.console.print(f"local sync: {_origin} -> {_dest}")
-
-        _script = LOCAL_SYNC_SCRIPT.format(folder_dest=_origin, folder_origin=_dest)
-        os.system(_script)
-
-
-def get_folders_to_sync(experiment_name, cluster_config):
-    # this does not sync models because that is delt with separetly so that the sacred ids can be fixed
-
-    folders_to_sync = FOLDERS_TO_SYNC
-
-    # get list of folders that we need to sync from cluster
-
-    if "sync" in cluster_config.keys():
-        folders_to_sync += cluster_config["sync"]
-
-    if "sync_folders" in cluster_config.keys():
-        folders_to_sync += cluster_config["sync_folders"]
-
-    folders_to_sync = [experiment_name + "/" + f for f in folders_to_sync]
-    folders_to_sync = "'" + " ".join(folders_to_sync) + "'"
-
-    return folders_to_sync
-
-
-def fix_run_ids(state, experiment_name):
-    """
-    Sacred runs start from 1. To merge cluster runs and local runs we simply
-        get the max run id locally, rename all cluster runs to add on the max id and
-        then merge
-
-    This guarrentees that there will be no conflicts, and assuming no runs have been deleted
-        will ensure that the runs are named sequentially
-    """
-    # if there are any sacred experiments they will be in cluster_temp/experiment_name/models/runs/*
-    runs_root = "models/runs/"
-    remote_root = "cluster_temp/" + experiment_name + "/models/runs/"
-
-    if not (os.path.exists(remote_root)):
-        # it seems nothing was synced and so cluster_temp does not exist
-        state.console.print("No sacred runs were synced, so no run ids to fix, continuing")
-        return
-
-    utils.mkdir_if_not_exists(runs_root)
-
-    # get max id
-    origin_ids = [int(folder) for folder in os.listdir(runs_root) if folder.isnumeric()]
-    max_id = 1
-    if len(origin_ids) > 0:
-        max_id = max(origin_ids) + 1
-
-    remote_files = [folder for folder in os.listdir(remote_root) if folder.isnumeric()]
-
-    for i, _file in enumerate(remote_files):
-        filepath = remote_root + _file
-        _id = max_id + i
-        os.system("mv {filepath} models/runs/{_id}".format(filepath=filepath, _id=_id))
-
-
 def sync_with_cluster(state, location):
     """
-    We sync from the cluster to cluster_temp and then locally sync from cluster_temp to the experiment folders.
-    This is to get around the fact the experiment folder on the cluster may be prefixed.
+    Sync the experiment from the cluster, only transferring runs and files that have changed since the last sync.
+        See cluster_sync.py.
     """
     experiment_config = state.experiment_config
     cluster_config = get_cluster_config(experiment_config, location)
     experiment_name = manager.get_experiment_name(experiment_config)
-    experiment_folder_name = manager.get_experiment_folder_name(experiment_config)
 
     if not (check_if_experiment_exists_on_cluster(experiment_name, cluster_config)):
         state.error(f"No experiment to sync on cluster - {location}, exiting!")
 
         return None
 
-    # get folders to sync without models folder
-    # on the cluster the folder created may be prefixed, so we need the folder names
-    # on the cluster and locally may not match up. hence sync to the local experiment
-    # folder name
-    folders_to_sync = get_folders_to_sync(experiment_name, cluster_config)
-
-    # move files from cluster into cluster_temp
-    sync_files(
-        folders_to_sync, experiment_folder_name + "/cluster_temp/", cluster_config
-    )
-    local_sync(state, "cluster_temp/" + experiment_name + "/")
-
-    folder_origin = experiment_folder_name + "/cluster_temp/"
-    sync_files(experiment_name + "/models/", folder_origin, cluster_config)
-
-    # fix sacred run ids
-    fix_run_ids(state, experiment_name)
-
-    # clean up
-    os.system("rm -rf cluster_temp")
+    cluster_sync.incremental_sync(state, location)
 
 
 def clean_up_temp_files():
@@ -0,0 +1,181 @@
+"""
+Resubmission of the configs that failed on a cluster.
+
+A config has failed when its latest slurm job (see cluster_status.py) ended in a failed state (i.e FAILED, TIMEOUT,
+    OUT_OF_MEMORY, CANCELLED, PREEMPTED), or when its slurm job completed but the synced sacred run of the config
+    failed. Configs with a completed sacred run are never resubmitted.
+
+Only new slurm scripts for the failed configs are created and streamed to the cluster, the rest of the experiment
+    is already there. The time and memory requested from slurm can be scaled up for the resubmitted jobs.
+"""
+import copy
+import os
+from typing import List
+
+from .. import utils
+from . import manager
+from . import cluster
+from . import cluster_status
+from . import upload
+
+# sacred statuses of runs that did not finish
+FAILED_RUN_STATUSES = ["FAILED", "INTERRUPTED"]
+
+
+def parse_slurm_time(t) -> float:
+    """ Convert a slurm time (minutes, MM:SS, HH:MM:SS, D-HH, D-HH:MM or D-HH:MM:SS) to minutes. """
+    t = str(t).strip()
+
+    days = 0
+    if "-" in t:
+        days, t = t.split("-", 1)
+        days = int(days)
+        # with days the first field is hours
+        parts = [int(p) for p in t.split(":")] + [0, 0]
+        hours, minutes, seconds = parts[:3]
+    else:
+        parts = [int(p) for p in t.split(":")]
+        if len(parts) == 1:
+            hours, minutes, seconds = 0, parts[0], 0
+        elif len(parts) == 2:
+            hours, minutes, seconds = 0, parts[0], parts[1]
+        else:
+            hours, minutes, seconds = parts[:3]
+
+    return days * 24 * 60 + hours * 60 + minutes + seconds / 60
+
+
+def format_slurm_time(minutes: float) -> str:
+    seconds = int(round(minutes * 60))
+    days, seconds = divmod(seconds, 24 * 60 * 60)
+    hours, seconds = divmod(seconds, 60 * 60)
+    minutes, seconds = divmod(seconds, 60)
+
+    return f"{days}-{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def escalate_cluster_config(cluster_config: dict, time_factor: float, memory_factor: float) -> dict:
+    """ Return a copy of cluster_config with the slurm time and memory scaled by time_factor and memory_factor. """
+    cluster_config = copy.deepcopy(cluster_config)
+    sbatch = cluster_config["sbatch"]
+
+    if time_factor != 1:
+        if "time" in sbatch.keys():
+            sbatch["time"] = format_slurm_time(parse_slurm_time(sbatch["time"]) * time_factor)
+        elif cluster_config["pack_jobs"]:
+            # same default as create_slurm_packed_scripts
+            sbatch["time"] = format_slurm_time(2 * cluster_config["pack_time_budget"] / 60 * time_factor)
+
+    if memory_factor != 1:
+        for key in ["mem", "mem_per_cpu", "mem_per_gpu"]:
+            if key in sbatch.keys():
+                mb = utils.parse_memory(sbatch[key]) / 1024 ** 2
+                sbatch[key] = f"{int(mb * memory_factor)}M"
+
+    return cluster_config
+
+
+def get_failed_configs(state, location, use_runs: bool = True) -> List[dict]:
+    """ Return the status (see cluster_status.get_config_statuses) of every config submitted to location that failed. """
+    statuses = cluster_status.poll_statuses(state, location)
+
+    completed_runs = set()
+    failed_runs = set()
+    if use_runs:
+        with manager.get_run_index(state.experiment_config) as run_index:
+            completed_runs = run_index.get_experiment_ids(["COMPLETED"])
+            failed_runs = run_index.get_experiment_ids(FAILED_RUN_STATUSES)
+
+    failed = []
+    for s in statuses:
+        if s["experiment_id"] in completed_runs:
+            continue
+
+        if (s["category"] == "failed") or ((s["category"] == "completed") and (s["experiment_id"] in failed_runs)):
+            failed.append(s)
+
+    return failed
+
+
+def match_failed_configs(failed: List[dict], configs: List[dict]) -> tuple:
+    """
+    Return (configs to run, changed, missing): the configs of the failed statuses, matched by filename and order_id,
+        the statuses whose order_id now refers to a config with a different experiment_id (i.e the model file was
+        edited since it was submitted) and the statuses whose config no longer exists.
+    """
+    failed_by_key = {(s["filename"], s["order_id"]): s for s in failed}
+
+    configs_to_run = []
+    changed = []
+    for c in configs:
+        s = failed_by_key.pop((c["filename"], c["order_id"]), None)
+        if s is None:
+            continue
+
+        if (s.get("experiment_id") is not None) and (c.get("experiment_id") != s["experiment_id"]):
+            changed.append(s)
+        else:
+            configs_to_run.append(c)
+
+    return configs_to_run, changed, list(failed_by_key.values())
+
+
+def upload_job_scripts(state, configs_to_run, experiment_name, cluster_config) -> None:
+    """ Stream the slurm scripts of the model files of configs_to_run to the cluster. """
+    files = {}
+
+    names = set(os.path.splitext(os.path.basename(c["filename"]))[0] for c in configs_to_run)
+    for name in names:
+        job_folder = os.path.join("jobs", name)
+        ignore = [os.path.join(job_folder, "slurm"), os.path.join(job_folder, "done")]
+
+        for local_file, target in utils.iter_dir_files(job_folder, ignore_dir_arr=ignore, dir_path=job_folder):
+            files[target] = local_file
+
+    upload.stream_files(cluster_config, experiment_name, files)
+    upload.run_remote_commands(cluster_config, experiment_name, upload.get_setup_commands(configs_to_run, cluster_config))
+
+
+def resubmit(state, location, time_factor: float, memory_factor: float, use_runs: bool, run_sbatch: bool) -> None:
+    experiment_config = state.experiment_config
+    experiment_name = manager.get_experiment_name(experiment_config)
+    cluster_config = cluster.get_cluster_config(experiment_config, location)
+
+    if not cluster.check_if_experiment_exists_on_cluster(experiment_name, cluster_config):
+        state.error(f"Experiment is not on cluster - {location}, use sdem run instead!")
+        return None
+
+    failed = get_failed_configs(state, location, use_runs=use_runs)
+
+    if len(failed) == 0:
+        state.success("No failed configs to resubmit")
+        return None
+
+    state.console.print(cluster_status.get_failed_table(failed))
+
+    configs_to_run, changed, missing = match_failed_configs(failed, manager.get_configs_from_model_files(state))
+
+    if len(missing) > 0:
+        state.error(f"{len(missing)} failed configs no longer exist in the model files -- skipping them")
+
+    if len(changed) > 0:
+        state.error(f"{len(changed)} failed configs have changed in the model files since they were submitted -- skipping them")
+        state.console.print(cluster_status.get_failed_table(changed))
+
+    if len(configs_to_run) == 0:
+        return None
+
+    cluster_config = escalate_cluster_config(cluster_config, time_factor, memory_factor)
+
+    if state.verbose:
+        state.console.print(f"Resubmitting with sbatch options {cluster_config['sbatch']}")
+
+    cluster.create_slurm_scripts(state, configs_to_run, {}, experiment_name, cluster_config)
+
+    upload_job_scripts(state, configs_to_run, experiment_name, cluster_config)
+
+    state.console.print(f"Resubmitting {len(configs_to_run)} failed configs to {location}")
+
+    if run_sbatch:
+        submitted = cluster.run_on_cluster(state, configs_to_run, {}, experiment_name, cluster_config)
+        cluster_status.record_submissions(state, location, configs_to_run, submitted)
@@ -0,0 +1,346 @@
+"""
+Status of the slurm jobs submitted to a cluster.
+
+When scripts are created, the order_ids run by every array task of every slurm script are written to
+    jobs/{name}/tasks.json (see cluster.write_job_tasks). When the scripts are submitted, the job ids printed by
+    sbatch are matched to these scripts and stored, together with the experiment_id of every order_id, in a job
+    ledger in the sdem tmp folder (one per location).
+
+A status poll is a single ssh command (over the shared connection, see transport.py) that runs one squeue and
+    one sacct for every job in the ledger and lists the done markers of packed jobs. The state of each array task is
+    then mapped back to the configs that it ran.
+"""
+import datetime
+import json
+import os
+import subprocess
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+from rich.live import Live
+from rich.table import Table
+
+from .. import utils
+from . import manager
+from . import cluster
+
+# folder inside the sdem tmp folder that stores the job ledger of every location
+JOBS_FOLDER = "cluster_jobs"
+
+JOB_STATUS_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'bash -s' << 'HERE'
+echo "#SQUEUE"
+squeue -h -r -j {job_ids} -o "%i|%T" 2>/dev/null
+echo "#SACCT"
+sacct -X -n -P -j {job_ids} --format=JobID,State,Start,End 2>/dev/null
+echo "#DONE"
+cd {exp_name} 2>/dev/null && ls -d jobs/*/done/* 2>/dev/null
+HERE"""
+
+PENDING_STATES = ["PENDING", "CONFIGURING", "REQUEUED", "REQUEUE_HOLD", "RESIZING", "SUSPENDED"]
+RUNNING_STATES = ["RUNNING", "COMPLETING", "STAGE_OUT"]
+
+# every other slurm state is a failure, i.e FAILED, TIMEOUT, OUT_OF_MEMORY, CANCELLED, NODE_FAIL
+STATUS_COLUMNS = ["pending", "running", "completed", "failed", "unknown"]
+
+
+def get_ledger_path(experiment_config, location) -> Path:
+    return manager.get_tmp_folder_path(experiment_config) / JOBS_FOLDER / f"{location}.json"
+
+
+def read_ledger(ledger_path: Path) -> dict:
+    if not ledger_path.exists():
+        return {"submissions": []}
+
+    with open(ledger_path) as f:
+        return json.load(f)
+
+
+def write_ledger(ledger_path: Path, ledger: dict) -> None:
+    ledger_path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_path = ledger_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(ledger, f)
+
+    os.replace(tmp_path, ledger_path)
+
+
+def remove_ledger(experiment_config, location) -> None:
+    ledger_path = get_ledger_path(experiment_config, location)
+
+    if ledger_path.exists():
+        ledger_path.unlink()
+
+
+def parse_submitted_jobs(output: str) -> dict:
+    """ Return a dict from job name to the job ids submitted for it, in order, from the output of run_on_cluster. """
+    jobs = OrderedDict()
+    name = None
+
+    for line in output.splitlines():
+        line = line.strip()
+
+        if line.startswith(cluster.SUBMIT_MARKER):
+            name = line[len(cluster.SUBMIT_MARKER):].strip()
+            jobs[name] = []
+        elif line.startswith("Submitted batch job") and (name is not None):
+            jobs[name].append(line.split()[-1])
+
+    return jobs
+
+
+def record_submissions(state, location, configs_to_run, submitted: dict) -> None:
+    """ Add the jobs in submitted (job name -> job ids) to the job ledger of location. """
+    experiment_config = state.experiment_config
+
+    ledger_path = get_ledger_path(experiment_config, location)
+    ledger = read_ledger(ledger_path)
+
+    for name, job_ids in submitted.items():
+        scripts = utils.json_from_file(os.path.join("jobs", name, cluster.JOB_TASKS_FILE))
+
+        if len(job_ids) != len(scripts):
+            state.error(f"{len(scripts)} scripts of {name} were submitted but {len(job_ids)} job ids were returned")
+
+        configs_of_name = [c for c in configs_to_run if os.path.splitext(os.path.basename(c["filename"]))[0] == name]
+        if len(configs_of_name) == 0:
+            continue
+
+        experiment_ids = {str(c["order_id"]): c.get("experiment_id") for c in configs_of_name}
+
+        for job_id, script in zip(job_ids, scripts):
+            ledger["submissions"].append({
+                "job_id": job_id,
+                "name": name,
+                "filename": configs_of_name[0]["filename"],
+                "script": script["path"],
+                "tasks": script["tasks"],
+                "experiment_ids": {
+                    str(o): experiment_ids.get(str(o)) for order_ids in script["tasks"].values() for o in order_ids
+                },
+                "submitted": time.time(),
+            })
+
+    write_ledger(ledger_path, ledger)
+
+    num_jobs = sum(len(job_ids) for job_ids in submitted.values())
+    state.console.print(f"Recorded {num_jobs} submitted jobs, check on them with sdem status --location {location}")
+
+
+def _parse_time(s: str) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.fromisoformat(s)
+    except ValueError:
+        return None
+
+
+def _expand_job_id(job_id: str) -> List[tuple]:
+    """ Split a slurm job id (123, 123_4 or a pending array 123_[4-9%2]) into (job, task) pairs. """
+    job, _, task = job_id.partition("_")
+
+    if task.startswith("["):
+        tasks = task.strip("[]").split("%")[0]
+        return [(job, str(t)) for t in utils.parse_order_ids(tasks)]
+
+    return [(job, task)]
+
+
+def get_job_states(cluster_config, experiment_name, job_ids: List[str]) -> tuple:
+    """
+    Return a dict from (job, task) to (state, start, end) of every slurm task, and the set of (name, order_id)
+        of configs that have a done marker.
+    """
+    script = cluster.ssh(
+        JOB_STATUS_SCRIPT,
+        cluster_config=cluster_config,
+        exp_name=experiment_name,
+        job_ids=",".join(job_ids),
+        run=False,
+    )
+
+    cout = subprocess.run(script, stdout=subprocess.PIPE, shell=True).stdout.decode("utf-8")
+
+    states = {}
+    queued = {}
+    done = set()
+
+    section = None
+    for line in cout.splitlines():
+        line = line.strip()
+        if line.startswith("#"):
+            section = line[1:]
+            continue
+
+        if line == "":
+            continue
+
+        if section == "SQUEUE":
+            job_id, slurm_state = line.split("|")[:2]
+            for key in _expand_job_id(job_id):
+                queued[key] = slurm_state
+
+        elif section == "SACCT":
+            job_id, slurm_state, start, end = line.split("|")[:4]
+            for key in _expand_job_id(job_id):
+                # i.e CANCELLED by 1234
+                states[key] = (slurm_state.split()[0], _parse_time(start), _parse_time(end))
+
+        elif section == "DONE":
+            parts = line.split("/")
+            if (len(parts) == 4) and parts[3].isnumeric():
+                done.add((parts[1], int(parts[3])))
+
+    # squeue is more up to date than sacct for jobs that are still queued
+    for key, slurm_state in queued.items():
+        _, start, end = states.get(key, (None, None, None))
+        states[key] = (slurm_state, start, end)
+
+    return states, done
+
+
+def get_category(slurm_state: Optional[str]) -> str:
+    if slurm_state is None:
+        return "unknown"
+    if slurm_state in PENDING_STATES:
+        return "pending"
+    if slurm_state in RUNNING_STATES:
+        return "running"
+    if slurm_state == "COMPLETED":
+        return "completed"
+
+    return "failed"
+
+
+def get_config_statuses(ledger: dict, states: dict, done: set) -> List[dict]:
+    """
+    Return the status of every config in the ledger. When a config has been submitted more than once the status
+        of its latest submission is used.
+    """
+    statuses = OrderedDict()
+
+    for submission in ledger["submissions"]:
+        for task, order_ids in submission["tasks"].items():
+            slurm_state, start, end = states.get((submission["job_id"], task), (None, None, None))
+
+            for order_id in order_ids:
+                config_state = slurm_state
+                if (submission["name"], order_id) in done:
+                    # configs of packed jobs finish before the job itself
+                    config_state = "COMPLETED"
+
+                statuses[(submission["filename"], order_id)] = {
+                    "filename": submission["filename"],
+                    "order_id": order_id,
+                    "experiment_id": submission["experiment_ids"].get(str(order_id)),
+                    "job_id": submission["job_id"] if task == "" else f"{submission['job_id']}_{task}",
+                    "state": config_state,
+                    "category": get_category(config_state),
+                    "start": start,
+                    "end": end,
+                }
+
+    return list(statuses.values())
+
+
+def get_status_table(statuses: List[dict]) -> Table:
+    """ Return a table of the number of configs in each state, throughput (configs per hour) and ETA of every file. """
+    table = Table(show_header=True)
+    table.add_column("File")
+    for col in STATUS_COLUMNS:
+        table.add_column(col.capitalize(), justify="right")
+    table.add_column("Configs/hour", justify="right")
+    table.add_column("ETA", justify="right")
+
+    files = OrderedDict()
+    for s in statuses:
+        files.setdefault(s["filename"], []).append(s)
+
+    rows = list(files.items()) + [("Total", statuses)]
+    for i, (filename, statuses_of_file) in enumerate(rows):
+        counts = {col: 0 for col in STATUS_COLUMNS}
+        for s in statuses_of_file:
+            counts[s["category"]] += 1
+
+        finished = [s for s in statuses_of_file if (s["category"] == "completed") and (s["end"] is not None)]
+        started = [s["start"] for s in finished if s["start"] is not None]
+
+        throughput = "-"
+        eta = "-"
+        if len(started) > 0:
+            elapsed = (max(s["end"] for s in finished) - min(started)).total_seconds()
+
+            if elapsed > 0:
+                rate = len(finished) / elapsed
+                throughput = f"{rate * 3600:.1f}"
+
+                remaining = counts["pending"] + counts["running"]
+                if remaining > 0:
+                    eta = str(datetime.timedelta(seconds=int(remaining / rate)))
+
+        if i == len(rows) - 1:
+            table.add_section()
+
+        table.add_row(
+            str(filename),
+            *[str(counts[col]) for col in STATUS_COLUMNS],
+            throughput,
+            eta,
+        )
+
+    return table
+
+
+def get_failed_table(statuses: List[dict]) -> Table:
+    table = Table(show_header=True)
+    for col in ["File", "Order id", "Experiment id", "Job id", "State"]:
+        table.add_column(col)
+
+    for s in statuses:
+        if s["category"] == "failed":
+            table.add_row(s["filename"], str(s["order_id"]), str(s["experiment_id"]), s["job_id"], s["state"])
+
+    return table
+
+
+def poll_statuses(state, location) -> List[dict]:
+    """ Return the status of every config submitted to location, with a single query to the cluster. """
+    experiment_config = state.experiment_config
+    cluster_config = cluster.get_cluster_config(experiment_config, location)
+    experiment_name = manager.get_experiment_name(experiment_config)
+
+    ledger = read_ledger(get_ledger_path(experiment_config, location))
+
+    job_ids = list(OrderedDict.fromkeys(s["job_id"] for s in ledger["submissions"]))
+    if len(job_ids) == 0:
+        return []
+
+    states, done = get_job_states(cluster_config, experiment_name, job_ids)
+
+    return get_config_statuses(ledger, states, done)
+
+
+def cluster_status(state, location, watch: bool, interval: float, show_failed: bool) -> None:
+    """
+    Show the status of the jobs submitted to location. When watch is true the table is updated every interval
+        seconds until no configs are pending or running.
+    """
+    statuses = poll_statuses(state, location)
+
+    if len(statuses) == 0:
+        state.console.print(f"No jobs have been submitted to {location}")
+        return
+
+    if watch:
+        with Live(get_status_table(statuses), console=state.console, refresh_per_second=1) as live:
+            while any(s["category"] in ["pending", "running"] for s in statuses):
+                time.sleep(interval)
+
+                statuses = poll_statuses(state, location)
+                live.update(get_status_table(statuses))
+    else:
+        state.console.print(get_status_table(statuses))
+
+    if show_failed and any(s["category"] == "failed" for s in statuses):
+        state.console.print(get_failed_table(statuses))
@@ -0,0 +1,296 @@
+"""
+Incremental sync of an experiment from a cluster.
+
+Folders other than the sacred runs (jobs/, results/, models/runs/_sources and any `sync`/`sync_folders` in the cluster config)
+    are rsynced directly into the experiment folder, one rsync per folder, running in parallel.
+
+Sacred runs have to be given new ids locally so that they do not clash with local runs. Only runs that have changed
+    on the cluster since the last sync (the watermark, in the cluster's clock) are rsynced into a staging folder that
+    is kept in the sdem tmp folder, so that rsync only transfers what has changed. The local id of every remote run
+    is stored so that syncing a run again updates the same local run instead of creating a new one, unless that local
+    run has since been removed or its id now belongs to a different run, in which case a new local id is allocated.
+"""
+import concurrent.futures
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import List
+
+from loguru import logger
+
+from . import manager
+from . import cluster
+from . import run_folders
+from .run_ids import RunIdAllocator
+
+# folder inside the sdem tmp folder that stores the staging folders and sync state of every location
+SYNC_FOLDER = "cluster_sync"
+
+SYNC_STATE_FILE = "state.json"
+
+# number of applied run id renames remembered in the sync state, see remap_synced_runs
+MAX_REMAPS = 20
+
+# prints the time on the cluster and then the ids of runs that have changed since the watermark
+REMOTE_CHANGED_RUNS_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'bash -s' << 'HERE'
+date +%s
+cd {exp_name}/models/runs 2>/dev/null || exit 0
+find . -mindepth 1 -maxdepth 2 {newer} | cut -d/ -f2 | grep -E '^[0-9]+$' | sort -un
+HERE"""
+
+RSYNC_FOLDER_SCRIPT = "rsync -ra --relative --compress -e '{ssh_auth_no_remote}' {remotehost}:{exp_name}/./{folder} ./"
+
+RSYNC_RUNS_SCRIPT = "rsync -ra --compress --files-from={files_from} -e '{ssh_auth_no_remote}' {remotehost}:{exp_name}/models/runs/ {dest}"
+
+
+def get_sync_folders(cluster_config) -> List[str]:
+    """ Return the folders, relative to the experiment folder, that are synced as they are. """
+    folders = list(cluster.FOLDERS_TO_SYNC)
+
+    for key in ["sync", "sync_folders"]:
+        for f in cluster_config.get(key) or []:
+            if f not in folders:
+                folders.append(f)
+
+    return folders
+
+
+def read_sync_state(state_file: Path) -> dict:
+    if state_file.exists():
+        try:
+            with open(state_file) as f:
+                return json.load(f)
+        except ValueError as e:
+            logger.info(f"Could not read {state_file} -- {e}")
+
+    return {"watermark": None, "run_map": {}}
+
+
+def write_sync_state(state_file: Path, sync_state: dict) -> None:
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = state_file.with_suffix(".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump(sync_state, f)
+
+    os.replace(tmp_file, state_file)
+
+
+def get_changed_runs(cluster_config, experiment_name, watermark) -> tuple:
+    """ Return the current time on the cluster and the ids of remote runs that have changed since watermark. """
+    newer = "" if watermark is None else f"-newermt @{int(watermark)}"
+
+    script = cluster.ssh(
+        REMOTE_CHANGED_RUNS_SCRIPT,
+        cluster_config=cluster_config,
+        exp_name=experiment_name,
+        newer=newer,
+        run=False,
+    )
+
+    cout = subprocess.run(script, stdout=subprocess.PIPE, shell=True).stdout.decode("utf-8").split()
+
+    if len(cout) == 0:
+        raise RuntimeError(f"Could not list the runs on {cluster.get_remote_host(cluster_config)}")
+
+    return int(cout[0]), [int(run_id) for run_id in cout[1:]]
+
+
+def run_rsync_scripts(state, scripts: List[str], workers: int) -> None:
+    """ Run every rsync script, workers at the same time. """
+    def _run(script):
+        if state.verbose:
+            logger.info(script)
+
+        return script, subprocess.run(script, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        for script, result in pool.map(_run, scripts):
+            # 23 is a partial transfer, i.e the folder does not exist on the cluster
+            if result.returncode not in (0, 23):
+                state.error(f"rsync failed ({result.returncode}): {result.stderr.decode('utf-8').strip()}")
+
+
+def sync_runs(state, cluster_config, experiment_name, run_ids: List[int], staging_root: Path, workers: int) -> None:
+    """ rsync the remote runs run_ids into staging_root, split across workers rsync streams. """
+    if len(run_ids) == 0:
+        return
+
+    staging_root.mkdir(parents=True, exist_ok=True)
+
+    chunk_size = -(-len(run_ids) // workers)
+    chunks = [run_ids[i:i + chunk_size] for i in range(0, len(run_ids), chunk_size)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        scripts = []
+        for i, chunk in enumerate(chunks):
+            files_from = Path(tmp_dir) / f"runs_{i}.txt"
+            files_from.write_text("".join(f"{run_id}\n" for run_id in chunk))
+
+            scripts.append(
+                cluster.ssh(
+                    RSYNC_RUNS_SCRIPT,
+                    cluster_config=cluster_config,
+                    remotehost=cluster.get_remote_host(cluster_config),
+                    exp_name=experiment_name,
+                    files_from=files_from,
+                    dest=staging_root,
+                    run=False,
+                )
+            )
+
+        run_rsync_scripts(state, scripts, workers)
+
+
+def get_run_identity(run_folder: Path):
+    """ Return (experiment_id, start time) of the run in run_folder, None if its config.json can not be read. """
+    config = run_folders.read_json_file(run_folder / "config.json")
+    if config is None:
+        return None
+
+    run = run_folders.read_json_file(run_folder / "run.json") or {}
+
+    return config.get("experiment_id"), run.get("start_time")
+
+
+def drop_stale_runs(run_ids: List[int], staging_root: Path, runs_root: Path, run_map: dict) -> None:
+    """
+    Remove the remote runs whose local run no longer exists from run_map, and the remote runs in run_ids whose local id
+        is now used by a different run (i.e the synced run was removed and its id reused), so that they are given new ids.
+    """
+    for run_id, local_id in list(run_map.items()):
+        if not (runs_root / str(local_id)).exists():
+            del run_map[run_id]
+
+    for run_id in run_ids:
+        local_id = run_map.get(str(run_id))
+        if local_id is None:
+            continue
+
+        if get_run_identity(runs_root / str(local_id)) != get_run_identity(staging_root / str(run_id)):
+            logger.info(f"Local run {local_id} is not the synced run {run_id}, it will be given a new id")
+            del run_map[str(run_id)]
+
+
+def allocate_run_ids(run_ids: List[int], run_map: dict, allocator) -> None:
+    """ Add a new local id to run_map for every remote run in run_ids that has not been synced before. """
+    new_runs = [run_id for run_id in run_ids if str(run_id) not in run_map]
+
+    for run_id, local_id in zip(new_runs, allocator.next_ids(len(new_runs), reserved=run_map.values())):
+        run_map[str(run_id)] = local_id
+
+
+def merge_runs(run_ids: List[int], staging_root: Path, runs_root: Path, run_map: dict) -> List[int]:
+    """ Copy the staged remote runs run_ids into their local runs (in run_map). Returns the updated local ids. """
+    runs_root.mkdir(parents=True, exist_ok=True)
+
+    updated = []
+    for run_id in run_ids:
+        local_id = run_map[str(run_id)]
+
+        shutil.copytree(staging_root / str(run_id), runs_root / str(local_id), dirs_exist_ok=True)
+        updated.append(local_id)
+
+    return updated
+
+
+def remap_synced_runs(experiment_config, mapping: dict, rename_id: str = "") -> None:
+    """
+    Update the local ids of synced runs, of every location, after local runs have been renamed (old id -> new id).
+        Renames with a rename_id (see run_ids.py) that has already been applied are skipped.
+    """
+    sync_folder = manager.get_tmp_folder_path(experiment_config) / SYNC_FOLDER
+
+    if (len(mapping) == 0) or (not sync_folder.exists()):
+        return
+
+    for state_file in sync_folder.glob(f"*/{SYNC_STATE_FILE}"):
+        sync_state = read_sync_state(state_file)
+
+        remaps = sync_state.get("remaps", [])
+        if (rename_id != "") and (rename_id in remaps):
+            continue
+
+        # ids that were only renamed into were not used before the rename, so runs mapped to them had been removed
+        removed = set(mapping.values()) - set(mapping.keys())
+
+        sync_state["run_map"] = {k: mapping.get(int(v), v) for k, v in sync_state["run_map"].items() if int(v) not in removed}
+
+        if rename_id != "":
+            sync_state["remaps"] = (remaps + [rename_id])[-MAX_REMAPS:]
+
+        write_sync_state(state_file, sync_state)
+
+
+def get_run_id_allocator(experiment_config) -> RunIdAllocator:
+    """ Return the run id allocator (see manager.get_run_id_allocator) that keeps the ids of synced runs up to date. """
+    return manager.get_run_id_allocator(
+        experiment_config,
+        on_rename=lambda mapping, rename_id: remap_synced_runs(experiment_config, mapping, rename_id)
+    )
+
+
+def incremental_sync(state, location) -> None:
+    """ Sync the folders and the runs that have changed since the last sync from the cluster at location. """
+    experiment_config = state.experiment_config
+    cluster_config = cluster.get_cluster_config(experiment_config, location)
+    experiment_name = manager.get_experiment_name(experiment_config)
+
+    workers = cluster_config["sync_workers"]
+
+    # created first as resuming an interrupted rename updates the sync state
+    allocator = get_run_id_allocator(experiment_config)
+
+    sync_root = manager.get_tmp_folder_path(experiment_config) / SYNC_FOLDER / location
+    state_file = sync_root / SYNC_STATE_FILE
+    sync_state = read_sync_state(state_file)
+
+    remotehost = cluster.get_remote_host(cluster_config)
+
+    # find changed runs first so that anything that changes while syncing is picked up next time
+    remote_time, run_ids = get_changed_runs(cluster_config, experiment_name, sync_state["watermark"])
+
+    folders = get_sync_folders(cluster_config)
+    state.console.print(f"Syncing {', '.join(folders)} and {len(run_ids)} changed runs from {remotehost}")
+
+    folder_scripts = [
+        cluster.ssh(
+            RSYNC_FOLDER_SCRIPT,
+            cluster_config=cluster_config,
+            remotehost=remotehost,
+            exp_name=experiment_name,
+            folder=folder,
+            run=False,
+        )
+        for folder in folders
+    ]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+        folders_done = pool.submit(run_rsync_scripts, state, folder_scripts, workers)
+        runs_done = pool.submit(sync_runs, state, cluster_config, experiment_name, run_ids, sync_root / "runs", workers)
+
+        folders_done.result()
+        runs_done.result()
+
+    run_ids = [run_id for run_id in run_ids if (sync_root / "runs" / str(run_id)).exists()]
+
+    drop_stale_runs(run_ids, sync_root / "runs", allocator.runs_root, sync_state["run_map"])
+    allocate_run_ids(run_ids, sync_state["run_map"], allocator)
+
+    # the new ids are stored before copying so that an interrupted sync copies into the same local runs
+    write_sync_state(state_file, sync_state)
+
+    updated = merge_runs(run_ids, sync_root / "runs", allocator.runs_root, sync_state["run_map"])
+
+    sync_state["watermark"] = remote_time
+    write_sync_state(state_file, sync_state)
+
+    # only the synced runs have changed, so the index does not have to be refreshed
+    with manager.get_run_index(experiment_config, refresh=False) as run_index:
+        for local_id in updated:
+            run_index.update_run(local_id)
+
+    state.success(f"Synced {len(updated)} runs")
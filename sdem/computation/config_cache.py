@@ -0,0 +1,230 @@
+"""
+On-disk cache of the configs found in each model file.
+
+Loading configs requires importing every model file, which for most experiments means importing heavy
+    frameworks. The configs of a model file only change when its source (or a local module it imports) changes,
+    so we store the expanded, ID-stamped configs keyed by the content hash of the model file and its local imports.
+"""
+import ast
+import hashlib
+import os
+import pickle
+from pathlib import Path
+from typing import List, Optional
+
+from loguru import logger
+
+from .. import utils
+
+# bump whenever the cached format or the fields added to each config change
+CACHE_VERSION = 2
+
+# name of the cache folder inside the sdem tmp folder
+CACHE_FOLDER = "config_cache"
+
+
+def hash_file(file_path: Path) -> str:
+    """ Return the sha256 hash of the contents of file_path. """
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _get_search_paths(tree: ast.AST, file_dir: Path) -> List[Path]:
+    """
+    Model files are imported with their own folder as the working directory and commonly extend the path
+        with sys.path.append('../'). Return the folder of the file and any such literal paths.
+    """
+    paths = [file_dir]
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)):
+            continue
+
+        if node.func.attr not in ("append", "insert"):
+            continue
+
+        target = node.func.value
+        is_sys_path = (
+            isinstance(target, ast.Attribute)
+            and target.attr == "path"
+            and isinstance(target.value, ast.Name)
+            and target.value.id == "sys"
+        )
+        if not is_sys_path:
+            continue
+
+        for arg in node.args:
+            if isinstance(arg, ast.Constant) and isinstance(arg.value, str):
+                paths.append((file_dir / arg.value).resolve())
+
+    return paths
+
+
+def _get_imported_modules(tree: ast.AST, file_dir: Path) -> List[tuple]:
+    """ Return (module name, search paths override) for every import statement in tree. """
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                modules.append((alias.name, None))
+
+        elif isinstance(node, ast.ImportFrom):
+            if node.level > 0:
+                # relative imports are resolved w.r.t to the folder of the file
+                base = file_dir
+                for _ in range(node.level - 1):
+                    base = base.parent
+                search_paths = [base]
+            else:
+                search_paths = None
+
+            prefix = node.module if node.module else ""
+            if prefix:
+                modules.append((prefix, search_paths))
+
+            # from a import b may import the submodule a.b
+            for alias in node.names:
+                name = f"{prefix}.{alias.name}" if prefix else alias.name
+                modules.append((name, search_paths))
+
+    return modules
+
+
+def _resolve_module(name: str, search_paths: List[Path]) -> List[Path]:
+    """ Return the local files that importing name would execute, or [] if it is not a local module. """
+    parts = name.split(".")
+    for root in search_paths:
+        files = []
+        folder = Path(root)
+
+        # parent packages are executed before the module itself
+        for part in parts[:-1]:
+            folder = folder / part
+            if (folder / "__init__.py").is_file():
+                files.append(folder / "__init__.py")
+
+        module_file = folder / f"{parts[-1]}.py"
+        package_file = folder / parts[-1] / "__init__.py"
+
+        if module_file.is_file():
+            return files + [module_file]
+        if package_file.is_file():
+            return files + [package_file]
+
+    return []
+
+
+def get_local_dependencies(file_path: Path) -> List[Path]:
+    """ Return file_path and every local python file it (recursively) imports. """
+    file_path = Path(file_path).resolve()
+
+    visited = set()
+    to_visit = [(file_path, None)]
+
+    while len(to_visit) > 0:
+        current, parent_search_paths = to_visit.pop()
+
+        if current in visited:
+            continue
+        visited.add(current)
+
+        try:
+            tree = ast.parse(current.read_bytes(), filename=str(current))
+        except (SyntaxError, ValueError) as e:
+            # Still hash the file so that fixing it invalidates the cache
+            logger.info(f"Could not parse {current} -- {e}")
+            continue
+
+        search_paths = _get_search_paths(tree, current.parent)
+        if parent_search_paths is not None:
+            search_paths = search_paths + parent_search_paths
+
+        for name, override in _get_imported_modules(tree, current.parent):
+            paths = override if override is not None else search_paths
+            for dep in _resolve_module(name, paths):
+                to_visit.append((dep.resolve(), search_paths))
+
+    return sorted(visited)
+
+
+class ConfigCache:
+    """
+    Stores the configs of each model file in cache_root/{model file stem}.pickle.
+
+    The global_id of each config is not cached as it must be unique for every load, it is re-added
+        on every cache hit.
+    """
+
+    def __init__(self, cache_root: Path):
+        self.cache_root = Path(cache_root)
+
+        self.hits = 0
+        self.misses = 0
+
+        # model file -> cache key, so that the key is only computed once per model file
+        self._keys = {}
+
+    def get_cache_file(self, model_file: Path) -> Path:
+        return self.cache_root / f"{Path(model_file).stem}.pickle"
+
+    def get_key(self, model_file: Path) -> str:
+        model_file = Path(model_file)
+
+        if model_file not in self._keys:
+            h = hashlib.sha256()
+            h.update(f"{CACHE_VERSION}:{model_file.name}".encode("utf-8"))
+
+            for dep in get_local_dependencies(model_file):
+                h.update(f"{dep}:{hash_file(dep)}".encode("utf-8"))
+
+            self._keys[model_file] = h.hexdigest()
+
+        return self._keys[model_file]
+
+    def get(self, model_file: Path) -> Optional[List[dict]]:
+        """ Return the cached configs of model_file, or None if they are missing or out of date. """
+        cache_file = self.get_cache_file(model_file)
+
+        configs = None
+        if cache_file.exists():
+            try:
+                with open(cache_file, "rb") as f:
+                    cached = pickle.load(f)
+
+                if cached["key"] == self.get_key(model_file):
+                    configs = cached["configs"]
+            except Exception as e:
+                logger.info(f"Could not read config cache {cache_file} -- {e}")
+
+        if configs is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+
+        return configs
+
+    def set(self, model_file: Path, configs: List[dict]) -> None:
+        """ Store configs of model_file. Configs that cannot be pickled are simply not cached. """
+        cache_file = self.get_cache_file(model_file)
+
+        cached = {
+            "key": self.get_key(model_file),
+            "configs": [utils.get_dict_without_key(c, "global_id") for c in configs],
+        }
+
+        try:
+            self.cache_root.mkdir(parents=True, exist_ok=True)
+
+            # write to a temporary file first so that an interrupted write never leaves a corrupt cache
+            tmp_file = cache_file.with_suffix(".tmp")
+            with open(tmp_file, "wb") as f:
+                pickle.dump(cached, f)
+
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logger.info(f"Could not write config cache {cache_file} -- {e}")
+
+    def stats(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses"
@@ -0,0 +1,159 @@
+"""
+Inverted index over experiment configs.
+
+Answers the same queries as utils.dict_is_subset, but for a list of filters in a single pass over the index
+    instead of comparing every filter against every config.
+"""
+import json
+from typing import List, Union
+
+from .. import utils
+
+
+def _is_hashable(v) -> bool:
+    try:
+        hash(v)
+    except TypeError:
+        return False
+    return True
+
+
+def _is_comparable(v) -> bool:
+    """ Return true if comparing v with == returns a bool, which is not the case for i.e numpy arrays (or lists of them). """
+    if isinstance(v, (list, tuple)):
+        return all(_is_comparable(item) for item in v)
+
+    if isinstance(v, dict):
+        return all(_is_comparable(item) for item in v.values())
+
+    try:
+        return type(v == v) is bool
+    except Exception:
+        return False
+
+
+def _canonical_str(v) -> str:
+    """ Used to bucket unhashable values so that equal values are usually compared against a single entry. """
+    try:
+        return json.dumps(v, sort_keys=True, default=repr)
+    except (TypeError, ValueError):
+        return repr(v)
+
+
+class ConfigIndex:
+    """
+    For every config key we store:
+        - a dict from each hashable value to the positions of the configs with that value
+        - a list of [value, positions] for unhashable values (i.e lists and dicts), bucketed by their json string
+        - the positions of configs whose value cannot be compared with == (i.e numpy arrays), which are checked
+            against the filter one by one
+
+    Filters follow the semantics of utils.dict_is_subset: every key of the filter must be in the config
+        and if the filter value is a list then it is treated as an OR over its items, unless the config
+        value is itself a list in which case they must be equal.
+    """
+
+    def __init__(self, configs: List[dict]):
+        self.configs = configs
+
+        self._hashable = {}
+        self._unhashable = {}
+        self._uncomparable = {}
+
+        for pos, config in enumerate(configs):
+            for k, v in config.items():
+                if _is_hashable(v):
+                    self._hashable.setdefault(k, {}).setdefault(v, set()).add(pos)
+                elif not _is_comparable(v):
+                    self._uncomparable.setdefault(k, []).append(pos)
+                else:
+                    bucket = self._unhashable.setdefault(k, {}).setdefault(_canonical_str(v), [])
+
+                    for entry in bucket:
+                        if entry[0] == v:
+                            entry[1].add(pos)
+                            break
+                    else:
+                        bucket.append([v, {pos}])
+
+    def _iter_unhashable(self, k):
+        for bucket in self._unhashable.get(k, {}).values():
+            for value, positions in bucket:
+                yield value, positions
+
+    def _lookup_hashable(self, k, v) -> set:
+        try:
+            return self._hashable.get(k, {}).get(v, set())
+        except TypeError:
+            # v is unhashable and so cannot equal any hashable value in the index
+            return set()
+
+    def _positions_matching_uncomparable(self, k, i) -> set:
+        return set(pos for pos in self._uncomparable.get(k, []) if utils.dict_is_subset({k: i}, self.configs[pos]))
+
+    def _positions_matching_item(self, k, i) -> set:
+        """ Return the positions of configs where config[k] matches the filter value i. """
+        positions = self._positions_matching_uncomparable(k, i)
+
+        if type(i) is list:
+            # config values that are lists must match exactly, otherwise the filter is an OR over its items
+            for value, value_positions in self._iter_unhashable(k):
+                if type(value) is list:
+                    if value == i:
+                        positions |= value_positions
+                elif any(value == item for item in i):
+                    positions |= value_positions
+
+            for item in i:
+                positions |= self._lookup_hashable(k, item)
+
+            return positions
+
+        positions |= self._lookup_hashable(k, i)
+        for value, value_positions in self._iter_unhashable(k):
+            if value == i:
+                positions |= value_positions
+
+        return positions
+
+    def _positions_matching_filter(self, _filter: dict) -> set:
+        positions = None
+
+        for k, i in _filter.items():
+            item_positions = self._positions_matching_item(k, i)
+
+            if positions is None:
+                positions = item_positions
+            else:
+                positions = positions & item_positions
+
+            if len(positions) == 0:
+                # no need to check the remaining keys
+                return positions
+
+        if positions is None:
+            # an empty filter matches everything
+            return set(range(len(self.configs)))
+
+        return positions
+
+    def query(self, filters: Union[dict, List[dict]]) -> List[int]:
+        """
+        Return the positions of every config that matches any of filters, without duplicates and in the
+            order of the configs. An empty list of filters matches every config.
+        """
+        if type(filters) != list:
+            filters = [filters]
+
+        if len(filters) == 0:
+            return list(range(len(self.configs)))
+
+        positions = set()
+        for _filter in filters:
+            positions |= self._positions_matching_filter(_filter)
+
+        return sorted(positions)
+
+    def filter(self, filters: Union[dict, List[dict]]) -> List[dict]:
+        """ Return every config that matches any of filters. See query. """
+        return [self.configs[pos] for pos in self.query(filters)]
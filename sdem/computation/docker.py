@@ -1,9 +1,24 @@
 import os
+import shlex
 from pathlib import Path
 
 from . import manager
 from .. import utils
 
+# environment variable that overrides the docker executable, i.e to use podman or a stand-in script
+DOCKER_CLI_ENV = "SDEM_DOCKER_CLI"
+
+# command that keeps a reused container alive, overridden by the `keep_alive` key of the docker config
+DEFAULT_KEEP_ALIVE = "tail -f /dev/null"
+
+
+def get_docker_cli(run_config) -> str:
+    """ Return the docker executable, the `cli` key of the docker config takes priority over DOCKER_CLI_ENV. """
+    if run_config.get("cli") is not None:
+        return run_config["cli"]
+
+    return os.environ.get(DOCKER_CLI_ENV, "docker")
+
 
 def get_mount_str(d, mount_target=None, read_only=True):
 
@@ -38,8 +53,13 @@ def get_mount_str(d, mount_target=None, read_only=True):
     return s
 
 
-def get_docker_run_command(experiment_config, run_config):
-    """ Return the command used to run docker with required files mounted. """
+def get_docker_run_command(experiment_config, run_config, container_name=None, detach=False, entrypoint=None):
+    """
+    Return the command used to run docker with required files mounted.
+
+    When detach is true the container is started in the background so that experiments can be run inside it
+        with get_docker_exec_command. When entrypoint is given it replaces the entrypoint of the image.
+    """
 
     # Docker image name
     docker_name = run_config["name"]
@@ -71,9 +91,40 @@ def get_docker_run_command(experiment_config, run_config):
     for d in libs:
         total_mount_str += get_mount_str(d, mount_target=mount_target, read_only=True)
 
-    run_command = "docker  run  {mount_str} {flags} {name}".format(
+    if container_name is not None:
+        flags = f"--name {container_name} " + flags
+
+    if detach:
+        flags = "-d " + flags
+
+    if entrypoint is not None:
+        flags = f"--entrypoint {shlex.quote(entrypoint)} " + flags
+
+    run_command = "{cli}  run  {mount_str} {flags} {name}".format(
+        cli=get_docker_cli(run_config),
         name=docker_name,
         flags=flags,
         mount_str=total_mount_str
     )
     return run_command
+
+
+def get_docker_start_command(experiment_config, run_config, container_name):
+    """ Return the command that starts a long lived container that experiments can be exec'd into. """
+    # keep the container alive until it is removed, run as the entrypoint as the image may define its own
+    keep_alive = shlex.split(run_config.get("keep_alive") or DEFAULT_KEEP_ALIVE)
+
+    run_command = get_docker_run_command(
+        experiment_config, run_config, container_name=container_name, detach=True, entrypoint=keep_alive[0]
+    )
+
+    return " ".join([run_command] + [shlex.quote(arg) for arg in keep_alive[1:]])
+
+
+def get_docker_exec_command(run_config, container_name):
+    """ Return the command used to run a command inside a running container. """
+    return f"{get_docker_cli(run_config)} exec {container_name}"
+
+
+def get_docker_remove_command(run_config, container_name):
+    return f"{get_docker_cli(run_config)} rm -f {container_name}"
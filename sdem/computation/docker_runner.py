@@ -2,9 +2,71 @@ from loguru import logger
 
 from .. import state
 from .. import decorators
+from .. import utils
 from . import docker, manager
+from .local_runner import get_log_file, get_memory_budget
+from .scheduler import LocalScheduler, Task
 
 import os
+import subprocess
+from typing import List
+
+
+def get_docker_config(docker_config: dict, exp: dict, docker_image=None) -> dict:
+    """ Return the docker config used to run exp. """
+    # copy dict
+    docker_config_i = dict(docker_config)
+
+    # arguments passed through cli have priority
+    if docker_image is not None:
+        docker_config_i['name'] = docker_image
+    elif 'docker_image' in exp.keys():
+        # then config has priority
+        docker_config_i['name'] = exp['docker_image']
+    else:
+        #otherwise we use what is in the exerimenet config
+        pass
+
+    return docker_config_i
+
+
+def start_containers(state, experiment_config: dict, docker_configs: List[dict]) -> dict:
+    """ Start one long lived container for every image in docker_configs and return a dict from image to container name. """
+    containers = {}
+
+    for docker_config in docker_configs:
+        image = docker_config['name']
+        if image in containers.keys():
+            continue
+
+        container_name = f"sdem_{os.getpid()}_{len(containers)}"
+        start_command = docker.get_docker_start_command(experiment_config, docker_config, container_name)
+
+        if state.verbose:
+            state.console.print(start_command, soft_wrap=True)
+
+        result = subprocess.run(start_command, shell=True, capture_output=True, text=True)
+
+        if result.returncode != 0:
+            # do not leave behind the containers that did start
+            stop_containers(state, docker_configs, containers)
+            raise RuntimeError(f"Could not start a container for {image}: {result.stderr.strip()}")
+
+        logger.info(f"Started container {container_name} for {image}")
+        containers[image] = container_name
+
+    return containers
+
+
+def stop_containers(state, docker_configs: List[dict], containers: dict) -> None:
+    docker_config_of_image = {c['name']: c for c in docker_configs}
+
+    for image, container_name in containers.items():
+        remove_command = docker.get_docker_remove_command(docker_config_of_image[image], container_name)
+        result = subprocess.run(remove_command, shell=True, capture_output=True, text=True)
+
+        if result.returncode != 0:
+            state.error(f"Could not remove container {container_name}: {result.stderr.strip()}")
 
 
 def docker_run(state, configs_to_run, run_settings, location, docker_image = None):
@@ -13,6 +75,10 @@ def docker_run(state, configs_to_run, run_settings, location, docker_image = Non
     These experiments will be run using a file storage observed which will be converted
         to a mongo entry after running.
 
+    When run_settings['reuse_containers'] is true one container is started per docker image and every experiment
+        is run inside it with docker exec, instead of starting a new container per experiment. When
+        run_settings['jobs'] > 1 experiments are run concurrently with their output written to log files.
+
     Args:
         configs_to_run: list of all experiment configs
     """
@@ -32,31 +98,67 @@ def docker_run(state, configs_to_run, run_settings, location, docker_image = Non
 
     docker_config = experiment_config[location]
 
-    for i, exp in enumerate(configs_to_run):
-        # copy dict
-        docker_config_i = dict(docker_config)
-
-        # arguments passed through cli have priority
-        if docker_image is not None:
-            docker_config_i['name'] = docker_image
-        elif 'docker_image' in exp.keys():
-            # then config has priority
-            docker_config_i['name'] = exp['docker_image']
-        else:
-            #otherwise we use what is in the exerimenet config
-            pass
-
-        docker_run_command = docker.get_docker_run_command(experiment_config, docker_config_i)
-
-        run_command = manager.substitute_config_in_str(
-            run_command_tmpl,
-            exp
-        )
+    docker_configs = [get_docker_config(docker_config, exp, docker_image) for exp in configs_to_run]
+
+    containers = {}
+    if run_settings.get('reuse_containers', False):
+        containers = start_containers(state, experiment_config, docker_configs)
+
+    try:
+        run_commands = []
+        for exp, docker_config_i in zip(configs_to_run, docker_configs):
+            if docker_config_i['name'] in containers.keys():
+                docker_run_command = docker.get_docker_exec_command(docker_config_i, containers[docker_config_i['name']])
+            else:
+                docker_run_command = docker.get_docker_run_command(experiment_config, docker_config_i)
+
+            run_command = manager.substitute_config_in_str(
+                run_command_tmpl,
+                exp
+            )
+
+            run_exp_command = f' /bin/bash -c  "{run_command}"'
+            run_commands.append(docker_run_command + run_exp_command)
+
+        if run_settings.get('jobs', 1) > 1:
+            run_docker_concurrently(state, configs_to_run, run_commands, run_settings)
+            return
+
+        for i, run_command in enumerate(run_commands):
+            state.console.rule(f'Running experiment {i}')
+            state.console.print(run_command, soft_wrap=True)
+
+            os.system(run_command)
+    finally:
+        stop_containers(state, docker_configs, containers)
 
-        run_exp_command = f' /bin/bash -c  "{run_command}"'
-        run_command = docker_run_command + run_exp_command
 
-        state.console.rule(f'Running experiment {i}')
-        state.console.print(run_command, soft_wrap=True)
+def run_docker_concurrently(state, configs_to_run: List[dict], run_commands: List[str], run_settings: dict) -> None:
+    """
+    Runs run_commands at the same time, packed so that at most run_settings['jobs'] cpus and
+        run_settings['memory_budget'] memory are in use.
+
+    Only the `cpus` and `memory` declared in the configs are used as the docker client does not report
+        the resources used inside the container.
+    """
+    experiment_config = state.experiment_config
+
+    memory_budget = get_memory_budget(run_settings)
+
+    scheduler = LocalScheduler(state, run_settings['jobs'], memory=memory_budget)
+
+    for exp, run_command in zip(configs_to_run, run_commands):
+        scheduler.add(
+            Task(
+                name=f"{exp['filename']} {exp['order_id']}",
+                command=run_command,
+                log_file=get_log_file(experiment_config, exp),
+                cpus=exp.get('cpus') or 1,
+                memory=utils.parse_memory(exp['memory']) if exp.get('memory') is not None else None,
+            )
+        )
+
+    state.console.print(f"Running {len(configs_to_run)} experiments on docker with {scheduler.jobs} cpus")
 
-        os.system(run_command)
+    scheduler.run()
+    scheduler.summary()
@@ -4,11 +4,21 @@ from typing import List
 from .. import state
 from .. import decorators
 from . import manager
+from .run_index import RUN_INDEX_FILE, RUN_INDEX_ENV
+from .scheduler import LocalScheduler, Task, COMPLETED
+from .resources import ResourceUsage, RESOURCE_USAGE_FILE
+from .warm_pool import run_with_warm_workers
+from .. import utils
 
 import os
+import itertools
+from pathlib import Path
 
 RUN_COMMAND = "cd models; python {name} {order} {observer}"
 
+# folder inside the tmp folder that stores the output of experiments run concurrently
+LOG_FOLDER = "logs"
+
 
 def local_run(state: 'State', configs_to_run: List[dict], run_settings: dict) -> None:
     """
@@ -16,6 +26,10 @@ def local_run(state: 'State', configs_to_run: List[dict], run_settings: dict) ->
     These experiments will be run using a file storage observed which will be converted
         to a local entry after running.
 
+    When run_settings['jobs'] > 1 experiments are instead run concurrently, see run_concurrently, and when
+        run_settings['batch_size'] > 1 many experiments are run by each process, see run_in_batches.
+        When run_settings['warm_workers'] > 0 experiments are run on a pool of long lived workers, see run_with_warm_workers.
+
     Args:
         configs_to_run: list of all experiment configs
     """
@@ -34,6 +48,22 @@ def local_run(state: 'State', configs_to_run: List[dict], run_settings: dict) ->
     else:
         run_command_tmpl = experiment_config['template']['run_command']['local_no_observer']
 
+    # Let experiments update the run index as they run
+    run_index_path = manager.get_tmp_folder_path(experiment_config) / RUN_INDEX_FILE
+    os.environ[RUN_INDEX_ENV] = str(run_index_path.resolve())
+
+    if run_settings.get("warm_workers", 0) > 0:
+        run_with_warm_workers(state, configs_to_run, run_settings)
+        return
+
+    if run_settings.get("batch_size", 1) > 1:
+        run_in_batches(state, configs_to_run, run_command_tmpl, run_settings)
+        return
+
+    if run_settings.get("jobs", 1) > 1:
+        run_concurrently(state, configs_to_run, run_command_tmpl, run_settings)
+        return
+
     # Seqentially loop through each experiment
     for exp in configs_to_run:
 
@@ -49,3 +79,178 @@ def local_run(state: 'State', configs_to_run: List[dict], run_settings: dict) ->
         os.system(run_command)
 
     state.console.print('[bold green]Finished[/]')
+
+
+def get_log_file(experiment_config: dict, config: dict) -> Path:
+    """ Path of the file that the output of the experiment config is written to. """
+    name = Path(config['filename']).stem
+    return manager.get_tmp_folder_path(experiment_config) / LOG_FOLDER / f"{name}_{config['order_id']}.log"
+
+
+def get_memory_budget(run_settings: dict) -> int:
+    """ Memory (bytes) that experiments running at the same time can use, defaults to all of the machine. """
+    memory_budget = run_settings.get('memory_budget')
+
+    if memory_budget is not None:
+        return utils.parse_memory(memory_budget)
+
+    return utils.get_total_memory()
+
+
+def run_concurrently(state: 'State', configs_to_run: List[dict], run_command_tmpl: str, run_settings: dict) -> None:
+    """
+    Runs experiments at the same time, each as its own subprocess with its output written to a log file in the tmp folder.
+
+    Experiments are packed onto the machine so that at most run_settings['jobs'] cpus and run_settings['memory_budget']
+        memory (defaults to all of the machine) are in use. Configs can declare the number of `cpus` (default 1) and
+        the `memory` (i.e 4G) they require, otherwise these are estimated from the recorded usage of previous runs.
+    """
+    experiment_config = state.experiment_config
+
+    usage = ResourceUsage(manager.get_tmp_folder_path(experiment_config) / RESOURCE_USAGE_FILE)
+
+    memory_budget = get_memory_budget(run_settings)
+
+    scheduler = LocalScheduler(state, run_settings['jobs'], memory=memory_budget)
+
+    def record_usage(exp):
+        def on_finish(task):
+            if task.status == COMPLETED:
+                usage.record(exp, task.peak_rss, task.cpu_time, task.elapsed)
+
+        return on_finish
+
+    for exp in configs_to_run:
+        run_command = manager.substitute_config_in_str(
+            run_command_tmpl,
+            exp
+        )
+
+        scheduler.add(
+            Task(
+                name=f"{exp['filename']} {exp['order_id']}",
+                command=run_command,
+                log_file=get_log_file(experiment_config, exp),
+                on_finish=record_usage(exp),
+                **usage.estimate(exp)
+            )
+        )
+
+    state.console.print(
+        f"Running {len(configs_to_run)} experiments with {scheduler.jobs} cpus"
+        + ("" if memory_budget is None else f" and {utils.format_memory(memory_budget)} memory")
+    )
+
+    try:
+        scheduler.run()
+    finally:
+        # keep what has been learned even if the runs are interrupted
+        usage.save()
+
+    scheduler.summary()
+
+
+def get_batches(configs_to_run: List[dict], batch_size: int) -> List[tuple]:
+    """ Group configs by model file and split each group into (filename, order_ids) chunks of at most batch_size. """
+    order_ids_of_file = {}
+    for exp in configs_to_run:
+        order_ids_of_file.setdefault(exp['filename'], []).append(exp['order_id'])
+
+    batches = []
+    for filename, order_ids in order_ids_of_file.items():
+        for i in range(0, len(order_ids), batch_size):
+            batches.append((filename, order_ids[i:i + batch_size]))
+
+    return batches
+
+
+def run_in_batches(state: 'State', configs_to_run: List[dict], run_command_tmpl: str, run_settings: dict) -> None:
+    """
+    Runs each model file once for every chunk of run_settings['batch_size'] of its configs, so the cost of starting
+        python and importing the model file is shared across the chunk (see Experiment.run_order_ids).
+
+    Every chunk is its own process (up to run_settings['jobs'] run at the same time) so a crash only affects
+        its own chunk. The model file records its progress in a file, when a chunk crashes the config that
+        was running is marked as failed and the configs that had not started are run in a new process.
+
+    The run command is constructed from the first config of each chunk with order_id replaced by the list of ids.
+    """
+    experiment_config = state.experiment_config
+
+    usage = ResourceUsage(manager.get_tmp_folder_path(experiment_config) / RESOURCE_USAGE_FILE)
+
+    scheduler = LocalScheduler(state, run_settings.get('jobs', 1), memory=get_memory_budget(run_settings))
+
+    log_root = manager.get_tmp_folder_path(experiment_config) / LOG_FOLDER
+    configs_by_id = {(exp['filename'], exp['order_id']): exp for exp in configs_to_run}
+    batch_counter = itertools.count()
+
+    # (filename, order_id) of every config that failed or crashed
+    failed = []
+
+    def make_task(filename, order_ids):
+        name = f"{Path(filename).stem}_batch_{next(batch_counter)}"
+
+        # the command changes directory so the progress file must be an absolute path
+        progress_file = (log_root / f'{name}.progress').resolve()
+        progress_file.parent.mkdir(parents=True, exist_ok=True)
+        if progress_file.exists():
+            progress_file.unlink()
+
+        batch_config = dict(configs_by_id[(filename, order_ids[0])], order_id=utils.format_order_ids(order_ids))
+        run_command = manager.substitute_config_in_str(run_command_tmpl, batch_config)
+        run_command = f'{run_command} --progress-file "{progress_file}"'
+
+        # a chunk needs the resources of its largest config
+        estimates = [usage.estimate(configs_by_id[(filename, i)]) for i in order_ids]
+        memory = [e['memory'] for e in estimates if e['memory'] is not None]
+
+        def on_finish(task):
+            progress = utils.read_progress(progress_file)
+
+            failed.extend((filename, i) for i, status in progress.items() if status == 'FAILED')
+
+            if task.returncode == 0:
+                return []
+
+            if len(progress) == 0:
+                # nothing ran, the model file itself must be broken so there is no point retrying
+                failed.extend((filename, i) for i in order_ids)
+                return []
+
+            # configs that started but never finished caused the crash
+            failed.extend((filename, i) for i, status in progress.items() if status is None)
+
+            remaining = [i for i in order_ids if i not in progress]
+
+            if len(remaining) == 0:
+                return []
+
+            state.console.log(f'{name} crashed -- restarting the remaining {len(remaining)} configs')
+            return [make_task(filename, remaining)]
+
+        return Task(
+            name=f"{filename} {utils.format_order_ids(order_ids)}",
+            command=run_command,
+            log_file=log_root / f'{name}.log',
+            cpus=max(e['cpus'] for e in estimates),
+            memory=max(memory) if len(memory) > 0 else None,
+            on_finish=on_finish
+        )
+
+    batches = get_batches(configs_to_run, run_settings['batch_size'])
+    for filename, order_ids in batches:
+        scheduler.add(make_task(filename, order_ids))
+
+    state.console.print(
+        f"Running {len(configs_to_run)} experiments in {len(batches)} batches with {scheduler.jobs} cpus"
+    )
+
+    scheduler.run()
+
+    if len(failed) > 0:
+        state.error(f'{len(failed)}/{len(configs_to_run)} experiments failed:')
+        for filename, i in failed:
+            state.console.print(f'    {filename} {i}')
+    else:
+        state.console.print(f"[bold green]All {len(configs_to_run)} experiments finished successfully[/]")
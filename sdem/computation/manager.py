@@ -1,22 +1,32 @@
 import os
+import time
+import multiprocessing
+import concurrent.futures
 from loguru import logger
 import pathlib
 import builtins
+import sysconfig
 from types import ModuleType
 import uuid
 from pathlib import Path
-from typing import List
+from typing import List, Iterable, Iterator
 from string import Formatter
 
 from .. import template
 from .. import utils
 from .. import state
 from .. import dispatch
+from . import config_cache
+from .config_index import ConfigIndex
 
-from ..results.local import get_run_configs
+from .run_index import RunIndex, RUN_INDEX_FILE
+from .run_ids import RunIdAllocator, RUN_ID_JOURNAL_FILE
 
 old_imp = builtins.__import__
 
+# files, outside of installed packages, that had an import replaced by a DummyModule in this process
+_stubbed_files = set()
+
 
 class DummyModule(ModuleType):
     def __getattr__(self, key):
@@ -41,6 +51,7 @@ def set_custom_import():
             m = old_imp(name, *args, **kwargs)
         except Exception as e:
             m = DummyModule(name)
+            _record_stubbed_import(kwargs.get("globals", args[0] if len(args) > 0 else None))
 
         return m
 
@@ -51,6 +62,31 @@ def reset_import():
     builtins.__import__ = old_imp
 
 
+def _record_stubbed_import(importer_globals) -> None:
+    """ Record the file that made an import that was replaced by a DummyModule, unless it is part of an installed package. """
+    importer = (importer_globals or {}).get("__file__")
+    if importer is None:
+        return
+
+    # installed packages commonly try optional imports, which do not change the configs
+    importer = os.path.abspath(importer)
+    if importer.startswith(sysconfig.get_paths()["stdlib"] + os.sep) or any(p in importer for p in ["site-packages", "dist-packages"]):
+        return
+
+    _stubbed_files.add(os.path.realpath(importer))
+
+
+def has_stubbed_imports(experiment: Path) -> bool:
+    """
+    Return true if the model file experiment, or a local module it imports, had an import replaced by a DummyModule.
+        Its configs may then differ from the configs of a real import and so are not cached.
+    """
+    if len(_stubbed_files) == 0:
+        return False
+
+    return any(str(f) in _stubbed_files for f in config_cache.get_local_dependencies(experiment))
+
+
 def get_experiment_config(state, default_config, exp_root = None):
     """
     There are three levels of config: default, project and local.
@@ -196,7 +232,109 @@ def get_model_files(state: 'State', model_root=None) -> List[Path]:
     return experiment_files
 
 
-def get_configs_from_model_files(state: 'State', model_root = None, ignore_files: list = None, return_ex = False, import_hook = True) -> List[dict]:
+def load_configs_from_model_file(experiment: Path):
+    """
+    Imports the model file experiment and returns its sacred experiment object (ex) and
+        configs, with the required fields added to each config.
+    """
+    mod = utils.load_mod(experiment)
+
+    # each model file must define an experiment variable called ex
+    # use ex to get the configs
+    experiment_configs = mod.ex.config_function()
+
+    configs = [
+        ensure_correct_fields_for_model_file_config(experiment, config, i)
+        for i, config in enumerate(experiment_configs)
+    ]
+
+    return mod.ex, configs
+
+
+def _load_configs_in_worker(experiment: Path, import_hook: bool):
+    """
+    Entry point of the model file loading workers.
+
+    Returns the configs of experiment, the time taken, an error message if the model file could not be loaded and
+        whether any of its imports were replaced by the import hook.
+    """
+    start = time.time()
+
+    if import_hook:
+        set_custom_import()
+
+    cwd = os.getcwd()
+    try:
+        _, configs = load_configs_from_model_file(experiment)
+        return configs, time.time() - start, None, has_stubbed_imports(experiment)
+    except Exception as e:
+        return None, time.time() - start, repr(e), False
+    finally:
+        os.chdir(cwd)
+
+
+def load_configs_in_pool(state, status, files_to_load: List[Path], configs_of_file: dict, import_hook: bool, cache=None) -> List[Path]:
+    """
+    Loads every model file in files_to_load in a separate worker process, so that heavy imports, the import
+        hook and any changes of working directory stay isolated from sdem.
+
+    The configs of each model file are stored in configs_of_file. Returns the model files whose configs could not
+        be sent back from the worker (i.e they cannot be pickled) so that they can be loaded in this process.
+    """
+    num_workers = min(state.load_workers, len(files_to_load))
+
+    # model files are loaded by forking, spawning would re-run the sdem cli in every worker
+    mp_context = None
+    if 'fork' in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context('fork')
+
+    failed_to_send = []
+
+    status.update(f"Loading {len(files_to_load)} model files with {num_workers} workers")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=num_workers, mp_context=mp_context) as executor:
+        futures = {
+            executor.submit(_load_configs_in_worker, experiment, import_hook): experiment
+            for experiment in files_to_load
+        }
+
+        for num_done, future in enumerate(concurrent.futures.as_completed(futures)):
+            experiment = futures[future]
+
+            status.update(f"Loaded {num_done + 1}/{len(files_to_load)} model files")
+
+            try:
+                configs, time_taken, error, stubbed = future.result()
+            except Exception as e:
+                status.console.log(f'Could not receive configs of {experiment} from worker ({e}) -- loading directly')
+                failed_to_send.append(experiment)
+                continue
+
+            if error is not None:
+                state.console.print(error)
+                status.console.log(f'!Error loading configs from {experiment} ({time_taken:.1f}s) -- Skipping!')
+                continue
+
+            configs_of_file[experiment] = configs
+            status.console.log(f'Loaded configs from {experiment} ({time_taken:.1f}s)')
+
+            if stubbed:
+                status.console.log(f'Not caching configs of {experiment} as some of its imports were replaced by dummy modules')
+            elif cache is not None:
+                cache.set(experiment, configs)
+
+    return failed_to_send
+
+
+def get_configs_from_model_files(
+    state: 'State',
+    model_root = None,
+    ignore_files: list = None,
+    return_ex = False,
+    import_hook = True,
+    exp_root = None,
+    use_cache = True
+) -> List[dict]:
     """
     Assumes that all configs are defined within the model files:
         models/m_{name}.py
@@ -209,6 +347,13 @@ def get_configs_from_model_files(state: 'State', model_root = None, ignore_files
         fold_group_id: ID that is constant for all configs within a fold
 
     If these are not provided they will be automatically generated.
+
+    Configs are cached in the tmp folder (relative to exp_root) so that model files are only re-imported when
+        they, or a local module they import, change. The cache is skipped when use_cache is false, when sdem is
+        run with --no-cache, or when return_ex is true as ex objects only exist once the model file is imported.
+        Configs of model files that were loaded with some of their imports replaced by the import hook are not cached.
+
+    When sdem is run with --load-workers N (N > 1) model files that are not cached are loaded in parallel worker processes.
     """
 
     if ignore_files is None:
@@ -216,6 +361,12 @@ def get_configs_from_model_files(state: 'State', model_root = None, ignore_files
 
     experiment_config: dict = state.experiment_config
 
+    cache = None
+    if use_cache and not return_ex and not state.no_cache:
+        cache = config_cache.ConfigCache(
+            get_tmp_folder_path(experiment_config, exp_root=exp_root) / config_cache.CACHE_FOLDER
+        )
+
     with state.console.status("Loading model configs") as status:
 
         experiment_files = get_model_files(state, model_root)
@@ -223,69 +374,176 @@ def get_configs_from_model_files(state: 'State', model_root = None, ignore_files
 
         if len(experiment_files) == 0:
             raise RuntimeError(
-                f"No models found in {model_root.resolve()} with pattern {experiment_file_pattern}"
+                f"No models found in {model_root} with pattern {experiment_config['template']['experiment_file']}"
             )
 
         # Go through every experiment file and store the found configs
 
-        experiment_config_arr = []
+        # model file -> configs, so that configs are always returned in the order of experiment_files
+        configs_of_file: dict = {}
 
         # a dictionary mapping from each experiment object to its configs
         experiment_config_dict: dict = {}
 
-        if import_hook:
-            # enable the custom hook to avoid uncessary import errors
-            set_custom_import()
+        # model files that are not ignored or cached and so need to be imported
+        files_to_load = []
 
         for experiment in experiment_files:
-            status.update(f"Loading configs from {experiment}")
-
             if experiment.name in ignore_files:
                 # skip
                 status.console.log(f'Ignoring {experiment}!')
                 continue
 
-            # If an error occurs skip and continue
-            #    logger does not exit when it catches an execption, just prints it
-            def load():
-                try:
-                    mod = utils.load_mod(experiment)
+            if cache is not None:
+                status.update(f"Checking config cache of {experiment}")
+                configs = cache.get(experiment)
 
-                    # each model file must define an experiment variable called ex
-                    # use ex to get the configs
-                    experiment_configs = mod.ex.config_function()
+                if configs is not None:
+                    # global ids are not cached, ensure_correct_fields_for_model_file_config only adds these back
+                    configs_of_file[experiment] = [
+                        ensure_correct_fields_for_model_file_config(experiment, config, config['order_id'])
+                        for config in configs
+                    ]
 
-                    for i, config in enumerate(experiment_configs):
-                        config = ensure_correct_fields_for_model_file_config(
-                            experiment, config, i
-                        )
-                        experiment_config_arr.append(config)
+                    status.console.log(f'Loaded configs from {experiment} (cached)')
+                    continue
 
-                    experiment_config_dict[mod.ex] = experiment_config_arr
-                    status.console.log(f'Loaded configs from {experiment}')
-                except Exception as e:
-                    state.console.print(e)
-                    #state.console.print_exception(show_locals=True)
-                    status.console.log(f'!Error loading configs from {experiment} -- Skipping!')
+            files_to_load.append(experiment)
+
+        # ex objects cannot be sent between processes so return_ex always loads in this process
+        use_pool = (state.load_workers > 1) and (not return_ex) and (len(files_to_load) > 1)
+
+        if use_pool:
+            files_to_load = load_configs_in_pool(state, status, files_to_load, configs_of_file, import_hook, cache)
+
+        if import_hook:
+            # enable the custom hook to avoid uncessary import errors
+            set_custom_import()
+
+        for experiment in files_to_load:
+            status.update(f"Loading configs from {experiment}")
 
             #store here so we can revert
             cwd = os.getcwd()
 
-            load()
-
-            # revert back to orginal working directory
-            os.chdir(cwd)
+            # If an error occurs skip and continue
+            #    logger does not exit when it catches an execption, just prints it
+            try:
+                ex, configs = load_configs_from_model_file(experiment)
+
+                configs_of_file[experiment] = configs
+                experiment_config_dict[ex] = configs
+                status.console.log(f'Loaded configs from {experiment}')
+
+                if (cache is not None) and has_stubbed_imports(experiment):
+                    status.console.log(f'Not caching configs of {experiment} as some of its imports were replaced by dummy modules')
+                elif cache is not None:
+                    cache.set(experiment, configs)
+            except Exception as e:
+                state.console.print(e)
+                #state.console.print_exception(show_locals=True)
+                status.console.log(f'!Error loading configs from {experiment} -- Skipping!')
+            finally:
+                # revert back to orginal working directory
+                os.chdir(cwd)
 
 
         if import_hook:
             # revert back to default import 
             reset_import()
 
+        experiment_config_arr = []
+        for experiment in experiment_files:
+            if experiment not in configs_of_file:
+                continue
+
+            experiment_config_arr += configs_of_file[experiment]
+
+        if cache is not None and state.verbose:
+            state.console.print(f'Config cache: {cache.stats()}')
+
         if return_ex:
             return experiment_config_arr, experiment_config_dict
         return experiment_config_arr
 
 
+def iter_configs_from_model_files(
+    state: 'State',
+    model_root = None,
+    ignore_files: list = None,
+    import_hook = True,
+    exp_root = None,
+    use_cache = True
+) -> Iterator[dict]:
+    """
+    Lazy version of get_configs_from_model_files. Configs are yielded one at a time and the required fields are only
+        added as each config is reached, so model files whose config functions return generators
+        (see utils.iter_all_permutations) are never fully materialised.
+
+    Cached configs are used, but configs are not written to the cache as that would require holding every config
+        of a model file in memory.
+    """
+    if ignore_files is None:
+        ignore_files = []
+
+    experiment_config: dict = state.experiment_config
+
+    cache = None
+    if use_cache and not state.no_cache:
+        cache = config_cache.ConfigCache(
+            get_tmp_folder_path(experiment_config, exp_root=exp_root) / config_cache.CACHE_FOLDER
+        )
+
+    experiment_files = get_model_files(state, model_root)
+
+    if len(experiment_files) == 0:
+        raise RuntimeError(
+            f"No models found in {model_root} with pattern {experiment_config['template']['experiment_file']}"
+        )
+
+    for experiment in experiment_files:
+        if experiment.name in ignore_files:
+            state.console.log(f'Ignoring {experiment}!')
+            continue
+
+        if cache is not None:
+            configs = cache.get(experiment)
+
+            if configs is not None:
+                state.console.log(f'Loading configs from {experiment} (cached)')
+
+                for config in configs:
+                    yield ensure_correct_fields_for_model_file_config(experiment, config, config['order_id'])
+
+                continue
+
+        #store here so we can revert
+        cwd = os.getcwd()
+
+        if import_hook:
+            # enable the custom hook to avoid uncessary import errors
+            set_custom_import()
+
+        try:
+            mod = utils.load_mod(experiment)
+            experiment_configs = mod.ex.config_function()
+        except Exception as e:
+            state.console.print(e)
+            state.console.log(f'!Error loading configs from {experiment} -- Skipping!')
+            continue
+        finally:
+            # the hook must not be active while the caller consumes configs
+            if import_hook:
+                reset_import()
+
+            os.chdir(cwd)
+
+        state.console.log(f'Loading configs from {experiment}')
+
+        for i, config in enumerate(experiment_configs):
+            yield ensure_correct_fields_for_model_file_config(experiment, config, i)
+
+
 def get_valid_experiment_ids(state):
     configs = get_configs_from_model_files(state)
     return [c["experiment_id"] for c in configs]
@@ -293,7 +551,8 @@ def get_valid_experiment_ids(state):
 
 def filter_configs(state, experiment_configs, filter_dict, run_new_only):
     """
-    removes configs from experiment_configs that do not match filter_dict
+    removes configs from experiment_configs that do not match filter_dict.
+        filter_dict can be a list of filters, a config is kept if it matches any of them.
     """
     if (type(filter_dict) == list and len(filter_dict) == 0) or (
         type(filter_dict) != list and len(filter_dict.keys()) == 0
@@ -301,24 +560,13 @@ def filter_configs(state, experiment_configs, filter_dict, run_new_only):
         # nothing to filter
         _experiment_configs = experiment_configs
     else:
-        if type(filter_dict) != list:
-            filter_dict = [filter_dict]
-
-        _experiment_configs = []
-        for _filter in filter_dict:
-            for config in experiment_configs:
-                # check if config matches filter_dict
-                if utils.dict_is_subset(_filter, config):
-                    _experiment_configs.append(config)
+        # answer all filters in a single pass over an index of the configs
+        _experiment_configs = ConfigIndex(experiment_configs).filter(filter_dict)
 
     if run_new_only:
         # go through each config and check if a run exists for it
 
-        # load all configs that have been run
-        run_configs = get_run_configs(exp_root = './')
-
-        # extract global ids
-        run_experiment_ids = [config['experiment_id'] for config in run_configs]
+        run_experiment_ids = get_run_experiment_ids(state.experiment_config)
 
         tmp = []
 
@@ -342,6 +590,73 @@ def filter_configs(state, experiment_configs, filter_dict, run_new_only):
     return _experiment_configs
 
 
+def get_run_index(experiment_config, exp_root=None, refresh=True) -> RunIndex:
+    """
+    Return the index of all sacred runs (stored in the sdem tmp folder), updated with any
+        run folders that have been added, changed or removed since it was last used unless refresh is false.
+    """
+    index_path = get_tmp_folder_path(experiment_config, exp_root=exp_root) / RUN_INDEX_FILE
+    runs_root = Path(exp_root if exp_root is not None else '.') / Path(
+        experiment_config['template']['folder_structure']['scared_run_files']
+    )
+
+    run_index = RunIndex(index_path, runs_root)
+
+    if refresh:
+        run_index.refresh()
+
+    return run_index
+
+
+def get_run_id_allocator(experiment_config, exp_root=None, on_rename=None) -> RunIdAllocator:
+    """
+    Return the allocator used to give new ids to sacred runs, finishing any interrupted renames. on_rename is
+        called with every mapping of renamed runs, see run_ids.py.
+    """
+    journal_path = get_tmp_folder_path(experiment_config, exp_root=exp_root) / RUN_ID_JOURNAL_FILE
+    runs_root = Path(exp_root if exp_root is not None else '.') / Path(
+        experiment_config['template']['folder_structure']['scared_run_files']
+    )
+
+    allocator = RunIdAllocator(runs_root, journal_path, on_rename=on_rename)
+
+    if allocator.resume() is not None:
+        # the index re-reads the renamed run folders when it is refreshed
+        with get_run_index(experiment_config, exp_root=exp_root):
+            pass
+
+    return allocator
+
+
+def get_run_experiment_ids(experiment_config, exp_root=None) -> set:
+    """ Return the experiment_ids of every sacred run. """
+    with get_run_index(experiment_config, exp_root=exp_root) as run_index:
+        return run_index.get_experiment_ids()
+
+
+def iter_filter_configs(state, experiment_configs: Iterable[dict], filter_dict, run_new_only) -> Iterator[dict]:
+    """
+    Streaming version of filter_configs, yields the configs of experiment_configs that match any filter in filter_dict.
+    """
+    if type(filter_dict) != list:
+        filter_dict = [filter_dict]
+
+    run_experiment_ids = None
+    if run_new_only:
+        run_experiment_ids = get_run_experiment_ids(state.experiment_config)
+
+    for config in experiment_configs:
+        if len(filter_dict) > 0:
+            if not any(utils.dict_is_subset(_filter, config) for _filter in filter_dict):
+                continue
+
+        if run_experiment_ids is not None:
+            if config['experiment_id'] in run_experiment_ids:
+                continue
+
+        yield config
+
+
 def create_default_experiment():
     tmpl = template.get_template()
     folders_to_create = [
@@ -0,0 +1,100 @@
+"""
+Records the resources used by previous local runs so that they can be used to pack future runs.
+
+Usage is stored in the sdem tmp folder per experiment_id, and per model file so that new configs of a model file
+    can be estimated from the configs of that file that have already run.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Optional
+
+from loguru import logger
+
+from .. import utils
+
+# name of the usage file inside the sdem tmp folder
+RESOURCE_USAGE_FILE = "resource_usage.json"
+
+# learned memory is only a measurement of previous runs, so leave some headroom
+MEMORY_SAFETY_FACTOR = 1.2
+
+
+class ResourceUsage:
+    def __init__(self, usage_file: Path):
+        self.usage_file = Path(usage_file)
+
+        self.usage = {"experiments": {}, "files": {}}
+
+        if self.usage_file.exists():
+            try:
+                self.usage = utils.json_from_file(self.usage_file)
+            except Exception as e:
+                logger.info(f"Could not read {self.usage_file} -- {e}")
+
+    def save(self) -> None:
+        self.usage_file.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_file = self.usage_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(self.usage, f)
+
+        os.replace(tmp_file, self.usage_file)
+
+    def record(self, config: dict, peak_rss: int, cpu_time: float, wall_time: float) -> None:
+        """ Store the measured usage of a finished run of config. """
+        if peak_rss is None:
+            return
+
+        cpus = cpu_time / wall_time if wall_time > 0 else 1.0
+
+        self.usage["experiments"][config["experiment_id"]] = {
+            "peak_rss": peak_rss,
+            "cpus": cpus,
+            "wall_time": wall_time,
+        }
+
+        # per file we keep the largest usage seen
+        file_usage = self.usage["files"].setdefault(config["filename"], {"peak_rss": 0, "cpus": 0.0})
+        file_usage["peak_rss"] = max(file_usage["peak_rss"], peak_rss)
+        file_usage["cpus"] = max(file_usage["cpus"], cpus)
+        file_usage["wall_time"] = max(file_usage.get("wall_time", 0.0), wall_time)
+
+    def _learned(self, config: dict) -> Optional[dict]:
+        if config.get("experiment_id") in self.usage["experiments"]:
+            return self.usage["experiments"][config["experiment_id"]]
+
+        return self.usage["files"].get(config.get("filename"))
+
+    def estimate(self, config: dict) -> dict:
+        """
+        Return the cpus and memory (bytes) that config is expected to need. Resources declared in the config
+            (`cpus` and `memory`) take priority over those learned from previous runs.
+        """
+        learned = self._learned(config)
+
+        if config.get("memory") is not None:
+            memory = utils.parse_memory(config["memory"])
+        elif learned is not None:
+            memory = int(learned["peak_rss"] * MEMORY_SAFETY_FACTOR)
+        else:
+            memory = None
+
+        if config.get("cpus") is not None:
+            cpus = config["cpus"]
+        elif learned is not None:
+            # a run that used 1.6 cpus on average still needs 2
+            cpus = max(1, int(-(-learned["cpus"] // 1)))
+        else:
+            cpus = 1
+
+        return {"cpus": cpus, "memory": memory}
+
+    def estimate_runtime(self, config: dict) -> Optional[float]:
+        """ Return the wall time (seconds) of the previous run of config, or of the longest run of its file. """
+        learned = self._learned(config)
+
+        if learned is None:
+            return None
+
+        return learned.get("wall_time")
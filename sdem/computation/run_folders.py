@@ -0,0 +1,132 @@
+"""
+Reading of sacred run folders.
+
+The run index (pruning, --new-only and resubmitting), the results store and the cleaning functions all read the
+    config.json, metrics.json and run.json of many run folders. Reading these files is I/O bound (especially on
+    network file systems) so folders are read with a thread pool, and parsed with orjson when it is installed.
+
+config.json and run.json are small and are read by several of these, so the parsed contents of the most recently
+    read ones are cached (in this process) together with a signature of the file, and are only read again once
+    the file changes.
+"""
+import concurrent.futures
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RUN_FILES = ["config.json", "metrics.json", "run.json"]
+
+# files whose parsed contents are cached
+CACHED_FILES = ["config.json", "run.json"]
+
+# number of threads used to read run folders
+DEFAULT_READ_WORKERS = 16
+
+# maximum number of files in the cache
+MAX_CACHED_FILES = 20000
+
+# path -> (signature, parsed contents), least recently used first
+_CACHE = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+
+
+def file_signature(f: Path) -> Optional[str]:
+    """ Return a string that changes whenever f changes, None if f does not exist. """
+    try:
+        st = os.stat(f)
+    except OSError:
+        return None
+
+    return f"{st.st_ino}:{st.st_mtime_ns}:{st.st_size}"
+
+
+def loads(b: bytes):
+    if orjson is not None:
+        try:
+            return orjson.loads(b)
+        except orjson.JSONDecodeError:
+            # sacred writes NaN and Infinity, which orjson rejects
+            pass
+
+    return json.loads(b)
+
+
+def read_json_file(f: Path) -> Optional[dict]:
+    """ Return the parsed contents of the json file f, None if it does not exist or can not be parsed. """
+    f = Path(f)
+    cached = f.name in CACHED_FILES
+
+    if cached:
+        signature = file_signature(f)
+        if signature is None:
+            return None
+
+        with _CACHE_LOCK:
+            hit = _CACHE.get(str(f))
+            if (hit is not None) and (hit[0] == signature):
+                _CACHE.move_to_end(str(f))
+                return hit[1]
+
+    try:
+        with open(f, "rb") as fh:
+            d = loads(fh.read())
+    except (OSError, ValueError):
+        return None
+
+    if cached:
+        with _CACHE_LOCK:
+            _CACHE[str(f)] = (signature, d)
+            _CACHE.move_to_end(str(f))
+
+            while len(_CACHE) > MAX_CACHED_FILES:
+                _CACHE.popitem(last=False)
+
+    return d
+
+
+def list_run_folders(runs_root: Path) -> Dict[int, Path]:
+    """ Return a dict from run id to the folder of every sacred run in runs_root. """
+    runs_root = Path(runs_root)
+
+    run_folders = {}
+    if runs_root.exists():
+        for entry in os.scandir(runs_root):
+            if entry.name.isnumeric() and entry.is_dir():
+                run_folders[int(entry.name)] = Path(entry.path)
+
+    return run_folders
+
+
+def read_run_folder(run_folder: Path, files: List[str] = RUN_FILES) -> dict:
+    """
+    Return {'run_id', 'path', 'config', 'metrics', 'run'} of run_folder, only reading the given files.
+        Files that are not read, or could not be read, are None.
+    """
+    run_folder = Path(run_folder)
+
+    run = {"run_id": int(run_folder.name), "path": run_folder}
+    for f in RUN_FILES:
+        run[f[:-len(".json")]] = read_json_file(run_folder / f) if f in files else None
+
+    return run
+
+
+def read_run_folders(run_folders: Iterable[Path], files: List[str] = RUN_FILES, workers: int = DEFAULT_READ_WORKERS) -> Dict[int, dict]:
+    """ Read every folder in run_folders (see read_run_folder) with a pool of workers threads. """
+    run_folders = list(run_folders)
+
+    if (workers <= 1) or (len(run_folders) <= 1):
+        runs = [read_run_folder(folder, files) for folder in run_folders]
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            runs = list(pool.map(lambda folder: read_run_folder(folder, files), run_folders))
+
+    return {run["run_id"]: run for run in runs}
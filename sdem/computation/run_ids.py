@@ -0,0 +1,181 @@
+"""
+Renaming of sacred run folders.
+
+Run ids are changed by computing the whole remapping (old id -> new id) up front and turning it into a list of
+    single renames, ordered so that no rename overwrites a run folder. Runs that are part of a cycle
+    (i.e swapping 1 and 2) are first moved to a temporary name.
+
+The renames are written to a journal (in the sdem tmp folder) before any folder is touched, and every finished
+    rename is appended to it. If sdem is interrupted the next allocator for the same runs folder (see
+    manager.get_run_id_allocator) finishes the remaining renames before doing anything else, so run folders are
+    never lost or left half renamed. The run index is updated with the new ids directly, and otherwise notices
+    renamed folders on its next refresh.
+
+Anything else that stores run ids (i.e the sync state of cluster_sync.py) is updated by on_rename, which is called
+    with the mapping and the id of the journal once the folders are renamed but before the journal is removed. It
+    may therefore be called again with the same journal id if sdem is interrupted.
+"""
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+from loguru import logger
+
+from .run_index import RunIndex
+
+# name of the journal file inside the sdem tmp folder
+RUN_ID_JOURNAL_FILE = "run_id_journal"
+
+
+def plan_renames(mapping: Dict[int, int], existing: Iterable[int]) -> List[List[str]]:
+    """
+    Return the renames [src, dst] (folder names) that apply mapping, in an order where every dst is free
+        when it is renamed to. existing are the ids of every run folder.
+    """
+    mapping = {int(k): int(v) for k, v in mapping.items() if int(k) != int(v)}
+
+    targets = list(mapping.values())
+    if len(set(targets)) != len(targets):
+        raise ValueError("Run ids can not be mapped to the same new id")
+
+    occupied = set(int(i) for i in existing)
+    missing = [k for k in mapping.keys() if k not in occupied]
+    if len(missing) > 0:
+        raise ValueError(f"Run ids {sorted(missing)} do not exist")
+
+    blocked = [v for k, v in mapping.items() if (v in occupied) and (v not in mapping)]
+    if len(blocked) > 0:
+        raise ValueError(f"Run ids {sorted(blocked)} already exist and are not being renamed")
+
+    # a run can only be renamed once the run currently using its new id has been moved away
+    renames = []
+    done = set()
+
+    def rename_chain(src):
+        chain = []
+        while (src not in done) and (src in mapping):
+            chain.append(src)
+            done.add(src)
+            src = mapping[src]
+
+        if (len(chain) > 0) and (src == chain[0]):
+            # cycle, move the first run out of the way and rename it last
+            tmp = f"{chain[0]}.tmp"
+            renames.append([str(chain[0]), tmp])
+            for k in reversed(chain[1:]):
+                renames.append([str(k), str(mapping[k])])
+            renames.append([tmp, str(mapping[chain[0]])])
+        else:
+            for k in reversed(chain):
+                renames.append([str(k), str(mapping[k])])
+
+    # start from runs that nothing is renamed to so that chains are renamed from their free end
+    targets = set(targets)
+    sources = sorted(mapping.keys(), key=lambda k: k in targets)
+    for src in sources:
+        rename_chain(src)
+
+    return renames
+
+
+class RunIdAllocator:
+    def __init__(self, runs_root: Path, journal_path: Path, on_rename: Optional[Callable[[Dict[int, int], str], None]] = None):
+        self.runs_root = Path(runs_root)
+        self.journal_path = Path(journal_path)
+        self.on_rename = on_rename
+
+    def get_run_ids(self) -> List[int]:
+        if not self.runs_root.exists():
+            return []
+
+        return [int(entry.name) for entry in os.scandir(self.runs_root) if entry.name.isnumeric() and entry.is_dir()]
+
+    def next_ids(self, n: int, reserved: Iterable[int] = ()) -> List[int]:
+        """ Return n new run ids, after the largest existing (or reserved) id. """
+        next_id = max(self.get_run_ids() + [int(i) for i in reserved] + [0]) + 1
+        return list(range(next_id, next_id + n))
+
+    def _read_journal(self):
+        with open(self.journal_path) as f:
+            lines = f.read().splitlines()
+
+        journal = json.loads(lines[0])
+        num_done = len([l for l in lines[1:] if l.strip() != ""])
+
+        return journal, num_done
+
+    def _apply_journal(self, journal: dict, num_done: int) -> None:
+        renames = journal["renames"]
+
+        with open(self.journal_path, "a") as f:
+            for src, dst in renames[num_done:]:
+                src_path = self.runs_root / src
+                dst_path = self.runs_root / dst
+
+                # the last rename may have happened before it was written to the journal
+                if (not src_path.exists()) and dst_path.exists():
+                    pass
+                else:
+                    os.rename(src_path, dst_path)
+
+                f.write("1\n")
+                f.flush()
+
+    def _finish_journal(self, journal: dict, mapping: Dict[int, int]) -> None:
+        if self.on_rename is not None:
+            # journals written before they had an id are only ever finished once
+            self.on_rename(mapping, journal.get("id", ""))
+
+        os.remove(self.journal_path)
+
+    def resume(self) -> Optional[Dict[int, int]]:
+        """ Finish the renames of an interrupted apply, returning its mapping. """
+        if not self.journal_path.exists():
+            return None
+
+        try:
+            journal, num_done = self._read_journal()
+        except (ValueError, IndexError) as e:
+            # journals are written atomically, so this can only be an unrelated file
+            logger.info(f"Could not read {self.journal_path} -- {e}, ignoring it")
+            os.remove(self.journal_path)
+            return None
+
+        logger.info(f"Finishing {len(journal['renames']) - num_done} interrupted run id renames")
+        self._apply_journal(journal, num_done)
+
+        mapping = {int(k): int(v) for k, v in journal["mapping"].items()}
+        self._finish_journal(journal, mapping)
+
+        return mapping
+
+    def apply(self, mapping: Dict[int, int], run_index: Optional[RunIndex] = None) -> Dict[int, int]:
+        """ Rename the run folders in mapping (old id -> new id), updating run_index if given. """
+        mapping = {int(k): int(v) for k, v in mapping.items() if int(k) != int(v)}
+
+        if len(mapping) == 0:
+            return mapping
+
+        journal = {
+            "id": uuid.uuid4().hex,
+            "mapping": {str(k): v for k, v in mapping.items()},
+            "renames": plan_renames(mapping, self.get_run_ids()),
+        }
+
+        self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = self.journal_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            f.write(json.dumps(journal) + "\n")
+        os.replace(tmp_path, self.journal_path)
+
+        self._apply_journal(journal, 0)
+
+        if run_index is not None:
+            run_index.rename(mapping)
+
+        self._finish_journal(journal, mapping)
+
+        return mapping
@@ -0,0 +1,169 @@
+"""
+Index of the sacred runs of an experiment.
+
+Reading the config.json and run.json of every run folder is slow when there are many runs. The index stores
+    the experiment_id, status and start_time of every run in a SQLite database (in the sdem tmp folder) together
+    with a signature of its run.json, so that only new or changed run folders need to be read again.
+
+The index is updated by:
+    - refresh, which is called before the index is used and only reads changed run folders
+    - RunIndexObserver (see experiment.py) as experiments run, when the index location is passed
+        through the RUN_INDEX_ENV environment variable
+"""
+import sqlite3
+from pathlib import Path
+from typing import List, Optional
+
+from . import run_folders
+
+# name of the index file inside the sdem tmp folder
+RUN_INDEX_FILE = "run_index.sqlite"
+
+# environment variable used to tell experiments where the run index is
+RUN_INDEX_ENV = "SDEM_RUN_INDEX"
+
+# run folder files that the indexed fields are read from
+INDEX_FILES = ["config.json", "run.json"]
+
+RUN_COLUMNS = ["run_id", "experiment_id", "global_id", "filename", "order_id", "status", "start_time", "signature"]
+
+_CREATE_TABLE = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    experiment_id TEXT,
+    global_id TEXT,
+    filename TEXT,
+    order_id INTEGER,
+    status TEXT,
+    start_time TEXT,
+    signature TEXT
+)
+"""
+
+
+def get_run_signature(run_folder: Path) -> Optional[str]:
+    """
+    Return a string that changes whenever run.json of run_folder changes. The inode is included so that
+        renaming run folders (i.e when fixing run ids) is also detected.
+    """
+    return run_folders.file_signature(Path(run_folder) / "run.json")
+
+
+def get_index_row(run: dict) -> dict:
+    """ Return the indexed fields of a run read by run_folders.read_run_folder. Missing files result in None values. """
+    config = run["config"] or {}
+    run_json = run["run"] or {}
+
+    return {
+        "run_id": run["run_id"],
+        "experiment_id": config.get("experiment_id"),
+        "global_id": config.get("global_id"),
+        "filename": config.get("filename"),
+        "order_id": config.get("order_id"),
+        "status": run_json.get("status"),
+        "start_time": run_json.get("start_time"),
+        "signature": get_run_signature(run["path"]),
+    }
+
+
+def read_run_folder(run_folder: Path) -> dict:
+    """ Read the indexed fields of a single run folder. """
+    return get_index_row(run_folders.read_run_folder(run_folder, INDEX_FILES))
+
+
+class RunIndex:
+    def __init__(self, index_path: Path, runs_root: Path):
+        self.index_path = Path(index_path)
+        self.runs_root = Path(runs_root)
+
+        self.index_path.parent.mkdir(parents=True, exist_ok=True)
+
+        # experiments running in parallel may write to the index at the same time
+        self.conn = sqlite3.connect(str(self.index_path), timeout=60)
+        self.conn.execute(_CREATE_TABLE)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def upsert(self, rows: List[dict]) -> None:
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO runs ({', '.join(RUN_COLUMNS)}) VALUES ({', '.join('?' * len(RUN_COLUMNS))})",
+            [[row.get(c) for c in RUN_COLUMNS] for row in rows],
+        )
+        self.conn.commit()
+
+    def update_run(self, run_id: int) -> None:
+        """ Re-read a single run folder. """
+        self.upsert([read_run_folder(self.runs_root / str(run_id))])
+
+    def remove(self, run_ids: List[int]) -> None:
+        self.conn.executemany("DELETE FROM runs WHERE run_id = ?", [[int(_id)] for _id in run_ids])
+        self.conn.commit()
+
+    def rename(self, mapping: dict) -> None:
+        """ Move the rows of renamed run folders (old run_id -> new run_id). """
+        rows = self.conn.execute(
+            f"SELECT {', '.join(RUN_COLUMNS)} FROM runs WHERE run_id IN ({', '.join('?' * len(mapping))})",
+            [int(_id) for _id in mapping.keys()],
+        ).fetchall()
+
+        renamed = []
+        for row in rows:
+            row = dict(zip(RUN_COLUMNS, row))
+            row["run_id"] = int(mapping[row["run_id"]])
+            renamed.append(row)
+
+        # rows are removed first as run ids may be swapped
+        self.conn.executemany("DELETE FROM runs WHERE run_id = ?", [[int(_id)] for _id in mapping.keys()])
+        self.upsert(renamed)
+
+    def refresh(self) -> "RunIndex":
+        """ Update the index with any run folders that have been added, changed or removed. """
+        on_disk = run_folders.list_run_folders(self.runs_root)
+
+        indexed = dict(self.conn.execute("SELECT run_id, signature FROM runs").fetchall())
+
+        removed = [run_id for run_id in indexed.keys() if run_id not in on_disk]
+        if len(removed) > 0:
+            self.remove(removed)
+
+        to_read = []
+        for run_id, run_folder in on_disk.items():
+            signature = get_run_signature(run_folder)
+
+            # runs without a run.json are always re-read as they may still be starting
+            if (signature is not None) and (indexed.get(run_id) == signature):
+                continue
+
+            to_read.append(run_folder)
+
+        changed = [get_index_row(run) for run in run_folders.read_run_folders(to_read, INDEX_FILES).values()]
+
+        if len(changed) > 0:
+            self.upsert(changed)
+
+        return self
+
+    def get_runs(self) -> List[dict]:
+        """ Return every indexed run ordered by run_id. """
+        rows = self.conn.execute(f"SELECT {', '.join(RUN_COLUMNS)} FROM runs ORDER BY run_id").fetchall()
+        return [dict(zip(RUN_COLUMNS, row)) for row in rows]
+
+    def get_experiment_ids(self, statuses: Optional[List[str]] = None) -> set:
+        """ Return the experiment_ids of all runs, optionally only those runs with a status in statuses. """
+        if statuses is None:
+            rows = self.conn.execute("SELECT DISTINCT experiment_id FROM runs").fetchall()
+        else:
+            rows = self.conn.execute(
+                f"SELECT DISTINCT experiment_id FROM runs WHERE status IN ({', '.join('?' * len(statuses))})",
+                list(statuses),
+            ).fetchall()
+
+        return set(row[0] for row in rows if row[0] is not None)
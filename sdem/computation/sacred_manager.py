@@ -26,6 +26,9 @@ import copy
 from .. import utils
 from .. import template
 from . import manager
+from . import cluster_sync
+from . import run_folders
+from ..results.payload import ARRAYS_SUFFIX
 
 from loguru import logger
 
@@ -50,17 +53,15 @@ def order_experiment_folders_by_datetime(runs_root: Path, experiment_folders:lis
     """ Return experiments from run_roots ordered by experiment start_time. """
 
     # Get experiments from run_roots
+    runs = run_folders.read_run_folders([runs_root / _id for _id in experiment_folders], ["run.json"])
+
     sort_array = []
     for _id in experiment_folders:
-        folder_path = runs_root / _id
-
         try:
-            with open(folder_path / "run.json") as f:
-                d = json.load(f)
-                start_time = dateutil.parser.parse(d["start_time"])
+            start_time = dateutil.parser.parse(runs[int(_id)]["run"]["start_time"])
         except Exception as e:
             logger.info(
-                "Error getting experiment start_time from experient run - {_id}"
+                f"Error getting experiment start_time from experient run - {_id}"
             )
             raise e
 
@@ -77,17 +78,15 @@ def order_experiment_folders_by_datetime(runs_root: Path, experiment_folders:lis
 
 def get_experiment_ids_from_folders(runs_root: Path, experiment_folders: list) -> list:
     """ For each sacred experiment get the corresponding (unique) sdem experiment_id from the config file. """
+    runs = run_folders.read_run_folders([runs_root / _id for _id in experiment_folders], ["config.json"])
+
     experiment_ids = []
     for _id in experiment_folders:
-        folder_path = runs_root / _id
-
         _id = int(_id)
 
         # get experiment+id
         try:
-            with open(folder_path / "config.json") as f:
-                d = json.load(f)
-                experiment_id = d["experiment_id"]
+            experiment_id = runs[_id]["config"]["experiment_id"]
         except Exception as e:
             logger.info(f"Error getting experiment _id from experient run - {_id}")
             raise e
@@ -114,6 +113,7 @@ def prune_unfinished(state, bin_path: Path, experiment_config: dict):
     """
     Go through every experiment and move to bin_path if:
         - the experiment folder is empty 
+        - the config or run file could not be read
         - the status of the sacred experiment is not Completed
     """
     # Get sacred run root
@@ -124,29 +124,23 @@ def prune_unfinished(state, bin_path: Path, experiment_config: dict):
 
     # Delete empty experiment folders
     experiment_folders = delete_empty_experiments(runs_root, experiment_folders, bin_path)
-    all_experiment_ids = get_experiment_ids_from_folders(runs_root, experiment_folders)
 
-    for i, _id in enumerate(experiment_folders):
+    with manager.get_run_index(experiment_config) as run_index:
+        runs = {run['run_id']: run for run in run_index.get_runs()}
+
+    for _id in experiment_folders:
         folder_path = runs_root / _id
 
-        _id = int(_id)
-        try:
-            with open(folder_path / "config.json") as f:
-                d = json.load(f)
-                experiment_id = d["experiment_id"]
-                global_id = d["global_id"]
-
-            with open(folder_path / "run.json") as f:
-                d = json.load(f)
-                status = d["status"]
-        except Exception as e:
+        run = runs.get(int(_id))
+
+        if (run is None) or (run['experiment_id'] is None) or (run['global_id'] is None) or (run['status'] is None):
             if state.verbose:
                 logger.info(f"Error getting experiment _id from experient run - {_id}")
 
             delete_id(folder_path, bin_path)
             continue
 
-        if status != "COMPLETED":
+        if run['status'] != "COMPLETED":
             delete_id(folder_path, bin_path)
 
 def get_sacred_experiment_folders(runs_root: Path) -> list:
@@ -179,41 +173,39 @@ def prune_experiments(state, bin_path: Path, experiment_config:dict):
 
     # Load all sacred runs
     runs_root = manager.get_sacred_runs_path(experiment_config)
-    experiment_folders = get_sacred_experiment_folders(runs_root) 
+
+    # the index drops the runs removed above
+    with manager.get_run_index(experiment_config) as run_index:
+        runs = run_index.get_runs()
 
     # experiment ids ordered by date
-    experiment_folders = order_experiment_folders_by_datetime(runs_root, experiment_folders)
-    all_experiment_ids = get_experiment_ids_from_folders(runs_root, experiment_folders)
+    runs = sorted(
+        runs,
+        key=lambda run: dateutil.parser.parse(run['start_time']) if run['start_time'] else datetime.datetime.min
+    )
 
     # Get all experiments_ids from configs
-    valid_experiment_ids = manager.get_valid_experiment_ids(state)
+    valid_experiment_ids = set(manager.get_valid_experiment_ids(state))
+
+    # the most recent run of each experiment_id
+    last_run_of_experiment = {run['experiment_id']: run['run_id'] for run in runs}
 
     # Remove experiments that do not have a valid id and have been run multiple times, 
     #   saving only the most recent one
-    for i, _id in enumerate(experiment_folders):
-        folder_path = runs_root / _id
-        _id = int(_id)
-
-        try:
-            with open(folder_path / "config.json") as f:
-                d = json.load(f)
-                global_id = d["global_id"]
-                experiment_id = d["experiment_id"]
-        except Exception as e:
-            logger.info(f"Error getting experiment {_id} from experient run - deleting")
-            delete_id(folder_path, bin_path)
-            continue
+    for run in runs:
+        _id = run['run_id']
+        folder_path = runs_root / str(_id)
+        experiment_id = run['experiment_id']
 
         if experiment_id not in valid_experiment_ids:
             if state.verbose:
                 logger.info(f"deleting {_id} because it is not a valid experiment id")
 
             delete_id(folder_path, bin_path)
+            continue
 
         # Check if experiment_id exists multiply times
-        # Since all_experiment_ids is ordred by start_time we only need to check if it exists
-        #   in all_experiment_ids AFTER this one
-        if experiment_id in all_experiment_ids[i + 1 :]:
+        if last_run_of_experiment[experiment_id] != _id:
             if state.verbose:
                 logger.info(f"deleting {_id} because a newer run exists")
 
@@ -238,6 +230,9 @@ def prune_results(state, bin_path: Path, experiment_config: dict):
         for config in all_configs
     ]
 
+    # arrays of results files saved with sdem.results.payload.save_results
+    valid_result_files = set(valid_result_files + [f + ARRAYS_SUFFIX for f in valid_result_files])
+
     results_folders = [f for f in os.listdir(results_root)]
 
     for res in results_folders:
@@ -247,47 +242,29 @@ def prune_results(state, bin_path: Path, experiment_config: dict):
 
 def fix_filestorage_ids(state, experiment_config):
     """
-    Goes through the data twice, once to rename to a temp name to avoid conflict and then to rename to the correct format
+    Renames the runs so that their ids are sequential (from 1) in the order that they were started.
+        The renames are journaled, see run_ids.py.
     """
+    # runs synced from a cluster keep their new ids when synced again
+    allocator = cluster_sync.get_run_id_allocator(experiment_config)
 
-    runs_root = manager.get_sacred_runs_path(experiment_config)
-    experiment_folders = get_sacred_experiment_folders(runs_root) 
+    with manager.get_run_index(experiment_config) as run_index:
+        runs = run_index.get_runs()
 
-    # sort experiments by datetime
-    experiment_folders = order_experiment_folders_by_datetime(runs_root, experiment_folders)
+        for run in runs:
+            if run["start_time"] is None:
+                raise ValueError(f"Error getting experiment start_time from experiment run - {run['run_id']}")
 
-    to_change = []
-    for i, _id in enumerate(experiment_folders):
-        folder_path = runs_root / _id
-        _id = int(_id)
+        # sort experiments by datetime
+        runs = sorted(runs, key=lambda run: (dateutil.parser.parse(run["start_time"]), run["run_id"]))
 
         # sacred run ids start from 1
-        new_id = i + 1
-
-        new_folder_path = runs_root /  f"{str(new_id)}.tmp"
-
-        # Do not rename if it will overwrite something
-        if new_folder_path.exists():
-            logger.info(f'{new_folder_path} exists -- skipping!')
-            continue
-
-        to_change.append(new_folder_path)
+        mapping = {run["run_id"]: i + 1 for i, run in enumerate(runs)}
 
-        if state.verbose:
-            logger.info(f"Renaming: {folder_path} -> {new_folder_path}")
-
-
-        os.rename(str(folder_path), str(new_folder_path))
-
-    for _file in to_change:
-        new_folder_path = runs_root / _file.stem 
-
-        # Do not rename if it will overwrite something
-        if new_folder_path.exists():
-            logger.info(f'{new_folder_path} exists -- skipping!')
-            continue
+        mapping = allocator.apply(mapping, run_index=run_index)
 
-        if state.verbose:
-            logger.info(f"Renaming: {_file} -> {new_folder_path}")
+    if state.verbose:
+        for _id, new_id in mapping.items():
+            logger.info(f"Renaming: {_id} -> {new_id}")
 
-        os.rename(str(_file), str(new_folder_path))
+    state.console.print(f"Renamed {len(mapping)} runs")
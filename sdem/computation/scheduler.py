@@ -0,0 +1,300 @@
+"""
+Runs shell commands concurrently on the local machine.
+
+Each task is launched as a subprocess with its output streamed to its own log file. Tasks can declare the
+    number of cpus and memory they need and are packed onto the machine so that these stay within the budget
+    of the scheduler. The peak memory and cpu time of every finished task is recorded so that it can be used
+    to estimate the resources of future runs.
+"""
+import os
+import signal
+import sys
+import subprocess
+import time
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from rich.live import Live
+from rich.table import Table
+
+from .. import utils
+
+PENDING = "pending"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+STATUS_STYLE = {
+    PENDING: "dim",
+    RUNNING: "yellow",
+    COMPLETED: "green",
+    FAILED: "red bold",
+}
+
+
+def _wait_status_to_exitcode(wait_status: int) -> int:
+    if os.WIFSIGNALED(wait_status):
+        return -os.WTERMSIG(wait_status)
+    return os.WEXITSTATUS(wait_status)
+
+
+class Task:
+    """
+    A shell command to run.
+
+    on_finish is called with the finished task and can return a list of new tasks to schedule.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        command: str,
+        log_file: Path,
+        cpus: int = 1,
+        memory: Optional[int] = None,
+        env: Optional[dict] = None,
+        on_finish: Optional[Callable[["Task"], Optional[List["Task"]]]] = None,
+    ):
+        self.name = name
+        self.command = command
+        self.log_file = Path(log_file)
+        self.cpus = cpus
+        self.memory = memory
+        self.env = env
+        self.on_finish = on_finish
+
+        self.status = PENDING
+        self.process = None
+        self.start_time = None
+        self.end_time = None
+        self.returncode = None
+
+        # measured once the task has finished
+        self.peak_rss = None
+        self.cpu_time = None
+
+        # number of times other tasks were started ahead of this one
+        self.skipped = 0
+
+        self._log_handle = None
+
+    @property
+    def elapsed(self) -> float:
+        if self.start_time is None:
+            return 0.0
+
+        end_time = self.end_time if self.end_time is not None else time.time()
+        return end_time - self.start_time
+
+    def start(self):
+        self.log_file.parent.mkdir(parents=True, exist_ok=True)
+        self._log_handle = open(self.log_file, "w")
+
+        env = os.environ.copy()
+        if self.env is not None:
+            env.update(self.env)
+
+        self.process = subprocess.Popen(
+            self.command,
+            shell=True,
+            stdout=self._log_handle,
+            stderr=subprocess.STDOUT,
+            env=env,
+            # commands are compound shell commands (i.e cd models; python ...), so they are run in their own
+            #   process group that can be terminated as a whole
+            start_new_session=True,
+        )
+        self.start_time = time.time()
+        self.status = RUNNING
+
+    def poll(self) -> bool:
+        """ Return true if the task has finished. """
+        # wait4 also gives us the resource usage of the finished process (and the processes it waited for)
+        try:
+            pid, wait_status, rusage = os.wait4(self.process.pid, os.WNOHANG)
+        except ChildProcessError:
+            # already reaped
+            pid, wait_status, rusage = self.process.pid, None, None
+
+        if pid == 0:
+            return False
+
+        if wait_status is None:
+            returncode = self.process.poll()
+        else:
+            returncode = _wait_status_to_exitcode(wait_status)
+            # stop Popen from trying to wait for the process again
+            self.process.returncode = returncode
+
+        if rusage is not None:
+            # ru_maxrss is in kilobytes on linux and bytes on mac
+            self.peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            self.cpu_time = rusage.ru_utime + rusage.ru_stime
+
+        self.finish(returncode)
+        return True
+
+    def finish(self, returncode: int):
+        self.returncode = returncode
+        self.end_time = time.time()
+        self.status = COMPLETED if returncode == 0 else FAILED
+
+        if self._log_handle is not None:
+            self._log_handle.close()
+            self._log_handle = None
+
+    def terminate(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                os.killpg(os.getpgid(self.process.pid), signal.SIGTERM)
+            except ProcessLookupError:
+                # finished in the meantime
+                pass
+
+
+class LocalScheduler:
+    """
+    Packs pending tasks onto the machine so that the cpus and memory of running tasks stay within the budget.
+
+    Tasks are considered largest first (by memory then cpus) and every task that fits in what is left is started,
+        so small tasks fill the gaps left by large ones. So that large tasks are not starved, once a task
+        has had max_skips other tasks started ahead of it, no more tasks are started until it fits.
+
+    Args:
+        jobs: maximum number of cpus in use at any time. A task that asks for more cpus than jobs is given all of them.
+        memory: maximum memory (bytes) in use at any time. Only tasks with a memory hint count towards this.
+    """
+
+    def __init__(self, state, jobs: int, memory: Optional[int] = None, poll_interval: float = 0.5, max_skips: int = 50):
+        self.state = state
+        self.jobs = max(int(jobs), 1)
+        self.memory = memory
+        self.poll_interval = poll_interval
+        self.max_skips = max_skips
+
+        self.tasks: List[Task] = []
+
+    def add(self, task: Task) -> None:
+        self.tasks.append(task)
+
+    def _cpus(self, task: Task) -> int:
+        return min(max(int(task.cpus), 1), self.jobs)
+
+    def _fits(self, task: Task, running: List[Task]) -> bool:
+        if len(running) == 0:
+            # always allow a single task to run, even if it is larger than the budget
+            return True
+
+        used_cpus = sum(self._cpus(t) for t in running)
+        if used_cpus + self._cpus(task) > self.jobs:
+            return False
+
+        if (self.memory is not None) and (task.memory is not None):
+            used_memory = sum(t.memory for t in running if t.memory is not None)
+            if used_memory + task.memory > self.memory:
+                return False
+
+        return True
+
+    def _size(self, task: Task) -> tuple:
+        return (task.memory if task.memory is not None else 0, self._cpus(task))
+
+    def next_tasks(self, pending: List[Task], running: List[Task]) -> List[Task]:
+        """ Return the pending tasks to start now. """
+        to_start = []
+        blocked = []
+
+        for task in sorted(pending, key=self._size, reverse=True):
+            if self._fits(task, running + to_start):
+                if any(t.skipped >= self.max_skips for t in blocked):
+                    # drain the machine until the starved task fits
+                    break
+
+                to_start.append(task)
+            else:
+                blocked.append(task)
+
+        if len(to_start) > 0:
+            for task in blocked:
+                task.skipped += 1
+
+        return to_start
+
+    def get_table(self) -> Table:
+        counts = {s: 0 for s in STATUS_STYLE.keys()}
+        for task in self.tasks:
+            counts[task.status] += 1
+
+        table = Table(
+            title=" ".join(f"[{STATUS_STYLE[s]}]{s}: {n}[/]" for s, n in counts.items()),
+            show_header=True,
+        )
+        table.add_column("Experiment")
+        table.add_column("Status")
+        table.add_column("Time", justify="right")
+        table.add_column("Exit code", justify="right")
+        table.add_column("Peak memory", justify="right")
+        table.add_column("Log")
+
+        # only show running tasks and the most recently finished ones so that the table fits on screen
+        running = [t for t in self.tasks if t.status == RUNNING]
+        finished = [t for t in self.tasks if t.status in (COMPLETED, FAILED)]
+        finished = sorted(finished, key=lambda t: t.end_time)[-10:]
+
+        for task in running + finished:
+            table.add_row(
+                task.name,
+                f"[{STATUS_STYLE[task.status]}]{task.status}[/]",
+                f"{task.elapsed:.0f}s",
+                "" if task.returncode is None else str(task.returncode),
+                "" if task.peak_rss is None else utils.format_memory(task.peak_rss),
+                str(task.log_file),
+            )
+
+        return table
+
+    def run(self) -> List[Task]:
+        """ Run all tasks and return them once they have all finished. """
+        pending = list(self.tasks)
+        running = []
+
+        try:
+            with Live(self.get_table(), console=self.state.console, refresh_per_second=2) as live:
+                while len(pending) > 0 or len(running) > 0:
+                    for task in self.next_tasks(pending, running):
+                        pending.remove(task)
+                        task.start()
+                        running.append(task)
+
+                    time.sleep(self.poll_interval)
+
+                    for task in list(running):
+                        if not task.poll():
+                            continue
+
+                        running.remove(task)
+
+                        if task.on_finish is not None:
+                            new_tasks = task.on_finish(task) or []
+                            for new_task in new_tasks:
+                                self.add(new_task)
+                                pending.append(new_task)
+
+                    live.update(self.get_table())
+        except KeyboardInterrupt:
+            for task in running:
+                task.terminate()
+            raise
+
+        return self.tasks
+
+    def summary(self) -> None:
+        failed = [t for t in self.tasks if t.status == FAILED]
+
+        if len(failed) == 0:
+            self.state.console.print(f"[bold green]All {len(self.tasks)} experiments finished successfully[/]")
+            return
+
+        self.state.error(f"{len(failed)}/{len(self.tasks)} experiments failed:")
+        for task in failed:
+            self.state.console.print(f"    {task.name} (exit code {task.returncode}) -- see {task.log_file}")
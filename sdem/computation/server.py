@@ -6,17 +6,41 @@ from .. import utils
 from . import manager
 
 import os
+import json
+import datetime
 
 import shutil
 import zipfile
 import subprocess
 from pathlib import Path
 
+from rich.table import Table
+
 from . import cluster
 
+# the scheduler is shipped in the jobs folder, see server_scheduler.py
+SCHEDULER_FILE = "jobs/sdem_scheduler.py"
+
+# logs, done markers and the status of the scheduler, inside the experiment folder on the server
+SERVER_STATE_FOLDER = "jobs/server"
+
+# used when the server config does not have a run_command, run from the home folder of the server
+DEFAULT_SERVER_RUN_COMMAND = "cd {experiment_name}/models && python {filename} {order_id}"
+
+# the scheduler is detached so that it keeps running once ssh exits
+SERVER_RUN_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'bash -s' << 'HERE'
+mkdir -p {exp_name}/{state_folder}
+nohup {python} {exp_name}/{scheduler} --commands {exp_name}/{run_file} --jobs {jobs} --state-dir {exp_name}/{state_folder} >> {exp_name}/{state_folder}/scheduler.log 2>&1 < /dev/null &
+echo "Started scheduler with pid $!"
+HERE"""
+
+SERVER_STATUS_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'cat {exp_name}/{state_folder}/status.json 2>/dev/null'"""
+
+
 def make_run_file(state, configs_to_run, run_settings, experiment_name, experiment_config, cluster_config):
+    """ Write the run file with a named command (name<TAB>command) for every config. """
 
-    run_template = cluster_config['run_command']
+    run_template = cluster_config.get('run_command', DEFAULT_SERVER_RUN_COMMAND)
 
     fname = Path(f'jobs/run_{experiment_name}.sh')
 
@@ -25,8 +49,9 @@ def make_run_file(state, configs_to_run, run_settings, experiment_name, experime
 
     with open (fname, 'w') as rsh:
         for config in configs_to_run:
+            name = "{stem}_{order_id}".format(stem=Path(config['filename']).stem, order_id=config['order_id'])
             rsh.writelines(
-                run_template.format(
+                name + '\t' + run_template.format(
                     experiment_name=experiment_name,
                     filename=config['filename'],
                     order_id=config['order_id'],
@@ -35,12 +60,41 @@ def make_run_file(state, configs_to_run, run_settings, experiment_name, experime
 
     return fname
 
+
+def get_server_jobs(run_settings, cluster_config) -> int:
+    """ Number of configs run at the same time, --jobs takes priority over the jobs of the server config. """
+    if run_settings.get('jobs', 1) > 1:
+        return run_settings['jobs']
+
+    return cluster_config.get('jobs', 1)
+
+
+def start_scheduler(state, run_file, jobs, experiment_name, cluster_config):
+    cluster.ssh(
+        SERVER_RUN_SCRIPT,
+        cluster_config = cluster_config,
+        exp_name=experiment_name,
+        python=cluster_config.get('python', 'python3'),
+        scheduler=SCHEDULER_FILE,
+        run_file=run_file,
+        jobs=jobs,
+        state_folder=SERVER_STATE_FOLDER,
+        run = True,
+        verbose=state.verbose
+    )
+
+
 def server_run(state, configs_to_run, run_settings, location):
+    """
+    Move the experiment to the server and run every config on a scheduler (see server_scheduler.py) that is
+        started over ssh and runs get_server_jobs configs at the same time. Configs that have already finished
+        on the server are skipped, so running again (with --no-check) resumes an interrupted run.
+    """
     experiment_config = state.experiment_config
     cluster_config = cluster.get_cluster_config(experiment_config, location)
     experiment_name = manager.get_experiment_name(experiment_config)
 
-    if run_settings['check_cluster']:
+    if run_settings['check_cluster'] and (cluster_config['upload'] != 'incremental'):
         if cluster.check_if_experiment_exists_on_cluster(experiment_name, cluster_config):
             if state.verbose:
                 logger.info(f"Experiment is already on server - {location}, exiting!")
@@ -54,12 +108,57 @@ def server_run(state, configs_to_run, run_settings, location):
     # make run file
     run_file: Path  = make_run_file(state, configs_to_run, run_settings, experiment_name, experiment_config, cluster_config)
 
-    # add run file to be synced
+    # ship the scheduler with the experiment
+    shutil.copyfile(Path(__file__).parent / 'server_scheduler.py', SCHEDULER_FILE)
+
+    cluster.upload_experiment(state, configs_to_run, run_settings, experiment_name, cluster_config)
+
+    if run_settings['run_sbatch']:
+        jobs = get_server_jobs(run_settings, cluster_config)
+        state.console.print(f"Running {len(configs_to_run)} configs on {location} with {jobs} processes")
+
+        start_scheduler(state, run_file, jobs, experiment_name, cluster_config)
+
+
+def server_status(state, location):
+    """ Print the progress of the scheduler on the server. """
+    experiment_config = state.experiment_config
+    cluster_config = cluster.get_cluster_config(experiment_config, location)
+    experiment_name = manager.get_experiment_name(experiment_config)
 
-    cluster.compress_files_for_cluster(
-        state, configs_to_run, run_settings, experiment_name, cluster_config
+    script = cluster.ssh(
+        SERVER_STATUS_SCRIPT,
+        cluster_config = cluster_config,
+        exp_name=experiment_name,
+        state_folder=SERVER_STATE_FOLDER,
+        run = False
     )
-    cluster.move_files_to_cluster(state, configs_to_run, run_settings, experiment_name, cluster_config)
+
+    cout = subprocess.run(script, stdout=subprocess.PIPE, shell=True).stdout.decode("utf-8")
+
+    try:
+        status = json.loads(cout)
+    except ValueError:
+        state.console.print(f"Nothing has been run on {location}")
+        return None
+
+    table = Table(show_header=True)
+    for col in ["Total", "Pending", "Running", "Completed", "Failed", "Processes", "Elapsed", "State"]:
+        table.add_column(col)
+
+    table.add_row(
+        str(status['total']),
+        str(status['pending']),
+        str(status['running']),
+        str(status['completed']),
+        str(status['failed']),
+        str(status['jobs']),
+        str(datetime.timedelta(seconds=int(status['updated'] - status['started']))),
+        'finished' if status['finished'] else 'running',
+    )
+
+    state.console.print(table)
+    state.console.print(f"Logs are in ~/{experiment_name}/{SERVER_STATE_FOLDER}/logs on {location}")
 
 
 def sync(location):
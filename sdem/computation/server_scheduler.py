@@ -0,0 +1,204 @@
+"""
+Runs the commands of a run file on a pool of processes.
+
+This file is copied into the jobs folder of the experiment and run on the server (see server.py), so it must only
+    use the standard library. Every line of the run file is a command, optionally preceded by a name and a tab.
+    Each command is run in a shell with its output written to {state_dir}/logs/{name}.log, and is marked as
+    finished in {state_dir}/done/{name} together with its exit code. When the scheduler is started again commands
+    that have already finished successfully are skipped, so an interrupted run can be resumed.
+
+The progress of the run is written to {state_dir}/status.json.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+
+STATUS_FILE = "status.json"
+PID_FILE = "scheduler.pid"
+
+# seconds that commands are given to exit after SIGTERM before they are killed
+STOP_TIMEOUT = 10
+
+
+def read_commands(run_file):
+    """ Return (name, command) of every line in run_file. Lines without a name are named by their line number. """
+    commands = []
+
+    with open(run_file) as f:
+        for i, line in enumerate(f.read().splitlines()):
+            if line.strip() == "":
+                continue
+
+            if "\t" in line:
+                name, command = line.split("\t", 1)
+            else:
+                name, command = str(i), line
+
+            commands.append((name, command))
+
+    return commands
+
+
+def write_atomic(path, s):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(s)
+
+    os.replace(tmp_path, path)
+
+
+def read_exit_code(done_file):
+    try:
+        with open(done_file) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+
+def is_running(pid_file):
+    """ Return true if a scheduler is running with the pid stored in pid_file. """
+    try:
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+    except (OSError, ValueError):
+        return False
+
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+
+    return pid != os.getpid()
+
+
+def signal_group(proc, signum):
+    """ Send signum to every process started by the command of proc. """
+    try:
+        os.killpg(os.getpgid(proc.pid), signum)
+    except ProcessLookupError:
+        # finished in the meantime
+        pass
+
+
+def run(run_file, jobs, state_dir, retry_failed=True):
+    log_dir = os.path.join(state_dir, "logs")
+    done_dir = os.path.join(state_dir, "done")
+    os.makedirs(log_dir, exist_ok=True)
+    os.makedirs(done_dir, exist_ok=True)
+
+    pid_file = os.path.join(state_dir, PID_FILE)
+    if is_running(pid_file):
+        print(f"A scheduler is already running for {state_dir}, exiting")
+        return 1
+
+    write_atomic(pid_file, str(os.getpid()))
+
+    commands = read_commands(run_file)
+
+    todo = []
+    skipped = 0
+    for name, command in commands:
+        exit_code = read_exit_code(os.path.join(done_dir, name))
+
+        if (exit_code == 0) or ((exit_code is not None) and not retry_failed):
+            skipped += 1
+            continue
+
+        todo.append((name, command))
+
+    print(f"Running {len(todo)}/{len(commands)} commands on {jobs} processes ({skipped} already finished)", flush=True)
+
+    # name -> (process, log file)
+    running = {}
+    completed = skipped
+    failed = 0
+    start_time = time.time()
+
+    def write_status():
+        status = {
+            "total": len(commands),
+            "pending": len(todo),
+            "running": len(running),
+            "completed": completed,
+            "failed": failed,
+            "jobs": jobs,
+            "pid": os.getpid(),
+            "started": start_time,
+            "updated": time.time(),
+            "finished": (len(todo) == 0) and (len(running) == 0),
+        }
+        write_atomic(os.path.join(state_dir, STATUS_FILE), json.dumps(status))
+
+    def stop(signum, frame):
+        # stopped commands have no done marker and so are run again when the scheduler is restarted
+        for proc, log in running.values():
+            signal_group(proc, signal.SIGTERM)
+
+        for proc, log in running.values():
+            try:
+                proc.wait(timeout=STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                signal_group(proc, signal.SIGKILL)
+
+        os.remove(pid_file)
+        sys.exit(1)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    # commands are started from the folder that the scheduler was started from
+    todo.reverse()
+    while (len(todo) > 0) or (len(running) > 0):
+        while (len(todo) > 0) and (len(running) < jobs):
+            name, command = todo.pop()
+
+            log = open(os.path.join(log_dir, f"{name}.log"), "w")
+            # commands are compound shell commands (i.e cd models && python ...), so they are run in their own
+            #   process group that can be stopped as a whole
+            proc = subprocess.Popen(command, shell=True, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+            running[name] = (proc, log)
+
+        for name, (proc, log) in list(running.items()):
+            exit_code = proc.poll()
+            if exit_code is None:
+                continue
+
+            log.close()
+            del running[name]
+
+            write_atomic(os.path.join(done_dir, name), str(exit_code))
+
+            if exit_code == 0:
+                completed += 1
+            else:
+                failed += 1
+                print(f"{name} failed with exit code {exit_code}", flush=True)
+
+        write_status()
+        time.sleep(0.5)
+
+    write_status()
+    os.remove(pid_file)
+
+    print(f"Finished, {completed} completed and {failed} failed", flush=True)
+
+    return 0 if failed == 0 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--commands", required=True, help="Run file with one command per line")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="Number of commands to run at the same time")
+    parser.add_argument("--state-dir", required=True, help="Folder for logs, done markers and the status file")
+    parser.add_argument("--no-retry-failed", action="store_true", help="Do not run failed commands again")
+    args = parser.parse_args()
+
+    sys.exit(run(args.commands, max(args.jobs, 1), args.state_dir, retry_failed=not args.no_retry_failed))
+
+
+if __name__ == "__main__":
+    main()
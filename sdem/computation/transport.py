@@ -0,0 +1,106 @@
+"""
+Builds the ssh and scp commands used to talk to a cluster.
+
+The transport of a cluster is looked up with dispatch using the `transport` key of the cluster config (default ssh),
+    so that other transports, i.e a stand-in for a local sshd in tests, can be registered with
+    @dispatch.register("transport", name). A transport is created from the cluster config and must provide
+    ssh_command, scp_command, start and stop (see SSHTransport).
+
+The ssh transport shares a single connection (an ssh ControlMaster) between all commands, so that the jump host
+    and any 2FA prompt are only gone through once. cluster.session keeps this connection open for the lifetime of
+    an sdem command and closes it afterwards.
+"""
+import os
+import subprocess
+import tempfile
+
+from loguru import logger
+
+from .. import dispatch
+
+# %C is replaced by ssh with a hash of the connection (local host, remote host, port and user)
+CONTROL_PATH = os.path.join(tempfile.gettempdir(), "sdem-ssh-%C")
+
+# seconds that an unused shared connection is kept open for
+CONTROL_PERSIST = 600
+
+# number of sessions using each shared connection, so that nested sessions do not close it early
+_SESSIONS = {}
+
+
+class SSHTransport:
+    def __init__(self, cluster_config):
+        self.cluster_config = cluster_config
+
+        self.ssh_bin = cluster_config.get("ssh_bin", "ssh")
+        self.scp_bin = cluster_config.get("scp_bin", "scp")
+        self.multiplex = cluster_config.get("multiplex", True)
+
+        self.remotehost = "{user}@{host}".format(
+            user=cluster_config["user"], host=cluster_config["host"]
+        )
+
+    def _options(self) -> str:
+        s_part = ""
+
+        if self.cluster_config["ssh_config_file"] is not None:
+            s_part += '-F "%s" ' % (self.cluster_config["ssh_config_file"],)
+
+        if self.cluster_config["jump_host"] is not None:
+            s_part += '-J %s ' % (self.cluster_config["jump_host"],)
+
+        if self.cluster_config["key"] is not None:
+            s_part += '-i %s ' % (self.cluster_config["key"],)
+
+        if self.multiplex:
+            s_part += f"-o ControlMaster=auto -o ControlPath={CONTROL_PATH} -o ControlPersist={CONTROL_PERSIST} "
+
+        return s_part
+
+    def ssh_command(self, remote=True) -> str:
+        """ Return the ssh command with authentication options, followed by the remote host if remote is true. """
+        s_part = f"{self.ssh_bin} " + self._options()
+
+        if not remote:
+            return s_part
+
+        return s_part + '"%s"' % (self.remotehost,)
+
+    def scp_command(self) -> str:
+        return f"{self.scp_bin} " + self._options()
+
+    def _control(self, command) -> int:
+        script = f'{self.ssh_command(remote=False)} -O {command} "{self.remotehost}"'
+        return subprocess.run(script, shell=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+
+    def start(self) -> None:
+        """ Open the shared connection if it is not already open. """
+        if not self.multiplex:
+            return
+
+        if _SESSIONS.get(self.remotehost, 0) == 0:
+            if self._control("check") != 0:
+                # -f backgrounds ssh once authenticated, so any password or 2FA prompt happens here
+                logger.info(f"Opening shared ssh connection to {self.remotehost}")
+                os.system(f'{self.ssh_command(remote=False)} -M -N -f "{self.remotehost}"')
+
+        _SESSIONS[self.remotehost] = _SESSIONS.get(self.remotehost, 0) + 1
+
+    def stop(self) -> None:
+        """ Close the shared connection once the last session using it has finished. """
+        if not self.multiplex:
+            return
+
+        _SESSIONS[self.remotehost] = _SESSIONS.get(self.remotehost, 1) - 1
+
+        if _SESSIONS[self.remotehost] == 0:
+            self._control("exit")
+
+
+@dispatch.register("transport", "ssh")
+def ssh_transport(cluster_config):
+    return SSHTransport(cluster_config)
+
+
+def get_transport(cluster_config):
+    return dispatch.dispatch("transport", cluster_config.get("transport", "ssh"))(cluster_config)
@@ -0,0 +1,306 @@
+"""
+Incremental upload of an experiment to a cluster.
+
+Instead of zipping and copying every file on every run, the sha256 of every file to upload is compared against
+    a manifest stored in the experiment folder on the cluster and only files that have changed are streamed
+    over ssh as an (uncompressed) tar. Files whose contents already exist on the cluster under another
+    path are copied remotely instead of being sent again.
+
+Folders listed under `symlink` in the cluster config, i.e {'data/': '/scratch/shared/data'}, are not uploaded
+    and instead linked to an existing folder on the cluster.
+
+With upload: stream every file is streamed as a tar without being hashed, which avoids both writing and
+    copying a zip. In both modes the tar can be compressed on the fly with zstd (multithreaded) or gzip by
+    setting `compression` in the cluster config, which requires the same tool on the cluster.
+"""
+import json
+import os
+import shlex
+import subprocess
+import tarfile
+import io
+from pathlib import Path
+
+from loguru import logger
+
+from .. import utils
+from . import manager
+from . import cluster
+from .config_cache import hash_file
+
+# manifest of uploaded files, stored inside the experiment folder on the cluster
+MANIFEST_FILE = ".sdem_manifest.json"
+
+# local cache of file hashes, stored in the sdem tmp folder
+HASH_CACHE_FILE = "upload_hashes.json"
+
+# suffix of the temporary files that files are copied to on the cluster
+COPY_SUFFIX = ".sdem_copy"
+
+REMOTE_MANIFEST_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'cat {exp_name}/{manifest} 2>/dev/null'"""
+
+REMOTE_UNTAR_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'mkdir -p {exp_name} && {decompress} tar -xf - -C {exp_name}'"""
+
+# compression -> (local command that compresses stdin, remote command that decompresses it)
+STREAM_COMPRESSION = {
+    "none": (None, ""),
+    "zstd": ("zstd -T0 -3 -q -c", "zstd -d -q -c |"),
+    "gzip": ("gzip -1 -c", "gzip -d -c |"),
+}
+
+REMOTE_COMMANDS_SCRIPT = """{ssh_auth} -o StrictHostKeyChecking=no 'bash -s' << 'HERE'
+mkdir -p {exp_name}
+cd {exp_name}
+{commands}
+HERE"""
+
+
+def get_files_to_upload(cluster_config, include_dirs=False) -> dict:
+    """
+    Return a dict from the path of every file on the cluster (relative to the experiment folder) to its local path.
+        When include_dirs is true folders are also included so that empty folders are created on the cluster.
+    """
+    files_to_move, folders_to_ignore = cluster.get_files_to_move(cluster_config)
+
+    symlinks = cluster_config.get("symlink") or {}
+    symlinked = [os.path.normpath(d) for d in symlinks.keys()]
+
+    files = {}
+
+    def add(local_file, target):
+        # like unzip, files outside of the experiment folder (i.e ../project_config.yaml) are put at its root
+        parts = Path(os.path.normpath(target)).parts
+        while (len(parts) > 1) and (parts[0] == ".."):
+            parts = parts[1:]
+        target = os.path.join(*parts)
+
+        if any((target == d) or target.startswith(d + os.sep) for d in symlinked):
+            return
+
+        files[target] = local_file
+
+    for f in files_to_move + ["models/"]:
+        if f is None:
+            continue
+
+        if type(f) == list:
+            # this defines a file/folder with a target folder structure
+            f_to_upload = f[0]
+            f_target = f[1]
+
+            if os.path.isdir(f_to_upload):
+                for local_file, target in utils.iter_dir_files(f_to_upload, dir_path=f_target, include_dirs=include_dirs):
+                    add(local_file, target)
+            elif os.path.exists(f_to_upload):
+                add(f_to_upload, os.path.normpath(f_target))
+
+        elif os.path.isdir(f):
+            ignore = folders_to_ignore if os.path.normpath(f) == "models" else None
+            for local_file, target in utils.iter_dir_files(f, ignore_dir_arr=ignore, include_dirs=include_dirs):
+                add(local_file, target)
+
+        elif os.path.exists(f):
+            add(f, os.path.normpath(f))
+
+    return files
+
+
+def hash_files(files: dict, cache_file: Path) -> dict:
+    """
+    Return a dict from target to the sha256 of the local file. Hashes are cached by path, mtime and size so
+        that large unchanged files are not read again.
+    """
+    cache = {}
+    if cache_file.exists():
+        try:
+            cache = utils.json_from_file(cache_file)
+        except Exception as e:
+            logger.info(f"Could not read {cache_file} -- {e}")
+
+    hashes = {}
+    new_cache = {}
+    for target, local_file in files.items():
+        local_file = os.path.abspath(local_file)
+        st = os.stat(local_file)
+        signature = [st.st_mtime_ns, st.st_size]
+
+        cached = cache.get(local_file)
+        if (cached is not None) and (cached[:2] == signature):
+            sha = cached[2]
+        else:
+            sha = hash_file(local_file)
+
+        hashes[target] = sha
+        new_cache[local_file] = signature + [sha]
+
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(cache_file, "w") as f:
+        json.dump(new_cache, f)
+
+    return hashes
+
+
+def get_remote_manifest(cluster_config, experiment_name) -> dict:
+    """ Return the manifest of the files on the cluster, empty if nothing has been uploaded. """
+    script = cluster.ssh(
+        REMOTE_MANIFEST_SCRIPT,
+        cluster_config=cluster_config,
+        exp_name=experiment_name,
+        manifest=MANIFEST_FILE,
+        run=False,
+    )
+
+    cout = subprocess.run(script, stdout=subprocess.PIPE, shell=True).stdout.decode("utf-8")
+
+    try:
+        return json.loads(cout)
+    except ValueError:
+        return {}
+
+
+def run_remote_commands(cluster_config, experiment_name, commands) -> None:
+    if len(commands) == 0:
+        return
+
+    cluster.ssh(
+        REMOTE_COMMANDS_SCRIPT,
+        cluster_config=cluster_config,
+        exp_name=experiment_name,
+        commands="\n".join(commands),
+        run=True,
+    )
+
+
+def stream_files(cluster_config, experiment_name, files: dict, manifest=None) -> None:
+    """
+    Stream files (target -> local file) to the cluster as a single tar, compressed with the `compression` of the
+        cluster config, followed by the new manifest if given.
+    """
+    compression = cluster_config.get("compression") or "none"
+    if compression not in STREAM_COMPRESSION.keys():
+        raise ValueError(f"Unknown compression {compression}, expected one of {list(STREAM_COMPRESSION.keys())}")
+
+    compress, decompress = STREAM_COMPRESSION[compression]
+
+    script = cluster.ssh(
+        REMOTE_UNTAR_SCRIPT,
+        cluster_config=cluster_config,
+        exp_name=experiment_name,
+        decompress=decompress,
+        run=False,
+    )
+
+    if compress is not None:
+        script = f"set -o pipefail; {compress} | {script}"
+
+    proc = subprocess.Popen(script, shell=True, stdin=subprocess.PIPE, executable="/bin/bash")
+
+    # the tar is written straight into the pipe, nothing is written to disk
+    with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+        for target, local_file in files.items():
+            tar.add(local_file, arcname=target, recursive=False)
+
+        if manifest is not None:
+            # the manifest is written last so that an interrupted upload is sent again next time
+            manifest_bytes = json.dumps(manifest).encode("utf-8")
+            info = tarfile.TarInfo(MANIFEST_FILE)
+            info.size = len(manifest_bytes)
+            tar.addfile(info, io.BytesIO(manifest_bytes))
+
+    proc.stdin.close()
+
+    if proc.wait() != 0:
+        raise RuntimeError(f"Uploading files to {cluster.get_remote_host(cluster_config)} failed")
+
+
+def get_setup_commands(configs_to_run, cluster_config) -> list:
+    """ Return the commands that create the symlinks, results/ and slurm log folders inside the experiment folder. """
+    commands = []
+
+    for local_dir, remote_dir in (cluster_config.get("symlink") or {}).items():
+        d = shlex.quote(os.path.normpath(local_dir))
+        commands.append(f"if [ -e {d} ] && [ ! -L {d} ]; then rm -rf {d}; fi")
+        commands.append(f"ln -sfn {shlex.quote(remote_dir)} {d}")
+
+    commands.append("mkdir -p results")
+
+    files_to_run = list(set([c["filename"] for c in configs_to_run]))
+    for _file in files_to_run:
+        _filename = os.path.splitext(os.path.basename(_file))[0]
+        commands.append(f"mkdir -p jobs/{_filename}/slurm")
+
+    return commands
+
+
+def stream_upload(state, configs_to_run, run_settings, experiment_name, cluster_config) -> None:
+    """ Stream every file to the cluster as a tar and prepare the experiment folder so that jobs can be submitted. """
+    files = get_files_to_upload(cluster_config, include_dirs=True)
+
+    send_size = sum(os.path.getsize(f) for f in files.values() if not os.path.isdir(f))
+    state.console.print(
+        f"Streaming {len(files)} files ({utils.format_memory(send_size)}) to the cluster "
+        f"with compression {cluster_config.get('compression') or 'none'}"
+    )
+
+    stream_files(cluster_config, experiment_name, files)
+
+    # the uploaded files no longer match the manifest of a previous incremental upload
+    commands = [f"rm -f {MANIFEST_FILE}"] + get_setup_commands(configs_to_run, cluster_config)
+    run_remote_commands(cluster_config, experiment_name, commands)
+
+
+def incremental_upload(state, configs_to_run, run_settings, experiment_name, cluster_config) -> None:
+    """
+    Upload only the files that differ from the manifest on the cluster and prepare the experiment folder
+        (results/, slurm log folders and symlinks) so that jobs can be submitted.
+    """
+    experiment_config = state.experiment_config
+
+    files = get_files_to_upload(cluster_config, include_dirs=True)
+
+    folders = [t for t, f in files.items() if os.path.isdir(f)]
+    files = {t: f for t, f in files.items() if not os.path.isdir(f)}
+
+    hashes = hash_files(files, manager.get_tmp_folder_path(experiment_config) / HASH_CACHE_FILE)
+
+    remote_manifest = get_remote_manifest(cluster_config, experiment_name)
+
+    changed = [t for t, sha in hashes.items() if remote_manifest.get(t) != sha]
+    deleted = [t for t in remote_manifest.keys() if t not in hashes]
+
+    # files whose contents are already on the cluster are copied there instead of sent again
+    remote_paths_of_hash = {}
+    for t, sha in remote_manifest.items():
+        remote_paths_of_hash.setdefault(sha, t)
+
+    # sources may themselves be changed (i.e two files swap contents), so every copy is first made to a
+    #   temporary file and only moved into place once all copies are done
+    copy_commands = []
+    move_commands = []
+    to_send = {}
+    for t in changed:
+        source = remote_paths_of_hash.get(hashes[t])
+
+        if source is not None:
+            tmp_t = shlex.quote(t + COPY_SUFFIX)
+            copy_commands.append(f"mkdir -p {shlex.quote(os.path.dirname(t) or '.')} && cp {shlex.quote(source)} {tmp_t}")
+            move_commands.append(f"mv -f {tmp_t} {shlex.quote(t)}")
+        else:
+            to_send[t] = files[t]
+
+    send_size = sum(os.path.getsize(f) for f in to_send.values())
+    state.console.print(
+        f"Uploading {len(to_send)}/{len(files)} files ({utils.format_memory(send_size)}), "
+        f"copying {len(changed) - len(to_send)} on the cluster and removing {len(deleted)}"
+    )
+
+    # copy before sending and deleting so that the sources still exist
+    run_remote_commands(cluster_config, experiment_name, copy_commands + move_commands)
+
+    stream_files(cluster_config, experiment_name, to_send, manifest=hashes)
+
+    commands = [f"rm -f {shlex.quote(t)}" for t in deleted]
+    commands += [f"mkdir -p {shlex.quote(t)}" for t in folders]
+    commands += get_setup_commands(configs_to_run, cluster_config)
+
+    run_remote_commands(cluster_config, experiment_name, commands)
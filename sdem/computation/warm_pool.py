@@ -0,0 +1,259 @@
+"""
+Runs experiments on a pool of warm worker processes.
+
+Each worker imports a model file once (through utils.load_mod) and then runs the order_ids it is sent, so a sweep
+    of many short experiments does not pay the cost of starting python and importing the model file for every run.
+    Workers are replaced after a number of runs, or when their memory has grown too much, to limit the
+    effect of leaks between runs.
+"""
+import os
+import sys
+import time
+import resource
+import traceback
+import multiprocessing
+import multiprocessing.connection
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import List
+
+from .. import utils
+from . import manager
+from .run_index import RUN_INDEX_ENV
+
+# by default a worker is replaced once its peak memory is this many times larger than after its first run
+DEFAULT_MEMORY_GROWTH = 2.0
+
+
+def _peak_rss() -> int:
+    # ru_maxrss is in kilobytes on linux and bytes on mac
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss * (1 if sys.platform == "darwin" else 1024)
+
+
+def _worker_main(model_file: str, conn, use_observer: bool, log_file: str, env: dict):
+    """ Entry point of a worker process. """
+    # all output of the experiments goes to the log file of the worker
+    log = open(log_file, "a")
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+
+    os.environ.update(env)
+
+    model_file = Path(model_file).resolve()
+
+    try:
+        mod = utils.load_mod(model_file)
+        ex = mod.ex
+
+        if ex.main_function is None:
+            raise RuntimeError(f"{model_file} does not define an automain function")
+
+        configs = ex.config_function()
+        if not isinstance(configs, list):
+            configs = list(configs)
+    except Exception:
+        traceback.print_exc()
+        conn.send(("load_error", traceback.format_exc()))
+        return
+
+    # experiments are run from the models folder
+    os.chdir(model_file.parent)
+
+    conn.send(("ready", _peak_rss()))
+
+    while True:
+        order_id = conn.recv()
+
+        if order_id is None:
+            break
+
+        failed = ex.run_order_ids(ex.main_function, model_file, configs, [order_id], use_observer=use_observer)
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        conn.send(("done", order_id, "FAILED" if len(failed) > 0 else "COMPLETED", _peak_rss()))
+
+
+class WarmWorker:
+    def __init__(self, ctx, model_file: Path, name: str, use_observer: bool, log_file: Path, env: dict):
+        self.model_file = model_file
+        self.name = name
+        self.log_file = log_file
+
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_worker_main,
+            args=(str(model_file), child_conn, use_observer, str(log_file), env),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+        # order_id currently being run
+        self.current = None
+        self.num_runs = 0
+
+        # peak memory after the first run, used to detect memory growth
+        self.baseline_rss = None
+
+    def send(self, order_id):
+        self.current = order_id
+        self.conn.send(order_id)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+
+        self.process.join(timeout=30)
+
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def run_with_warm_workers(state: "State", configs_to_run: List[dict], run_settings: dict) -> None:
+    """
+    Runs configs_to_run on run_settings['warm_workers'] worker processes.
+
+    Workers are replaced after run_settings['recycle_after'] runs, or once their peak memory is larger than
+        run_settings['worker_max_memory'] (defaults to DEFAULT_MEMORY_GROWTH times the peak memory after their first run).
+        If a worker crashes the config it was running is marked as failed and a new worker is started.
+    """
+    experiment_config = state.experiment_config
+
+    num_workers = run_settings["warm_workers"]
+    recycle_after = run_settings.get("recycle_after")
+    max_memory = run_settings.get("worker_max_memory")
+    if max_memory is not None:
+        max_memory = utils.parse_memory(max_memory)
+
+    use_observer = run_settings["observer"]
+
+    models_root = manager.get_models_folder_path(experiment_config)
+    log_root = manager.get_tmp_folder_path(experiment_config) / "logs"
+    log_root.mkdir(parents=True, exist_ok=True)
+
+    env = {}
+    if RUN_INDEX_ENV in os.environ:
+        env[RUN_INDEX_ENV] = os.environ[RUN_INDEX_ENV]
+
+    # workers are forked, spawning would re-run the sdem cli in every worker
+    ctx = multiprocessing.get_context("fork")
+
+    # model file -> order_ids that have not been sent to a worker
+    pending = OrderedDict()
+    for exp in configs_to_run:
+        pending.setdefault(exp["filename"], deque()).append(exp["order_id"])
+
+    workers: List[WarmWorker] = []
+    worker_count = 0
+
+    completed = []
+    failed = []
+
+    def next_task(filename):
+        if filename in pending and len(pending[filename]) > 0:
+            return pending[filename].popleft()
+        return None
+
+    def retire(worker):
+        worker.stop()
+        workers.remove(worker)
+
+    start_time = time.time()
+
+    with state.console.status("Running experiments on warm workers") as status:
+        while len(workers) > 0 or any(len(q) > 0 for q in pending.values()):
+            # fill free slots with workers for model files that still have configs to run
+            for filename, queue in pending.items():
+                while len(workers) < num_workers and len(queue) > 0:
+                    name = f"warm_{Path(filename).stem}_{worker_count}"
+                    worker_count += 1
+
+                    worker = WarmWorker(ctx, models_root / filename, name, use_observer, log_root / f"{name}.log", env)
+                    worker.send(queue.popleft())
+                    workers.append(worker)
+
+            ready = multiprocessing.connection.wait(
+                [w.conn for w in workers] + [w.process.sentinel for w in workers], timeout=1
+            )
+
+            for worker in list(workers):
+                if (worker.conn not in ready) and (worker.process.sentinel not in ready):
+                    continue
+
+                filename = worker.model_file.name
+
+                try:
+                    message = worker.conn.recv()
+                except (EOFError, OSError):
+                    # the worker died while running worker.current
+                    if worker.current is not None:
+                        state.console.log(f"Worker {worker.name} crashed while running {filename} {worker.current}")
+                        failed.append((filename, worker.current))
+
+                    worker.process.join()
+                    workers.remove(worker)
+                    continue
+
+                if message[0] == "load_error":
+                    state.console.print(message[1])
+                    state.error(f"Could not load {filename} -- skipping its configs")
+
+                    # every other config of this model file would fail in the same way
+                    failed.append((filename, worker.current))
+                    failed.extend((filename, i) for i in pending.pop(filename, []))
+                    retire(worker)
+                    continue
+
+                if message[0] == "ready":
+                    continue
+
+                _, order_id, run_status, rss = message
+                worker.current = None
+                worker.num_runs += 1
+
+                if run_status == "COMPLETED":
+                    completed.append((filename, order_id))
+                else:
+                    failed.append((filename, order_id))
+
+                state.console.log(f"{filename} {order_id} {run_status.lower()} ({worker.name})")
+
+                if worker.baseline_rss is None:
+                    worker.baseline_rss = rss
+
+                memory_limit = max_memory if max_memory is not None else DEFAULT_MEMORY_GROWTH * worker.baseline_rss
+
+                if (recycle_after is not None) and (worker.num_runs >= recycle_after):
+                    retire(worker)
+                    continue
+
+                if rss > memory_limit:
+                    state.console.log(f"Recycling {worker.name}, memory grew to {utils.format_memory(rss)}")
+                    retire(worker)
+                    continue
+
+                order_id = next_task(filename)
+                if order_id is None:
+                    retire(worker)
+                else:
+                    worker.send(order_id)
+
+            num_done = len(completed) + len(failed)
+            status.update(
+                f"Finished {num_done}/{len(configs_to_run)} experiments on {len(workers)} warm workers "
+                f"({time.time() - start_time:.0f}s)"
+            )
+
+    if len(failed) > 0:
+        state.error(f"{len(failed)}/{len(configs_to_run)} experiments failed:")
+        for filename, i in failed:
+            state.console.print(f"    {filename} {i}")
+    else:
+        state.console.print(f"[bold green]All {len(configs_to_run)} experiments finished successfully[/]")
+
+    state.console.print(f"Worker logs are in {log_root}")
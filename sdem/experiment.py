@@ -1,21 +1,59 @@
 """ Wrapper around SacredExperiment. """
 from sacred import Experiment as SacredExperiment
-from sacred.observers import FileStorageObserver
+from sacred.observers import FileStorageObserver, RunObserver
 
 import argparse
 from pathlib import Path
 
 import sys
+import traceback
 
 from .computation import manager
 from .computation import metrics
+from .computation.run_index import RunIndex, RUN_INDEX_ENV
 
-from .utils import pass_unknown_kargs
+from .utils import pass_unknown_kargs, parse_order_ids, record_progress
 
 import inspect
 import os
 
 
+class RunIndexObserver(RunObserver):
+    """
+    Keeps the sdem run index up to date as the experiment runs. Must be added after the FileStorageObserver
+        so that the run folder has been written when the index is updated.
+    """
+
+    def __init__(self, index_path, runs_root):
+        self.index_path = index_path
+        self.runs_root = runs_root
+        self.run_id = None
+
+    def _update(self):
+        if self.run_id is None:
+            return
+
+        try:
+            with RunIndex(self.index_path, self.runs_root) as run_index:
+                run_index.update_run(self.run_id)
+        except Exception as e:
+            # the index is rebuilt from the run folders when it is next used, so never fail the experiment
+            print(f'Could not update run index: {e}')
+
+    def started_event(self, ex_info, command, host_info, start_time, config, meta_info, _id):
+        self.run_id = _id
+        self._update()
+
+    def completed_event(self, stop_time, result):
+        self._update()
+
+    def interrupted_event(self, interrupt_time, status):
+        self._update()
+
+    def failed_event(self, fail_time, fail_trace):
+        self._update()
+
+
 class Experiment(SacredExperiment):
     def __init__(self, name="exp"):
         caller_globals = inspect.stack()[1][0].f_globals
@@ -36,6 +74,9 @@ class Experiment(SacredExperiment):
         self.model_function = None
         self.predict_function = None
 
+        # the function passed to automain, stored so that experiments can be run when the model file is imported
+        self.main_function = None
+
     def configs(self, function):
         self.config_function = function
 
@@ -46,6 +87,10 @@ class Experiment(SacredExperiment):
         if use_observer:
             self.observers.append(FileStorageObserver("runs"))
 
+            # sdem passes the location of the run index when running experiments locally
+            if RUN_INDEX_ENV in os.environ:
+                self.observers.append(RunIndexObserver(os.environ[RUN_INDEX_ENV], "runs"))
+
         self.add_config(config)
         captured_function = self.main(lambda: function(config, **kwargs))
 
@@ -76,12 +121,15 @@ class Experiment(SacredExperiment):
 
         when the file is run from command line we support the follow command line arguments:
             int>=0: run specific config id [default = 0]
+            list or range of ids (i.e 1,4,7 or 2-5): run each of these configs in this process
             -1: run all experiment configs
         """
 
         # check if the function was run through the command line or imported
         # if imported we do not run the experiments
 
+        self.main_function = function
+
         # TODO: check if required
         # captured = self.main(function)
         if function.__module__ != "__main__":
@@ -93,18 +141,25 @@ class Experiment(SacredExperiment):
         filename = Path(inspect.getfile(function))
 
         parser = argparse.ArgumentParser()
-        parser.add_argument('i', type=int, default=-1, help='Experiment id to run')
+        parser.add_argument(
+            'i', type=str, default='-1',
+            help='Experiment id to run, a list (i.e 1,4,7) or range (i.e 2-5) of ids, or -1 to run all'
+        )
         parser.add_argument('--no-observer', action='store_true', default=False, help='Run without observer')
+        parser.add_argument(
+            '--progress-file', type=str, default=None,
+            help='File to record the progress of each experiment in, used by sdem to recover from crashes'
+        )
         input_args, unknown_args = parser.parse_known_args()
 
         unknown_kwargs = pass_unknown_kargs(unknown_args)
 
         use_observer = not(input_args.no_observer)
-        i = input_args.i
+        order_ids = parse_order_ids(input_args.i)
 
         configs = self.config_function()
 
-        if i == -1:
+        if order_ids is None:
             # Run all experiments
             for i, config in enumerate(configs):
                 config = manager.ensure_correct_fields_for_model_file_config(
@@ -113,8 +168,73 @@ class Experiment(SacredExperiment):
                 self.run_config(function, config, use_observer=use_observer, **unknown_kwargs)
 
         else:
-            # Run specific experiment
+            # Run specific experiments, each experiment is run even if a previous one fails
+            failed = self.run_order_ids(
+                function,
+                filename,
+                configs,
+                order_ids,
+                use_observer=use_observer,
+                progress_file=input_args.progress_file,
+                **unknown_kwargs
+            )
+
+            if len(failed) > 0:
+                sys.exit(1)
+
+    def run_order_ids(self, function, filename, configs, order_ids, use_observer=True, progress_file=None, **kwargs):
+        """
+        Runs the configs with the given order_ids one after another in this process, so that the cost
+            of importing the model file is only paid once.
+
+        Exceptions are printed and the remaining configs are still run. If progress_file is passed then a line
+            `start {order_id}` is written before each config is run and `end {order_id} {COMPLETED|FAILED}` once it
+            has finished, so that if the process crashes the config that caused it can be found.
+
+        Returns the order_ids that failed.
+        """
+        configs_by_order_id = get_configs_by_order_id(configs, order_ids)
+
+        failed = []
+        for i in order_ids:
             config = manager.ensure_correct_fields_for_model_file_config(
-                filename, configs[i], i
+                filename, configs_by_order_id[i], i
             )
-            self.run_config(function, config, use_observer=use_observer, **unknown_kwargs)
+
+            record_progress(progress_file, f'start {i}')
+
+            try:
+                self.run_config(function, config, use_observer=use_observer, **kwargs)
+                status = 'COMPLETED'
+            except Exception:
+                traceback.print_exc()
+                failed.append(i)
+                status = 'FAILED'
+
+            record_progress(progress_file, f'end {i} {status}')
+
+        return failed
+
+
+def get_configs_by_order_id(configs, order_ids) -> dict:
+    """
+    Return a dict from each of order_ids to its config.
+        configs may be a generator (see utils.iter_all_permutations) so we cannot always index directly
+    """
+    if isinstance(configs, list):
+        return {i: configs[i] for i in order_ids}
+
+    wanted = set(order_ids)
+    found = {}
+    for i, config in enumerate(configs):
+        if i in wanted:
+            found[i] = config
+
+            if len(found) == len(wanted):
+                break
+
+    missing = wanted - set(found.keys())
+    if len(missing) > 0:
+        raise IndexError(f'No configs with order_ids {sorted(missing)}')
+
+    return found
@@ -4,7 +4,7 @@ import typer
 from . import state  # global settings
 from . import template
 
-from .cli import run, dvc, clean, vis, sync, setup, rollback, install, info
+from .cli import run, dvc, clean, vis, sync, status, resubmit, setup, rollback, install, info
 import warnings
 
 from time import sleep
@@ -17,6 +17,8 @@ app = typer.Typer()
 app.command()(run.run)
 app.command()(clean.clean)
 app.command()(sync.sync)
+app.command()(status.status)
+app.command()(resubmit.resubmit)
 
 info_app = typer.Typer()
 info_app.add_typer(info.model_app, name='models')
@@ -35,7 +37,13 @@ app.add_typer(vis.app, name="vis")
 
 
 @app.callback()
-def global_state(ctx: typer.Context, verbose: bool = False, dry: bool = False):
+def global_state(
+    ctx: typer.Context,
+    verbose: bool = False,
+    dry: bool = False,
+    no_cache: bool = typer.Option(False, help=state.help_texts["no_cache"]),
+    load_workers: int = typer.Option(1, help=state.help_texts["load_workers"]),
+):
     """
     This function will be run before every cli function
     It sets up the current state and sets global settings.
@@ -43,7 +51,7 @@ def global_state(ctx: typer.Context, verbose: bool = False, dry: bool = False):
 
     # allow kwargs
 
-    config = state.get_state(verbose, dry)
+    config = state.get_state(verbose, dry, no_cache=no_cache, load_workers=load_workers)
 
     config.console.print('Running in verbose mode')
     config.console.print('Running in dry mode')
@@ -0,0 +1,234 @@
+"""
+In-process caches for interactive analysis.
+
+Notebooks and metrics scripts call get_results_that_match_dict/spec many times with overlapping filters. Each
+    call would load the experiment config, find the configs of every model file and unpickle every matched
+    results file again. Within a process these are cached:
+
+    - discover_configs memoizes the experiment config and the configs of the model files (and get_config_index
+        an index over them). The memo is used until a config file, a model file (or a local module it imports)
+        changes or model files are added or removed.
+    - PayloadCache keeps loaded results keyed by results file and file signature (inode, mtime and size), and
+        evicts the least recently used results once their (estimated) size exceeds max_bytes.
+
+Both are used when use_cache=True is passed to the functions of local.py. Cached configs and results are shared
+    between calls, so they must not be modified in place.
+"""
+import sys
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .. import state
+from ..computation import config_cache
+from ..computation.config_index import ConfigIndex
+from ..computation import manager
+from ..computation import run_folders
+from . import payload
+
+# default memory cap of the payload cache
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def estimate_size(obj, seen: Optional[set] = None) -> int:
+    """ Return the (approximate) number of bytes of memory used by obj. Memory-mapped arrays are not counted. """
+    if seen is None:
+        seen = set()
+
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.memmap):
+        # backed by the file, pages are dropped by the OS as needed
+        return sys.getsizeof(obj)
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + sys.getsizeof(obj)
+
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(np.sum(obj.memory_usage(deep=True)))
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        size += sum(estimate_size(k, seen) + estimate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_size(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), seen)
+
+    return size
+
+
+class PayloadCache:
+    """ LRU cache of loaded results files (see payload.load_results), capped at max_bytes. """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+
+        # (results file, mmap_mode) -> (signature, results, nbytes), least recently used first
+        self._entries = OrderedDict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key) -> None:
+        _, _, nbytes = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def _evict(self) -> None:
+        while (self.nbytes > self.max_bytes) and (len(self._entries) > 0):
+            self._remove(next(iter(self._entries)))
+
+    def get(self, res_file: Path, mmap_mode: Optional[str] = "r"):
+        """ Return the results of res_file, only loading it if it is not cached or has changed. """
+        key = (str(Path(res_file).resolve()), mmap_mode)
+        signature = run_folders.file_signature(res_file)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] == signature:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self._remove(key)
+
+        self.misses += 1
+
+        results = payload.load_results(res_file, mmap_mode=mmap_mode)
+        nbytes = estimate_size(results)
+
+        # results larger than the cache are not cached at all
+        if nbytes <= self.max_bytes:
+            self._entries[key] = (signature, results, nbytes)
+            self.nbytes += nbytes
+            self._evict()
+
+        return results
+
+    def resize(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._evict()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.nbytes = 0
+
+    def stats(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses, {len(self)} results using {self.nbytes / 1024 ** 2:.1f}MB"
+
+
+_PAYLOAD_CACHE = PayloadCache()
+
+# (working directory, exp_root, return_ex, import_hook) -> discovered configs, see discover_configs
+_DISCOVERY = {}
+
+
+def get_payload_cache() -> PayloadCache:
+    return _PAYLOAD_CACHE
+
+
+def set_payload_cache_size(max_bytes: int) -> None:
+    """ Change the memory cap of the payload cache, evicting results if needed. """
+    _PAYLOAD_CACHE.resize(max_bytes)
+
+
+def clear_caches() -> None:
+    """ Drop all cached results and configs. """
+    _PAYLOAD_CACHE.clear()
+    _DISCOVERY.clear()
+
+
+def _get_discovery_files(config_state, model_files: list) -> list:
+    """ Return the files that the discovered configs depend on: the experiment config files, model files and their local imports. """
+    experiment_configs = config_state.experiment_config["experiment_configs"]
+    root = Path(config_state.root) if config_state.root is not None else Path(".")
+
+    files = set([root / experiment_configs["project"], root / experiment_configs["local"]])
+    for model_file in model_files:
+        files.update(config_cache.get_local_dependencies(model_file))
+
+    return sorted(files)
+
+
+def _get_signature(files: list) -> tuple:
+    return tuple(run_folders.file_signature(f) for f in files)
+
+
+def _is_valid(entry: dict) -> bool:
+    model_files = sorted(manager.get_model_files(entry["state"], entry["model_path"]))
+
+    return (model_files == entry["model_files"]) and (_get_signature(entry["files"]) == entry["signature"])
+
+
+def _get_key(exp_root: Path, return_ex: bool, import_hook: bool) -> tuple:
+    return (str(Path.cwd()), str(Path(exp_root).resolve()), return_ex, import_hook)
+
+
+def discover_configs(exp_root: Path, return_ex: bool = False, import_hook: bool = True, use_cache: bool = True) -> tuple:
+    """
+    Return (state, configs) of the experiment, where configs are the configs of every model file in exp_root
+        ((configs, ex_dict) when return_ex is true, see manager.get_configs_from_model_files).
+    """
+    exp_root = Path(exp_root)
+    key = _get_key(exp_root, return_ex, import_hook)
+
+    entry = _DISCOVERY.get(key)
+    if use_cache and (entry is not None) and _is_valid(entry):
+        return entry["state"], entry["configs"]
+
+    # load experiment configs
+    config_state = state.get_state(True, True)
+    config_state.load_experiment_config()
+    experiment_config = config_state.experiment_config
+
+    # load all experiments
+    model_path = manager.get_models_folder_path(experiment_config, exp_root=exp_root)
+
+    # the signature is taken first so that files changed while loading invalidate the memo
+    model_files = sorted(manager.get_model_files(config_state, model_path))
+    files = _get_discovery_files(config_state, model_files)
+    signature = _get_signature(files)
+
+    configs = manager.get_configs_from_model_files(
+        config_state,
+        model_root=model_path,
+        exp_root=exp_root,
+        return_ex=return_ex,
+        import_hook=import_hook
+    )
+
+    _DISCOVERY[key] = {
+        "state": config_state,
+        "configs": configs,
+        "model_path": model_path,
+        "model_files": model_files,
+        "files": files,
+        "signature": signature,
+    }
+
+    return config_state, configs
+
+
+def get_config_index(exp_root: Path, use_cache: bool = True) -> tuple:
+    """ Return (state, ConfigIndex) of the configs found by discover_configs. The index is memoized with the configs. """
+    config_state, configs = discover_configs(exp_root, use_cache=use_cache)
+
+    entry = _DISCOVERY.get(_get_key(exp_root, False, True))
+    if (entry is None) or (entry["configs"] is not configs):
+        # not memoized
+        return config_state, ConfigIndex(configs)
+
+    if "index" not in entry:
+        entry["index"] = ConfigIndex(configs)
+
+    return config_state, entry["index"]
@@ -1,8 +1,11 @@
 """ Helper function for extracting results and metrics from an sdem experiment. """
 import os
-import pickle
 from ..computation import manager, sacred_manager, startup
+from ..computation.config_index import ConfigIndex
 from .. import utils, template, state
+from . import store
+from . import payload
+from . import cache
 import pandas as pd
 import json
 from loguru import logger
@@ -10,86 +13,78 @@ import typing
 import numpy as np
 from pathlib import Path
 
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 def _flatten_checkpoint_dict(d):
-    df = pd.json_normalize(d, sep="_")
-    return df.to_dict(orient="records")[0]
+    return store.flatten_dict(d)
 
 def _get_last_checkpoints(d):
-    _d = {}
-    for key, item in d.items():
-        _d[key] = d[key]["values"][-1]
+    return store.get_last_checkpoints(d)
 
-    return _flatten_checkpoint_dict(_d)
+def get_experiments_that_match_dict(_dict: dict, exp_root: Path, use_cache: bool = False):
+    """
+    Return a dict from every experiment (ex) to its configs that match _dict.
 
-def get_experiments_that_match_dict(_dict: dict, exp_root: Path):
+    When use_cache is true the configs are memoized in this process (see cache.py) and the same config dicts are
+        returned by every call, so they must not be modified in place.
+    """
     # Ensure root is a path 
     exp_root = Path(exp_root)
 
-
-    # load experiment configs
-    config = state.get_state(True, True)
-    config.load_experiment_config()
-    experiment_config = config.experiment_config
-
-    # load all experiments
-    model_path = manager.get_models_folder_path(experiment_config, exp_root=exp_root)
-
-    _, ex_dict = manager.get_configs_from_model_files(
-        config,
-        model_root= model_path,
+    # load experiment configs and all experiments, memoized for the lifetime of the process (see cache.py)
+    _, (_, ex_dict) = cache.discover_configs(
+        exp_root,
         return_ex = True,
-        import_hook = False # no need to custom hook as we should be in the correct env to load the model
+        import_hook = False, # no need to custom hook as we should be in the correct env to load the model
+        use_cache = use_cache
     )
 
     # filter out ex, and config pairs that do not match _dict
-    matched_dict = {}
-    for ex, config_list in ex_dict.items():
-        matched_config_list = []
-        for config in config_list:
-            if utils.dict_is_subset(_dict, config):
-                matched_config_list.append(config)
+    ex_list = []
+    config_list = []
+    for ex, ex_config_list in ex_dict.items():
+        ex_list += [ex] * len(ex_config_list)
+        config_list += ex_config_list
 
-        if len(matched_config_list) > 0:
-            matched_dict[ex] = matched_config_list
+    matched_dict = {}
+    for pos in ConfigIndex(config_list).query(_dict):
+        matched_dict.setdefault(ex_list[pos], []).append(config_list[pos])
 
     return matched_dict
 
 
-def get_results_that_match_dict(_dict: dict, exp_root: Path, squeeze: bool = False, result_pattern: str = None) -> Tuple[dict, dict]:
+def _get_results_of_filters(filters: list, exp_root: Path, result_pattern: str = None, lazy: bool = False, mmap_mode: Optional[str] = "r", use_cache: bool = False) -> List[Tuple[list, list]]:
     """
+    Return (results, configs) of every filter in filters (see ConfigIndex.query).
 
+    The configs are found and indexed once for all filters, and every distinct results file is only loaded once
+        even when it is matched by more than one filter.
     """
     # Ensure root is a path 
     exp_root = Path(exp_root)
 
-
-    # load experiment configs
-    config = state.get_state(True, True)
-    config.load_experiment_config()
+    # load experiment configs and index all configs, memoized for the lifetime of the process (see cache.py)
+    config, config_index = cache.get_config_index(exp_root, use_cache=use_cache)
     experiment_config = config.experiment_config
 
-    # Load all configs
-
-    model_path = manager.get_models_folder_path(experiment_config, exp_root=exp_root)
-
-    config_arr = manager.get_configs_from_model_files(
-        config,
-        model_root= model_path
-    )
-
-    # For configs that match filter load the corresponding results pickle file
-    matched_configs = []
-    matched_results = []
-
     if result_pattern is None:
         result_pattern = manager.get_results_output_pattern(experiment_config)
 
     results_path = manager.get_results_path(experiment_config, exp_root=exp_root)
 
-    for config in config_arr:
-        if utils.dict_is_subset(_dict, config):
+    payload_cache = cache.get_payload_cache() if use_cache else None
+
+    # results file -> loaded results, None if the results file does not exist
+    loaded = {}
+
+    matches = []
+    for _filter in filters:
+        # For configs that match filter load the corresponding results pickle file
+        matched_configs = []
+        matched_results = []
+
+        for pos in config_index.query(_filter):
+            config = config_index.configs[pos]
 
             results_file = manager.substitute_config_in_str(
                 result_pattern,
@@ -98,40 +93,98 @@ def get_results_that_match_dict(_dict: dict, exp_root: Path, squeeze: bool = Fal
 
             res_file = results_path / results_file
 
-            if res_file.exists():
-
+            if res_file not in loaded:
+                if not res_file.exists():
+                    loaded[res_file] = None
+                elif lazy:
+                    loaded[res_file] = payload.ResultHandle(res_file, mmap_mode=mmap_mode, cache=payload_cache)
+                elif payload_cache is not None:
+                    loaded[res_file] = payload_cache.get(res_file, mmap_mode=mmap_mode)
+                else:
+                    loaded[res_file] = payload.load_results(res_file, mmap_mode=mmap_mode)
+
+            if loaded[res_file] is not None:
                 # Read pickle and save config
                 matched_configs.append(config)
-                results = pickle.load(open(res_file, "rb"))
-                matched_results.append(results)
+                matched_results.append(loaded[res_file])
+
+        if len(matched_results) == 0:
+            logger.info(f"No results found for {_filter}")
+
+        matches.append((matched_results, matched_configs))
+
+    return matches
 
-    if len(matched_results) == 0:
-        logger.info(f"No results found for {_dict}")
+
+def _squeeze_results(matched_results: list, matched_configs: list) -> tuple:
+    if len(matched_results) == 1:
+        return matched_results[0], matched_configs[0]
+
+    if len(matched_results) > 1:
+        logger.info("Cannot squeeze, too many results!")
+
+    return matched_results, matched_configs
+
+
+def get_results_that_match_dict(_dict: dict, exp_root: Path, squeeze: bool = False, result_pattern: str = None, lazy: bool = False, mmap_mode: Optional[str] = "r", use_cache: bool = False) -> Tuple[dict, dict]:
+    """
+    Return the results and configs of every config that matches _dict and has a results file.
+
+    When lazy is true a payload.ResultHandle is returned for every results file, which is only loaded when it is
+        accessed. Arrays of results files saved with payload.save_results are memory-mapped with mmap_mode
+        (loaded into memory when mmap_mode is None).
+
+    When use_cache is true the configs and loaded results are cached in this process (see cache.py), so repeated
+        calls only reload what has changed. The same config dicts and results objects are then returned by every
+        call, so they must not be modified in place (i.e res['predictions'] *= s would change the results of
+        later calls). Without use_cache every call returns newly loaded objects.
+    """
+    matched_results, matched_configs = _get_results_of_filters(
+        [_dict], exp_root, result_pattern=result_pattern, lazy=lazy, mmap_mode=mmap_mode, use_cache=use_cache
+    )[0]
 
     if squeeze:
-        if len(matched_results) == 1:
-            matched_results = matched_results[0]
-            matched_configs = matched_configs[0]
-        else:
-            if len(matched_results) > 1:
-                logger.info("Cannot squeeze, too many results!")
+        matched_results, matched_configs = _squeeze_results(matched_results, matched_configs)
 
     return matched_results, matched_configs
 
-def get_results_that_match_spec(spec_list: list, exp_root: Path, squeeze: bool = False):
-    matched_results = []
-    matched_configs = []
 
+def flatten_spec(spec_list: list) -> List[dict]:
+    """ Return the dicts of a spec (a list of dicts and nested specs) in order. """
+    specs = []
     for spec in spec_list:
         if type(spec) is dict:
-            matched_results_spec, matched_configs_spec = get_results_that_match_dict(spec, exp_root, squeeze)
+            specs.append(spec)
         elif type(spec) is list:
-            matched_results_spec, matched_configs_spec = get_results_that_match_spec(spec, exp_root, squeeze)
+            specs += flatten_spec(spec)
         else:
-            raise RuntimeError()
+            raise RuntimeError(f"Specs must be dicts or lists, not {type(spec)}")
+
+    return specs
+
+
+def get_results_that_match_spec(spec_list: list, exp_root: Path, squeeze: bool = False, lazy: bool = False, mmap_mode: Optional[str] = "r", use_cache: bool = False):
+    """
+    Return the results and configs matched by every dict of spec_list (see get_results_that_match_dict), in order.
+
+    All dicts are resolved in a single pass: configs are found once and each results file is loaded once, even when
+        it is matched by several dicts. Results matched by several dicts are therefore the same object.
 
-        matched_results = matched_results +  matched_results_spec
-        matched_configs = matched_configs +  matched_configs_spec
+    See get_results_that_match_dict for use_cache; with it results objects are also shared between calls.
+    """
+    matches = _get_results_of_filters(
+        flatten_spec(spec_list), exp_root, lazy=lazy, mmap_mode=mmap_mode, use_cache=use_cache
+    )
+
+    matched_results = []
+    matched_configs = []
+
+    for matched_results_spec, matched_configs_spec in matches:
+        matched_results += matched_results_spec
+        matched_configs += matched_configs_spec
+
+    if squeeze:
+        matched_results, matched_configs = _squeeze_results(matched_results, matched_configs)
 
     return matched_results, matched_configs
 
@@ -149,24 +202,17 @@ def index_of_match(config_columns, metric_columns, metric_cols, group_by_cols):
     return None
 
 def get_run_configs(exp_root):
-    runs_root = str(Path(exp_root) / 'models' / 'runs')
-    experiment_folders = sacred_manager.get_sacred_experiment_folders(runs_root)
-    config_list = []
-    for run in experiment_folders:
-        # load config and metrics
-        with open(f"{runs_root}/{run}/config.json") as f:
-            config = json.load(f)
-        config_list.append(config)
+    config = state.get_state(True, True)
+    config.load_experiment_config()
 
-    return config_list
+    return store.get_results_store(config.experiment_config, exp_root=Path(exp_root)).get_configs()
 
 def get_results_df(exp_root: Path, metric_cols, group_by_cols):
     """
     General Structure:
-        - Goes through every sacred run folder
-        - extracts config and metrics
-        - construct resuts file name from config
-        - load results
+        - Updates the results store (see store.py) with any sacred runs that have changed
+        - Groups runs by their config and metric keys
+        - Selects the group_by_cols and metric_cols of every group
         - Aggregates and return
 
     Notes:
@@ -177,11 +223,7 @@ def get_results_df(exp_root: Path, metric_cols, group_by_cols):
     config.load_experiment_config()
     experiment_config = config.experiment_config
 
-    # Get sacred runs path
-    runs_root = manager.get_sacred_runs_path(experiment_config, exp_root=exp_root)
-
-    # Get all folders that are correspond to sacred runs
-    experiment_folders = sacred_manager.get_sacred_experiment_folders(runs_root)
+    results_store = store.get_results_store(experiment_config, exp_root=exp_root)
 
     num_groups = len(metric_cols)
 
@@ -191,50 +233,34 @@ def get_results_df(exp_root: Path, metric_cols, group_by_cols):
     columns = [None for i in range(num_groups)]
     results_df = [None for i in range(num_groups)]
 
-    for run in experiment_folders:
-        # load config and metrics
-        with open(runs_root / run / 'config.json') as f:
-            config = json.load(f)
-
-        with open(runs_root / run / "metrics.json") as f:
-            metrics = json.load(f)
-
-        if bool(metrics) == False:
+    for (config_columns, metric_columns), run_ids in results_store.get_key_groups().items():
+        if len(metric_columns) == 0:
             # metrics is empty
-            logger.info(f"Skiping {run} because metrics is empty")
+            logger.info(f"Skiping {len(run_ids)} runs because metrics is empty")
             continue
 
-
-        # When there are multiply checkpoints we use the last one
-        metrics = _get_last_checkpoints(metrics)
-
-        # Construct list of all config keys and metric keys 
-        config_columns = list(config.keys())
-        metric_columns = list(metrics.keys())
-
         # Each group corresponds to experiments with the same config_columns and metric_columns
         #   We actually only group by the columns/rows that will be used in the final table
-        
         config_index = index_of_match(config_columns, metric_columns, metric_cols, group_by_cols)
 
         if config_index is None:
-            print(f'Could not get metrics for experiment run {run}')
-            print(f'As not find group for experiment with config {config_columns} and metrics {metric_columns}')
+            print(f'Could not get metrics for experiment runs {run_ids}')
+            print(f'As not find group for experiment with config {list(config_columns)} and metrics {list(metric_columns)}')
 
             continue
 
-        # Subset config and metrics
-        row = [config[key] for key in group_by_cols] + [metrics[key] for key in metric_cols[config_index]]
-        column_list = group_by_cols + metric_cols[config_index]
+        # Subset config and metrics
+        df = results_store.get_table(run_ids, group_by_cols, metric_cols[config_index])
 
         if results_df[config_index] is None:
-            results_df[config_index] = [row]
-            columns[config_index] = column_list
+            results_df[config_index] = [df]
+            columns[config_index] = group_by_cols + metric_cols[config_index]
         else:
-            results_df[config_index].append(row)
+            results_df[config_index].append(df)
 
     return [
-        pd.DataFrame(results_df[i], columns=columns[i]) for i in range(len(columns))
+        pd.concat(results_df[i], ignore_index=True) if results_df[i] is not None else pd.DataFrame([], columns=columns[i])
+        for i in range(len(columns))
     ]
 
 
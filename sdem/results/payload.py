@@ -0,0 +1,201 @@
+"""
+Lazy loading of results files.
+
+A results file is a pickle written by the model file (see the results pattern of the template). Loading the results
+    of many configs at once, i.e the predictions of every fold, would read every array into memory. Two things
+    avoid this:
+
+    - ResultHandle, a proxy of a results file that only unpickles it when it is first accessed.
+    - An (optional) array format written by save_results: large numpy arrays are stored as .npy files in the
+        folder {results file}.arrays and are replaced by an ArrayRef in the pickle. The pickle, which holds
+        the small parts of the results (i.e metrics), is read eagerly and the arrays are memory-mapped.
+
+Plain pickles are still loaded by load_results and ResultHandle, so model files do not have to use save_results.
+"""
+import os
+import pickle
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+# suffix of the folder that stores the arrays of a results file
+ARRAYS_SUFFIX = ".arrays"
+
+# arrays that are smaller than this (in bytes) are kept in the pickle
+DEFAULT_MIN_ARRAY_BYTES = 1024 ** 2
+
+
+class ArrayRef:
+    """ Placeholder of an array stored in the arrays folder of a results file. """
+
+    def __init__(self, file: str, shape: tuple, dtype: str):
+        self.file = file
+        self.shape = shape
+        self.dtype = dtype
+
+    def __repr__(self):
+        return f"ArrayRef({self.file}, shape={self.shape}, dtype={self.dtype})"
+
+    def load(self, arrays_path: Path, mmap_mode: Optional[str] = "r") -> np.ndarray:
+        return np.load(Path(arrays_path) / self.file, mmap_mode=mmap_mode, allow_pickle=False)
+
+
+def get_arrays_path(res_file: Path) -> Path:
+    res_file = Path(res_file)
+    return res_file.with_name(res_file.name + ARRAYS_SUFFIX)
+
+
+def _map_dict(obj: dict, f) -> dict:
+    """ Return a copy of obj, of the same type where possible (i.e defaultdict), with every value v replaced by f(k, v). """
+    try:
+        new_obj = obj.copy()
+    except Exception:
+        new_obj = dict(obj)
+
+    for k, v in obj.items():
+        new_obj[k] = f(k, v)
+
+    return new_obj
+
+
+def _extract_arrays(obj, key: str, arrays: dict, min_array_bytes: int):
+    """ Return obj with every large numpy array replaced by an ArrayRef, collecting the arrays in arrays. """
+    if isinstance(obj, dict):
+        return _map_dict(obj, lambda k, v: _extract_arrays(v, f"{key}.{k}" if key else str(k), arrays, min_array_bytes))
+
+    if isinstance(obj, (list, tuple)):
+        items = [_extract_arrays(v, f"{key}.{i}" if key else str(i), arrays, min_array_bytes) for i, v in enumerate(obj)]
+        return items if isinstance(obj, list) else tuple(items)
+
+    if isinstance(obj, np.ndarray) and (obj.dtype != object) and (obj.nbytes >= min_array_bytes):
+        # keys are only used as file names
+        file = f"{len(arrays)}_{key.replace(os.sep, '_')}.npy"
+        arrays[file] = obj
+        return ArrayRef(file, obj.shape, str(obj.dtype))
+
+    return obj
+
+
+def _resolve_arrays(obj, arrays_path: Path, mmap_mode: Optional[str]):
+    """ Return obj with every ArrayRef replaced by its (memory-mapped) array. """
+    if isinstance(obj, ArrayRef):
+        return obj.load(arrays_path, mmap_mode=mmap_mode)
+
+    if isinstance(obj, dict):
+        return _map_dict(obj, lambda k, v: _resolve_arrays(v, arrays_path, mmap_mode))
+
+    if isinstance(obj, (list, tuple)):
+        items = [_resolve_arrays(v, arrays_path, mmap_mode) for v in obj]
+        return items if isinstance(obj, list) else tuple(items)
+
+    return obj
+
+
+def save_results(results, res_file: Path, min_array_bytes: int = DEFAULT_MIN_ARRAY_BYTES) -> None:
+    """
+    Save results to res_file, storing every numpy array of at least min_array_bytes in the arrays folder of
+        res_file so that it can be memory-mapped when the results are loaded.
+    """
+    res_file = Path(res_file)
+    arrays_path = get_arrays_path(res_file)
+
+    arrays = {}
+    results = _extract_arrays(results, "", arrays, min_array_bytes)
+
+    # arrays of a previous save are no longer referenced
+    if arrays_path.exists():
+        for f in os.listdir(arrays_path):
+            if f not in arrays:
+                os.remove(arrays_path / f)
+
+        if len(arrays) == 0:
+            arrays_path.rmdir()
+
+    if len(arrays) > 0:
+        arrays_path.mkdir(parents=True, exist_ok=True)
+
+        for file, array in arrays.items():
+            np.save(arrays_path / file, array, allow_pickle=False)
+
+    tmp_file = res_file.with_name(res_file.name + ".tmp")
+    with open(tmp_file, "wb") as f:
+        pickle.dump(results, f)
+
+    os.replace(tmp_file, res_file)
+
+
+def load_results(res_file: Path, mmap_mode: Optional[str] = "r"):
+    """ Load a results file, memory-mapping the arrays saved by save_results (loaded into memory if mmap_mode is None). """
+    res_file = Path(res_file)
+
+    with open(res_file, "rb") as f:
+        results = pickle.load(f)
+
+    arrays_path = get_arrays_path(res_file)
+    if arrays_path.exists():
+        results = _resolve_arrays(results, arrays_path, mmap_mode)
+
+    return results
+
+
+class ResultHandle:
+    """
+    Proxy of a results file that is only loaded (see load_results) when it is first accessed. Handles of dict results
+        can be indexed as the results themselves, i.e handle['metrics'].
+
+    When a cache (see cache.PayloadCache) is passed the results are loaded through, and held by, the cache.
+    """
+
+    def __init__(self, res_file: Path, mmap_mode: Optional[str] = "r", cache=None):
+        self.path = Path(res_file)
+        self.mmap_mode = mmap_mode
+        self.cache = cache
+
+        self._results = None
+        self._loaded = False
+
+    def __repr__(self):
+        return f"ResultHandle({self.path}, loaded={self._loaded})"
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def load(self):
+        """ Return the results. """
+        if self.cache is not None:
+            self._loaded = True
+            return self.cache.get(self.path, mmap_mode=self.mmap_mode)
+
+        if not self._loaded:
+            self._results = load_results(self.path, mmap_mode=self.mmap_mode)
+            self._loaded = True
+
+        return self._results
+
+    def release(self) -> None:
+        """ Drop the loaded results, they will be loaded again when next accessed. """
+        self._results = None
+        self._loaded = False
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __contains__(self, key):
+        return key in self.load()
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+    def keys(self):
+        return self.load().keys()
+
+    def items(self):
+        return self.load().items()
+
+    def get(self, key, default=None):
+        return self.load().get(key, default)
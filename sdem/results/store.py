@@ -0,0 +1,182 @@
+"""
+Columnar store of the configs and final metrics of every sacred run.
+
+Reading config.json and metrics.json of every run folder each time a results table is built is slow when there
+    are many runs. The store keeps one row per run in a pandas DataFrame (pickled in the sdem tmp folder) with:
+        - a `config.{key}` column for every config key
+        - a `metrics.{key}` column for the last checkpoint of every (flattened) metric
+        - the config and metric keys of the run, so that runs with different keys can be grouped without
+            looking at every row
+        - a signature of config.json and metrics.json
+
+refresh only reads the run folders whose signature has changed, so runs are added to the store as they complete
+    or are synced and the store can be queried directly.
+"""
+import os
+from pathlib import Path
+from typing import List, Optional
+
+import pandas as pd
+
+from ..computation import manager
+from ..computation import run_folders
+
+# name of the store inside the sdem tmp folder
+RESULTS_STORE_FILE = "results_store.pkl"
+
+CONFIG_PREFIX = "config."
+METRICS_PREFIX = "metrics."
+
+SIGNATURE_COLUMN = "_signature"
+CONFIG_KEYS_COLUMN = "_config_keys"
+METRIC_KEYS_COLUMN = "_metric_keys"
+
+
+# run folder files that the store is built from
+RESULTS_FILES = ["config.json", "metrics.json"]
+
+
+def _file_signature(f: Path) -> str:
+    return run_folders.file_signature(f) or "-"
+
+
+def get_results_signature(run_folder: Path) -> str:
+    """ Return a string that changes whenever config.json or metrics.json of run_folder changes. """
+    return _file_signature(run_folder / "config.json") + "|" + _file_signature(run_folder / "metrics.json")
+
+
+def flatten_dict(d: dict, prefix: str = "", sep: str = "_") -> dict:
+    """ Flatten nested dicts, joining keys with sep (as pd.json_normalize). """
+    flat = {}
+    for key, item in d.items():
+        key = f"{prefix}{sep}{key}" if prefix != "" else str(key)
+
+        if isinstance(item, dict) and len(item) > 0:
+            flat.update(flatten_dict(item, prefix=key, sep=sep))
+        else:
+            flat[key] = item
+
+    return flat
+
+
+def get_last_checkpoints(metrics: dict) -> dict:
+    """ Return the flattened last value of every metric. """
+    return flatten_dict({key: item["values"][-1] for key, item in metrics.items()})
+
+
+def get_results_row(run: dict, signature: Optional[str] = None) -> dict:
+    """ Return the row of the store for a run read by run_folders.read_run_folder. """
+    config = run["config"] or {}
+    metrics = run["metrics"] or {}
+
+    if len(metrics) > 0:
+        # When there are multiply checkpoints we use the last one
+        metrics = get_last_checkpoints(metrics)
+
+    row = {
+        SIGNATURE_COLUMN: signature if signature is not None else get_results_signature(run["path"]),
+        CONFIG_KEYS_COLUMN: tuple(config.keys()),
+        METRIC_KEYS_COLUMN: tuple(metrics.keys()),
+    }
+    row.update({CONFIG_PREFIX + k: v for k, v in config.items()})
+    row.update({METRICS_PREFIX + k: v for k, v in metrics.items()})
+
+    return row
+
+
+def read_run_results(run_folder: Path, signature: Optional[str] = None) -> dict:
+    """ Return the row of the store for a single run folder. """
+    return get_results_row(run_folders.read_run_folder(run_folder, RESULTS_FILES), signature)
+
+
+class ResultsStore:
+    def __init__(self, store_path: Path, runs_root: Path):
+        self.store_path = Path(store_path)
+        self.runs_root = Path(runs_root)
+
+        self.df = self._load()
+
+    def _load(self) -> pd.DataFrame:
+        if self.store_path.exists():
+            try:
+                return pd.read_pickle(self.store_path)
+            except Exception:
+                # rebuilt by refresh
+                pass
+
+        return pd.DataFrame(columns=[SIGNATURE_COLUMN, CONFIG_KEYS_COLUMN, METRIC_KEYS_COLUMN], dtype=object)
+
+    def save(self) -> None:
+        self.store_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = self.store_path.with_suffix(".tmp")
+        self.df.to_pickle(tmp_path)
+        os.replace(tmp_path, self.store_path)
+
+    def read_runs(self, to_read: dict) -> List[dict]:
+        """ Return the rows of the runs in to_read (run_id -> (folder, signature)), in the same order. """
+        runs = run_folders.read_run_folders([folder for folder, _ in to_read.values()], RESULTS_FILES)
+
+        return [get_results_row(runs[run_id], signature) for run_id, (_, signature) in to_read.items()]
+
+    def refresh(self) -> "ResultsStore":
+        """ Update the store with any run folders that have been added, changed or removed. """
+        on_disk = run_folders.list_run_folders(self.runs_root)
+
+        stored = self.df[SIGNATURE_COLUMN].to_dict()
+
+        removed = [run_id for run_id in stored.keys() if run_id not in on_disk]
+
+        changed = {}
+        for run_id, run_folder in on_disk.items():
+            signature = get_results_signature(run_folder)
+
+            if stored.get(run_id) != signature:
+                changed[run_id] = (run_folder, signature)
+
+        if (len(removed) == 0) and (len(changed) == 0):
+            return self
+
+        df = self.df.drop(index=removed + [run_id for run_id in changed.keys() if run_id in stored])
+
+        if len(changed) > 0:
+            # object columns so that values are stored exactly as they are in the json files
+            new_df = pd.DataFrame(self.read_runs(changed), index=list(changed.keys()), dtype=object)
+            df = pd.concat([df, new_df]) if len(df) > 0 else new_df
+
+        self.df = df.sort_index()
+        self.save()
+
+        return self
+
+    def get_key_groups(self) -> dict:
+        """ Return a dict from (config keys, metric keys) to the run ids that have them. """
+        groups = {}
+        for run_id, config_keys, metric_keys in zip(self.df.index, self.df[CONFIG_KEYS_COLUMN], self.df[METRIC_KEYS_COLUMN]):
+            groups.setdefault((config_keys, metric_keys), []).append(run_id)
+
+        return groups
+
+    def get_table(self, run_ids: List[int], config_keys: List[str], metric_keys: List[str]) -> pd.DataFrame:
+        """ Return the config_keys and metric_keys of run_ids, with dtypes inferred as if built from python lists. """
+        columns = [CONFIG_PREFIX + k for k in config_keys] + [METRICS_PREFIX + k for k in metric_keys]
+
+        rows = self.df.loc[run_ids, columns].values.tolist()
+
+        return pd.DataFrame(rows, columns=list(config_keys) + list(metric_keys))
+
+    def get_configs(self) -> List[dict]:
+        """ Return the config of every run. """
+        configs = []
+        for run_id, row in self.df.iterrows():
+            configs.append({k: row[CONFIG_PREFIX + k] for k in row[CONFIG_KEYS_COLUMN]})
+
+        return configs
+
+
+def get_results_store(experiment_config, exp_root=None) -> ResultsStore:
+    """ Return the results store of the experiment, updated with any runs that have changed since it was last used. """
+    store_path = manager.get_tmp_folder_path(experiment_config, exp_root=exp_root) / RESULTS_STORE_FILE
+    runs_root = manager.get_sacred_runs_path(experiment_config, exp_root=exp_root)
+
+    return ResultsStore(store_path, runs_root).refresh()
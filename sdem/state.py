@@ -11,13 +11,21 @@ help_texts = {
     "filter": "",
     "filter_file": "",
     "observer": "Run experiment with a sacred observer",
+    "no_cache": "Always re-import model files instead of using cached configs",
+    "load_workers": "Number of worker processes used to load model files",
 }
 
 class State:
-    def __init__(self, verbose=False, dry=False, root = None):
+    def __init__(self, verbose=False, dry=False, root = None, no_cache=False, load_workers=1):
         self.verbose = verbose
         self.dry = dry
 
+        # when true model files are always re-imported instead of using the config cache
+        self.no_cache = no_cache
+
+        # number of worker processes used to load model files
+        self.load_workers = load_workers
+
         self.root = root
 
         #TODO stop console print when in verbose mode
@@ -88,5 +96,5 @@ class State:
     def success(self, s: str):
         self.console.print(f'[greeb bold]{s}[/]')
                 
-def get_state(verbose, dry):
-    return State(verbose=verbose, dry=dry)
+def get_state(verbose, dry, no_cache=False, load_workers=1):
+    return State(verbose=verbose, dry=dry, no_cache=no_cache, load_workers=load_workers)
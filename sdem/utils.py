@@ -181,6 +181,48 @@ def dict_is_subset(dict1, dict2):
     return is_subset
 
 
+_MEMORY_UNITS = {"": 1, "b": 1, "k": 1024, "m": 1024 ** 2, "g": 1024 ** 3, "t": 1024 ** 4}
+
+
+def parse_memory(v) -> int:
+    """
+    Convert a memory size to bytes. Numbers are taken to be in megabytes (as in slurm),
+        strings can have a unit suffix i.e 512M, 4G, 4GB.
+    """
+    if isinstance(v, (int, float)):
+        return int(v * _MEMORY_UNITS["m"])
+
+    s = str(v).strip().lower()
+    if s.endswith("b") and len(s) > 1 and s[-2] in _MEMORY_UNITS:
+        s = s[:-1]
+
+    unit = s[-1] if s[-1] in _MEMORY_UNITS else ""
+    number = s[: len(s) - len(unit)]
+
+    if unit == "":
+        # no unit, assume megabytes
+        return int(float(number) * _MEMORY_UNITS["m"])
+
+    return int(float(number) * _MEMORY_UNITS[unit])
+
+
+def format_memory(n_bytes: int) -> str:
+    """ Human readable memory size. """
+    for unit in ["B", "K", "M", "G"]:
+        if abs(n_bytes) < 1024:
+            return f"{n_bytes:.1f}{unit}"
+        n_bytes = n_bytes / 1024
+    return f"{n_bytes:.1f}T"
+
+
+def get_total_memory() -> int:
+    """ Total physical memory of this machine in bytes. """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
 def get_dict_without_key(_dict, key):
     return {i: _dict[i] for i in _dict if i != key}
 
@@ -238,104 +280,114 @@ class Split():
     pass
 
 def get_all_permutations(options):
+    """
+    Return a list of every config defined by options. See iter_all_permutations.
+    """
+    return list(iter_all_permutations(options))
+
+
+def iter_all_permutations(options):
+    """
+    Lazily construct every config defined by options:
+        - a dict of lists is expanded into the cartesian product of its values
+        - a list of options is the concatenation of the configs of each element
+        - a Split key is replaced by each of its configs, which are then expanded
+
+    Configs are only constructed as they are iterated over so this can be used for very large sweeps.
+    """
     # python passes dicts around by reference, this can cause some issues as we are looping over the dicts and editing them
-    # therefore create a deep copy to break the reference
+    # therefore create a deep copy to break the reference. Options are never edited below, and the branches of a
+    # Split are copied as they are expanded.
     options = copy.deepcopy(options)
 
+    return _iter_permutations(options)
+
+
+def _iter_permutations(options):
     if type(options) is list:
-        dict_list = []
         for opt in options:
-            dict_list = dict_list + get_all_permutations(opt)
+            yield from _iter_permutations(opt)
+
+        return
+
+    # check if any Split keys
+    split_key = next((k for k in options.keys() if isinstance(k, Split)), None)
 
-        return dict_list
+    if split_key is not None:
+        # for each split we construct a config, one for each element in the split
+        # We recursively apply split each element
+        options_without_split = {k: v for k, v in options.items() if k is not split_key}
+
+        for _config in options[split_key]:
+            # each branch gets its own copy so that configs of different branches do not share values
+            new_config = add_dicts([options_without_split, _config], deepcopy=True)
+            yield from _iter_permutations(new_config)
     else:
-        # check if any Split keys
-        if any([isinstance(k, Split) for k in options.keys()]):
-            # for each split we construct an array of configs, one for each element in the split
-            # We recursively apply split each element
-
-            option_list = []
-
-            options_copy = copy.deepcopy(options)
-
-            for k in options_copy.keys():
-                if isinstance(k, Split):
-                    # split
-                    config_to_split = options_copy.pop(k)
-                    for _config in config_to_split:
-                        new_config = add_dicts(
-                            [
-                                options_copy,
-                                _config
-                            ],
-                            deepcopy=True
-                        )
-                        option_list.append(new_config)
+        # get all permutations of options
+        keys, values = zip(*options.items())
+        for v in itertools.product(*values):
+            yield dict(zip(keys, v))
 
-                    break
 
-            return get_all_permutations(option_list)
-        else:
-            # get all permutations of options
-            keys, values = zip(*options.items())
-            permutations_dicts = [dict(zip(keys, v)) for v in itertools.product(*values)]
-            return permutations_dicts
+# extensions of files that are already compressed and so are stored without compressing again
+INCOMPRESSIBLE_EXTENSIONS = {
+    ".npy", ".npz", ".pickle", ".pkl", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".zst", ".7z",
+    ".png", ".jpg", ".jpeg", ".gif", ".mp4", ".pt", ".pth", ".h5", ".hdf5", ".parquet", ".sif",
+}
+
+
+def is_incompressible(f) -> bool:
+    return os.path.splitext(str(f))[1].lower() in INCOMPRESSIBLE_EXTENSIONS
 
 
 def zip_dir(path, zipf, ignore_dir_arr=None, dir_path=None):
     """
     Path can be something like ../../folder_1/folder_2/lib/*
     we strip all leading directory structure and zip only lib/*
+
+    Ignored folders are not walked and files that are already compressed are stored as they are.
     """
-    # target_dir = os.path.basename(os.path.normpath(path))
+    for f, target in iter_dir_files(path, ignore_dir_arr=ignore_dir_arr, dir_path=dir_path, include_dirs=True):
+        if os.path.isdir(f):
+            zipf.write(f, target)
+        elif is_incompressible(f):
+            zipf.write(f, target, compress_type=zipfile.ZIP_STORED)
+        else:
+            zipf.write(f, target)
 
-    path_split = os.path.normpath(path).split(os.sep)
 
-    if dir_path is None:
-        dir_path = ""
+def iter_dir_files(path, ignore_dir_arr=None, dir_path=None, include_dirs=False):
+    """
+    Yield (file, target) for every file in path, where target is the path of the file as it is zipped
+        by zip_dir (i.e ../../folder_1/lib/a.py -> lib/a.py). If dir_path is passed it replaces the
+        top level folder. Folders that start with any of ignore_dir_arr are not walked, and are
+        only yielded themselves when include_dirs is true.
+    """
+    path_split = os.path.normpath(path).split(os.sep)
 
     for root, dirs, files in os.walk(path):
-        for folder_name in dirs:
-            if ignore_dir_arr is not None:
-                ignore_flag = False
-                for ignore_dir in ignore_dir_arr:
-                    # if the root starts with ignore dir then we do not want to zip it
-                    if str(root).startswith(ignore_dir):
-                        ignore_flag = True
-                if ignore_flag:
-                    # do not zip this dir
-                    continue
-
-            # remove leading directory structure
-            root_split = os.path.normpath(root).split(os.sep)
-            if dir_path:
-                target_dir = dir_path
-            else:
-                target_dir = os.path.join(*root_split[(len(path_split) - 1) :])
+        all_dirs = list(dirs)
 
-            zipf.write(
-                os.path.join(root, folder_name), os.path.join(target_dir, folder_name)
-            )
+        if ignore_dir_arr is not None:
+            # prune ignored folders so that os.walk does not descend into them
+            dirs[:] = [
+                d for d in dirs
+                if not any(str(os.path.join(root, d)).startswith(ignore_dir) for ignore_dir in ignore_dir_arr)
+            ]
 
-        for f in files:
-            if ignore_dir_arr is not None:
-                ignore_flag = False
-                for ignore_dir in ignore_dir_arr:
-                    # if the root starts with ignore dir then we do not want to zip it
-                    if str(root).startswith(ignore_dir):
-                        ignore_flag = True
-                if ignore_flag:
-                    # do not zip this dir
-                    continue
-
-            # remove leading directory structure
-            root_split = os.path.normpath(root).split(os.sep)
-            if dir_path:
-                target_dir = dir_path
-            else:
-                target_dir = os.path.join(*root_split[(len(path_split) - 1) :])
+        # remove leading directory structure
+        root_split = os.path.normpath(root).split(os.sep)
+        target_dir = os.path.join(*root_split[(len(path_split) - 1) :])
+
+        if dir_path:
+            target_dir = os.path.join(dir_path, *root_split[len(path_split) :])
 
-            zipf.write(os.path.join(root, f), str(os.path.join(target_dir, f)))
+        if include_dirs:
+            for d in all_dirs:
+                yield os.path.join(root, d), str(os.path.join(target_dir, d))
+
+        for f in files:
+            yield os.path.join(root, f), str(os.path.join(target_dir, f))
 
 
 def ensure_backslash(s):
@@ -365,6 +417,84 @@ def pass_unknown_kargs(unknown_args) -> dict:
         for i in ind
     }
 
+def parse_order_ids(s: str) -> typing.Optional[typing.List[int]]:
+    """
+    Parse the order ids passed to a model file. Supports:
+        -1: all configs, returns None
+        3: a single id
+        1,4,7: a comma separated list of ids
+        2-5: an inclusive range of ids (can be combined with lists i.e 1,4-6)
+    """
+    s = str(s).strip()
+
+    if s == "-1":
+        return None
+
+    order_ids = []
+    for part in s.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+
+        if "-" in part[1:]:
+            start, end = part.split("-", 1)
+            order_ids += list(range(int(start), int(end) + 1))
+        else:
+            order_ids.append(int(part))
+
+    return order_ids
+
+def format_order_ids(order_ids: typing.List[int]) -> str:
+    """ Inverse of parse_order_ids. Runs of consecutive ids are written as ranges i.e [1, 2, 3, 7] -> 1-3,7 """
+    parts = []
+
+    i = 0
+    while i < len(order_ids):
+        j = i
+        while (j + 1 < len(order_ids)) and (order_ids[j + 1] == order_ids[j] + 1):
+            j += 1
+
+        if j == i:
+            parts.append(str(order_ids[i]))
+        else:
+            parts.append(f"{order_ids[i]}-{order_ids[j]}")
+
+        i = j + 1
+
+    return ",".join(parts)
+
+def record_progress(progress_file, line: str) -> None:
+    """ Append line to progress_file, making sure it is written to disk in case the process then crashes. """
+    if progress_file is None:
+        return
+
+    with open(progress_file, 'a') as f:
+        f.write(line + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_progress(progress_file) -> dict:
+    """
+    Read a progress file written by Experiment.run_order_ids. Returns a dict from each order_id that was
+        started to its status, which is None if the experiment never finished.
+    """
+    progress = {}
+
+    if not os.path.exists(progress_file):
+        return progress
+
+    with open(progress_file) as f:
+        for line in f:
+            parts = line.split()
+
+            if len(parts) == 2 and parts[0] == 'start':
+                progress[int(parts[1])] = None
+            elif len(parts) == 3 and parts[0] == 'end':
+                progress[int(parts[1])] = parts[2]
+
+    return progress
+
 def flatten(xs):
     """
     Flatten a mixed-depth list into a single depth flat list 
@@ -0,0 +1,23 @@
+import numpy as np
+
+from sdem.computation.config_index import ConfigIndex
+from sdem.utils import dict_is_subset
+
+
+def _matches(configs, _filter):
+    return [i for i, config in enumerate(configs) if dict_is_subset(_filter, config)]
+
+
+def test_array_valued_configs():
+    configs = [
+        {"a": 1, "x": np.zeros(3)},
+        {"a": 2, "x": np.zeros(3)},
+        {"a": 3, "x": [np.ones(2), np.ones(2)]},
+        {"a": [1, 2], "x": np.zeros(1)},
+    ]
+    index = ConfigIndex(configs)
+
+    for _filter in [{"a": 1}, {"a": [1, 2]}, {"a": [2, 3]}, {}]:
+        assert index.query(_filter) == _matches(configs, _filter)
+
+    assert index.filter({"a": 1}) == [configs[0]]